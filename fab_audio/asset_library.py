@@ -0,0 +1,351 @@
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+import numpy as np
+import soundfile as sf
+from pydub import AudioSegment
+from scipy.signal import resample_poly
+
+from fab_audio.loop_points import find_loop_points
+from fab_audio.loudness import integrated_loudness
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the index is not locked across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Canonical layout every library asset is decoded to
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+LIBRARY_DIRS = ["data/sfx", "data/bg_music", "data/misc"]
+
+# Assets that are looped under a story, analyzed for seamless loop points
+LOOP_DIRS = ["data/bg_music"]
+
+# Files read straight through libsndfile instead of an ffmpeg subprocess
+PCM_EXTENSIONS = {".wav", ".flac"}
+
+
+def decode_audio_file(file_path: str) -> AudioSegment:
+    """
+    Decode an audio file with fallback to explicit codec if needed.
+
+    Args:
+        file_path: Path to the audio file
+
+    Returns:
+        AudioSegment object
+    """
+    try:
+        return AudioSegment.from_file(file_path)
+    except Exception as e:
+        try:
+            return AudioSegment.from_file(file_path, format="wav", codec="adpcm_ms")
+        except Exception as inner_e:
+            raise Exception(f"Failed to load audio file {file_path}: {str(e)}, then tried with codec: {str(inner_e)}")
+
+
+def segment_to_array(segment: AudioSegment) -> np.ndarray:
+    """Convert an AudioSegment to an int16 (frames, CHANNELS) array at SAMPLE_RATE."""
+    segment = segment.set_frame_rate(SAMPLE_RATE).set_channels(CHANNELS).set_sample_width(2)
+    return np.frombuffer(segment.raw_data, dtype=np.int16).reshape(-1, CHANNELS)
+
+
+def read_pcm_file(file_path: str) -> Optional[np.ndarray]:
+    """
+    Read a WAV or FLAC file to an int16 (frames, CHANNELS) array at SAMPLE_RATE without ffmpeg.
+
+    Returns:
+        The samples, or None if the file needs the ffmpeg decoder
+    """
+    if os.path.splitext(file_path)[1].lower() not in PCM_EXTENSIONS:
+        return None
+    try:
+        samples, rate = sf.read(file_path, dtype="int16", always_2d=True)
+    except RuntimeError:
+        return None
+    if samples.shape[1] == 1:
+        samples = np.repeat(samples, CHANNELS, axis=1)
+    elif samples.shape[1] != CHANNELS:
+        return None
+    if rate != SAMPLE_RATE:
+        divisor = math.gcd(rate, SAMPLE_RATE)
+        resampled = resample_poly(samples.astype(np.float32), SAMPLE_RATE // divisor, rate // divisor, axis=0)
+        samples = np.clip(np.round(resampled), -32768, 32767).astype(np.int16)
+    return samples
+
+
+def array_to_segment(samples: np.ndarray) -> AudioSegment:
+    """Wrap an int16 (frames, CHANNELS) array at SAMPLE_RATE in an AudioSegment."""
+    return AudioSegment(
+        data=np.ascontiguousarray(samples, dtype=np.int16).tobytes(),
+        sample_width=2,
+        frame_rate=SAMPLE_RATE,
+        channels=CHANNELS,
+    )
+
+
+class AssetLibrary:
+    """
+    Pre-decoded copies of the sound library (data/sfx, data/bg_music, data/misc).
+
+    `ingest` decodes every asset once to int16 PCM at SAMPLE_RATE/CHANNELS and
+    stores it as a .npy file next to a JSON index. The mixer then memory-maps
+    those files instead of running ffmpeg for every story; the mapped pages
+    live in the OS page cache and are shared by all worker processes.
+
+    Mix workers also update the index, when they measure an asset ingested
+    before loudness or loop points were recorded, so the index file is only
+    rewritten under a lock and merged with what is on disk.
+    """
+
+    def __init__(self, cache_dir: str = "data/decoded"):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock_path = os.path.join(cache_dir, "index.lock")
+        self._lock = threading.Lock()
+        self._index: Optional[dict] = None
+        self._arrays: dict[str, np.ndarray] = {}
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            self._index = self._read_index()
+        return self._index
+
+    def _read_index(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @contextmanager
+    def _index_lock(self):
+        """Exclusive lock on the index file, held across processes."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _save_index(self, updated: Dict[str, dict]):
+        """
+        Write the `updated` entries to the index file. The file is read again
+        under the lock, so entries other processes added or measured since it
+        was loaded are kept; for the same decoded asset their fields are merged.
+        """
+        with self._index_lock():
+            index = self._read_index()
+            for file_path, entry in updated.items():
+                current = index.get(file_path)
+                if current is not None and current["npy"] == entry["npy"] and current["mtime"] == entry["mtime"]:
+                    entry = {**current, **entry}
+                index[file_path] = entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".index-", suffix=".json")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(index, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        self._index = index
+
+    @staticmethod
+    def _npy_name(file_path: str) -> str:
+        # The extension is kept, so bark.mp3 and bark.wav don't share a file
+        return os.path.normpath(file_path).replace(os.sep, "__") + ".npy"
+
+    def _entry(self, file_path: str) -> Optional[dict]:
+        """Index entry of an asset, or None if it was never ingested or changed since."""
+        entry = self.index.get(os.path.normpath(file_path))
+        if entry is None or entry["npy"] != self._npy_name(file_path):
+            # Decoded under a name another asset may have overwritten
+            return None
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        if stat.st_mtime != entry["mtime"] or stat.st_size != entry["size"]:
+            return None
+        return entry
+
+    def ingest(self, dirs: List[str] = LIBRARY_DIRS, force: bool = False) -> int:
+        """
+        Decode every new or changed asset in `dirs`.
+
+        Returns:
+            Number of assets decoded
+        """
+        updated = {}
+        with self._lock:
+            for directory in dirs:
+                if not os.path.isdir(directory):
+                    logger.warning(f"Asset directory not found: {directory}")
+                    continue
+                for fname in sorted(os.listdir(directory)):
+                    file_path = os.path.normpath(os.path.join(directory, fname))
+                    if os.path.isdir(file_path) or (not force and self._entry(file_path) is not None):
+                        continue
+                    updated[file_path] = self._decode(file_path)
+                    self._arrays.pop(file_path, None)
+            if updated:
+                self._save_index(updated)
+        decoded = len(updated)
+        logger.info(f"Asset library: decoded {decoded} assets, {len(self.index)} in index")
+        return decoded
+
+    def _decode(self, file_path: str) -> dict:
+        samples = read_pcm_file(file_path)
+        if samples is None:
+            samples = segment_to_array(decode_audio_file(file_path))
+        npy_name = self._npy_name(file_path)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.save(os.path.join(self.cache_dir, npy_name), samples)
+        stat = os.stat(file_path)
+        loudness = integrated_loudness(samples, SAMPLE_RATE)
+        entry = {
+            "npy": npy_name,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "frames": len(samples),
+            "sample_rate": SAMPLE_RATE,
+            "channels": CHANNELS,
+            "duration_ms": round(len(samples) * 1000 / SAMPLE_RATE),
+            "loudness_lufs": loudness if math.isfinite(loudness) else None,
+        }
+        if self._is_loop_asset(file_path):
+            entry["loop"] = find_loop_points(samples, SAMPLE_RATE)
+        return entry
+
+    @staticmethod
+    def _is_loop_asset(file_path: str) -> bool:
+        # Matched by directory name, so a library ingested from another root works too
+        directory = os.path.basename(os.path.dirname(os.path.normpath(file_path)))
+        return any(directory == os.path.basename(os.path.normpath(loop_dir)) for loop_dir in LOOP_DIRS)
+
+    def load(self, file_path: str) -> Optional[np.ndarray]:
+        """
+        Memory-mapped int16 (frames, CHANNELS) samples of an ingested asset.
+
+        Returns:
+            None if the asset is not in the library or changed since ingestion
+        """
+        key = os.path.normpath(file_path)
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return None
+            if key not in self._arrays:
+                self._arrays[key] = np.load(os.path.join(self.cache_dir, entry["npy"]), mmap_mode="r")
+            return self._arrays[key]
+
+    def load_segment(self, file_path: str) -> Optional[AudioSegment]:
+        """Ingested asset as an AudioSegment, without running a decoder."""
+        samples = self.load(file_path)
+        return array_to_segment(samples) if samples is not None else None
+
+    def duration_ms(self, file_path: str) -> Optional[int]:
+        entry = self._entry(file_path)
+        return entry["duration_ms"] if entry is not None else None
+
+    def loudness(self, file_path: str) -> Optional[float]:
+        """
+        Integrated loudness (LUFS) of an ingested asset, None if it is silent
+        or not in the library. Entries from before loudness was recorded are
+        measured once and the index is updated.
+        """
+        entry = self._entry(file_path)
+        if entry is None:
+            return None
+        if "loudness_lufs" not in entry:
+            loudness = integrated_loudness(self.load(file_path), SAMPLE_RATE)
+            entry = dict(entry, loudness_lufs=loudness if math.isfinite(loudness) else None)
+            with self._lock:
+                self._save_index({os.path.normpath(file_path): entry})
+        return entry["loudness_lufs"]
+
+    def loop_points(self, file_path: str) -> Optional[dict]:
+        """
+        Seamless loop region of an ingested bg_music asset, see `find_loop_points`.
+        None for other assets and for tracks too short to analyze. Entries
+        from before loop points were recorded are analyzed once.
+        """
+        entry = self._entry(file_path)
+        if entry is None or not self._is_loop_asset(file_path):
+            return None
+        if "loop" not in entry:
+            points = find_loop_points(self.load(file_path), SAMPLE_RATE)
+            entry = dict(entry, loop=points)
+            with self._lock:
+                self._save_index({os.path.normpath(file_path): entry})
+        return entry["loop"]
+
+
+T = TypeVar("T")
+
+
+class DecodeCache(Generic[T]):
+    """
+    Decoded files of one mix, keyed by path and mtime.
+
+    A mix peeks at the next segment in several modes and often repeats the
+    same SFX, so without this the same file is decoded several times per
+    story. Create one cache per mix so memory is released when it finishes.
+    """
+
+    def __init__(self, decode: Callable[[str], T]):
+        self.decode = decode
+        self._entries: Dict[Tuple[str, float], T] = {}
+        self._lock = threading.Lock()
+        self.decodes = 0
+        self.hits = 0
+        self.decode_seconds = 0.0
+
+    def get(self, file_path: str) -> T:
+        key = (os.path.normpath(file_path), os.path.getmtime(file_path))
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+        start = time.perf_counter()
+        value = self.decode(file_path)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.decodes += 1
+            self.decode_seconds += elapsed
+            return self._entries.setdefault(key, value)
+
+    def discard(self, file_path: str):
+        """Drop a file that won't be needed again in this mix."""
+        file_path = os.path.normpath(file_path)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == file_path]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"decodes": self.decodes, "hits": self.hits, "decode_seconds": round(self.decode_seconds, 3)}
+
+    def log_stats(self, label: str = "mix"):
+        stats = self.stats()
+        logger.info(
+            f"Decode cache for {label}: {stats['decodes']} files decoded in {stats['decode_seconds']}s, "
+            f"{stats['hits']} repeated loads skipped"
+        )
+
+
+asset_library = AssetLibrary(os.getenv("ASSET_CACHE_DIR", "data/decoded"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asset_library.ingest(force="--force" in sys.argv)
@@ -0,0 +1,132 @@
+import json
+import os
+
+import numpy as np
+import soundfile as sf
+
+from fab_audio import asset_library
+from fab_audio.asset_library import CHANNELS, SAMPLE_RATE, AssetLibrary, DecodeCache, read_pcm_file
+
+
+def write_wav(path, seconds=0.5, rate=22050):
+    t = np.arange(int(seconds * rate)) / rate
+    sf.write(str(path), 0.5 * np.sin(2 * np.pi * 440 * t), rate, subtype="PCM_16")
+    return str(path)
+
+
+def test_ingest_decodes_to_canonical_layout(tmp_path):
+    os.makedirs(tmp_path / "sfx")
+    asset = write_wav(tmp_path / "sfx" / "bark.wav")
+    library = AssetLibrary(str(tmp_path / "decoded"))
+
+    assert library.ingest([str(tmp_path / "sfx")]) == 1
+    samples = library.load(asset)
+
+    assert isinstance(samples, np.memmap)
+    assert samples.dtype == np.int16
+    assert samples.shape[1] == CHANNELS
+    assert abs(len(samples) - SAMPLE_RATE // 2) <= 2
+    assert library.duration_ms(asset) == 500
+    assert len(library.load_segment(asset)) == 500
+    # 440 Hz sine at -6 dBFS peak on both channels; K-weighting is ~0.7 dB lower there than at 1 kHz
+    assert abs(library.loudness(asset) - (-6.7)) < 0.2
+
+
+def test_ingest_skips_unchanged_assets(tmp_path):
+    os.makedirs(tmp_path / "sfx")
+    asset = write_wav(tmp_path / "sfx" / "bark.wav")
+    AssetLibrary(str(tmp_path / "decoded")).ingest([str(tmp_path / "sfx")])
+
+    library = AssetLibrary(str(tmp_path / "decoded"))
+    assert library.ingest([str(tmp_path / "sfx")]) == 0
+
+    write_wav(asset, seconds=1.0)
+    os.utime(asset, (0, 0))
+    assert library.load(asset) is None
+    assert library.ingest([str(tmp_path / "sfx")]) == 1
+    assert library.duration_ms(asset) == 1000
+
+
+def test_unknown_assets_are_not_loaded(tmp_path):
+    library = AssetLibrary(str(tmp_path / "decoded"))
+    assert library.load(str(tmp_path / "missing.mp3")) is None
+
+
+def test_decode_cache_decodes_each_file_once(tmp_path):
+    asset = write_wav(tmp_path / "bark.wav")
+    decoded = []
+    cache = DecodeCache(lambda path: decoded.append(path) or len(decoded))
+
+    assert cache.get(asset) == cache.get(str(tmp_path / "." / "bark.wav")) == 1
+    assert cache.stats()["decodes"] == 1
+    assert cache.stats()["hits"] == 1
+
+    os.utime(asset, (0, 0))
+    assert cache.get(asset) == 2
+    assert cache.stats()["decodes"] == 2
+
+
+def test_only_bg_music_gets_loop_points(tmp_path):
+    for directory in ("sfx", "bg_music"):
+        os.makedirs(tmp_path / directory)
+    bark = write_wav(tmp_path / "sfx" / "bark.wav", seconds=5)
+    theme = write_wav(tmp_path / "bg_music" / "theme.wav", seconds=5)
+    library = AssetLibrary(str(tmp_path / "decoded"))
+    library.ingest([str(tmp_path / "sfx"), str(tmp_path / "bg_music")])
+
+    assert library.loop_points(bark) is None
+    points = library.loop_points(theme)
+    assert 0 <= points["crossfade"] <= points["loop_start"] < points["loop_end"] <= 5 * SAMPLE_RATE
+    # Recorded in the index, so later runs don't analyze the track again
+    assert AssetLibrary(str(tmp_path / "decoded")).index[os.path.normpath(theme)]["loop"] == points
+
+
+def test_pcm_segments_are_read_without_ffmpeg(tmp_path, monkeypatch):
+    def no_ffmpeg(*args, **kwargs):
+        raise AssertionError("ffmpeg decode")
+
+    monkeypatch.setattr(asset_library.AudioSegment, "from_file", no_ffmpeg)
+    # What the TTS stage writes for pcm16: 24 kHz mono int16
+    segment = write_wav(tmp_path / "0.wav", seconds=1.0, rate=24000)
+
+    samples = read_pcm_file(segment)
+
+    assert samples.dtype == np.int16
+    assert samples.shape == (SAMPLE_RATE, CHANNELS)
+    assert np.array_equal(samples[:, 0], samples[:, 1])
+    assert 16000 < np.abs(samples).max() < 16500
+    assert read_pcm_file(str(tmp_path / "0.mp3")) is None
+
+
+def test_assets_differing_in_extension_are_kept_apart(tmp_path):
+    os.makedirs(tmp_path / "sfx")
+    wav = write_wav(tmp_path / "sfx" / "bark.wav", seconds=0.5)
+    flac = str(tmp_path / "sfx" / "bark.flac")
+    sf.write(flac, np.zeros(22050), 22050, format="FLAC")
+    library = AssetLibrary(str(tmp_path / "decoded"))
+
+    assert library.ingest([str(tmp_path / "sfx")]) == 2
+    assert np.abs(library.load(wav)).max() > 0
+    assert np.abs(library.load(flac)).max() == 0
+
+
+def test_measurements_from_several_processes_are_merged(tmp_path):
+    os.makedirs(tmp_path / "sfx")
+    assets = [write_wav(tmp_path / "sfx" / f"{name}.wav") for name in ("bark", "meow")]
+    AssetLibrary(str(tmp_path / "decoded")).ingest([str(tmp_path / "sfx")])
+    # An index from before loudness was recorded
+    index_path = tmp_path / "decoded" / "index.json"
+    index = json.loads(index_path.read_text())
+    for entry in index.values():
+        del entry["loudness_lufs"]
+    index_path.write_text(json.dumps(index))
+
+    # Two mix workers, each with its own copy of the index, measure one asset each
+    workers = [AssetLibrary(str(tmp_path / "decoded")) for _ in assets]
+    for worker in workers:
+        assert len(worker.index) == 2
+    for worker, asset in zip(workers, assets):
+        assert worker.loudness(asset) is not None
+
+    saved = json.loads(index_path.read_text())
+    assert all("loudness_lufs" in entry for entry in saved.values())
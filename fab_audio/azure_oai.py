@@ -1,12 +1,17 @@
 import os
 import base64
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import Collection, Iterable, List, Optional, Tuple
 import logging
-from openai import APIError
+import numpy as np
+import soundfile as sf
 from dotenv import load_dotenv
 from openai import AzureOpenAI
+from fab_audio.coalesce import group_segments, join_segments, split_audio
+from fab_audio.tts_cache import SegmentCache
+from fab_audio.rate_limiter import estimate_tokens, get_rate_limiter
 
 # Load environment variables
 load_dotenv()
@@ -18,9 +23,23 @@ logger = logging.getLogger(__name__)
 client = AzureOpenAI(
     api_key=os.getenv("AUDIO_AZURE_OPENAI_API_KEY"),
     api_version="2025-02-01-preview",
-    azure_endpoint=os.getenv("AUDIO_AZURE_OPENAI_ENDPOINT")
+    azure_endpoint=os.getenv("AUDIO_AZURE_OPENAI_ENDPOINT"),
+    # Retries and backoff are handled by the shared rate limiter
+    max_retries=0
 )
 model = os.getenv("AUDIO_AZURE_OPENAI_DEPLOYMENT", "gpt-4o-audio-preview")
+rate_limiter = get_rate_limiter(model)
+
+# File extension of the segments for each audio format the API can return. pcm16 is
+# raw 24 kHz mono PCM, stored in a WAV container so the mixer reads it without ffmpeg.
+SEGMENT_EXTENSIONS = {"mp3": "mp3", "wav": "wav", "pcm16": "wav"}
+PCM16_SAMPLE_RATE = 24000
+
+# Shared across stories so repeated text (openings, titles, re-tagged stories) is synthesized once
+segment_cache = SegmentCache(
+    os.getenv("TTS_CACHE_DIR", "out/tts_cache"),
+    max_bytes=int(os.getenv("TTS_CACHE_MAX_MB", "2048")) * 1024 * 1024
+)
     
 INSTRUCTIONS="""
 Read the children's story with lively, expressive emotions, creating an engaging, fun, and captivating experience for young listeners.
@@ -60,6 +79,56 @@ Guidelines:
 - Remember, your task is to read the text, not expand it. For any user provided text, just read it out.
 """
 
+def save_audio_stream(chunks: Iterable, file_path: str) -> str:
+    """
+    Append the pcm16 audio deltas of a streamed chat completion to a WAV file as they arrive.
+
+    The audio goes to `<file_path>.part`, which is moved into place once the
+    response has finished normally, so an interrupted stream never leaves a
+    file that passes for a finished segment. Streaming saves holding the whole
+    response in memory; nothing downstream sees the segment before it is done.
+
+    Returns:
+        The transcript of the audio
+    """
+    tmp_path = f"{file_path}.part"
+    transcript = []
+    pending = b""
+    frames = 0
+    finish_reason = None
+    try:
+        with sf.SoundFile(
+            tmp_path, "w", samplerate=PCM16_SAMPLE_RATE, channels=1, format="WAV", subtype="PCM_16"
+        ) as out:
+            for chunk in chunks:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                audio = choice.delta.audio
+                if audio is None:
+                    continue
+                if audio.transcript:
+                    transcript.append(audio.transcript)
+                if audio.data:
+                    # A delta may end in the middle of a sample
+                    data = pending + base64.b64decode(audio.data)
+                    whole = len(data) // 2 * 2
+                    out.write(np.frombuffer(data[:whole], dtype=np.int16))
+                    out.flush()
+                    frames += whole // 2
+                    pending = data[whole:]
+        if finish_reason != "stop":
+            raise RuntimeError(f"Audio stream ended with finish_reason {finish_reason}")
+        if frames == 0:
+            raise RuntimeError("Audio stream carried no audio")
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return "".join(transcript)
+
+
 def generate_audio(
     text: str, 
     output_dir: str, 
@@ -67,41 +136,91 @@ def generate_audio(
     voice: str = "alloy",
     format: str = "mp3",
     max_retries: int = 3,
-    retry_delay: int = 2
+    retry_delay: int = 2,
+    cache: Optional[SegmentCache] = segment_cache,
+    stream: bool = False,
+    refresh: bool = False,
+    cache_stats: Optional[dict] = None
 ) -> Optional[str]:
     """
     Generate audio from text using Azure OpenAI's GPT-4o-audio model.
+
+    See generate_audio_with_transcript for the arguments.
+
+    Returns:
+        Path to the generated audio file or None if failed
+    """
+    return generate_audio_with_transcript(
+        text, output_dir, file_name, voice, format, max_retries, retry_delay, cache, stream, refresh, cache_stats
+    )[0]
+
+
+def generate_audio_with_transcript(
+    text: str, 
+    output_dir: str, 
+    file_name: str,
+    voice: str = "alloy",
+    format: str = "mp3",
+    max_retries: int = 3,
+    retry_delay: int = 2,
+    cache: Optional[SegmentCache] = segment_cache,
+    stream: bool = False,
+    refresh: bool = False,
+    cache_stats: Optional[dict] = None
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Generate audio from text and return the transcript of what was read along with it.
     
     Args:
         text: The text to convert to speech
         output_dir: Directory to save the audio file
         file_name: Name of the output file (without extension)
         voice: Voice to use (default: "alloy")
-        format: Audio format (default: "mp3")
+        format: Audio format requested from the API, one of SEGMENT_EXTENSIONS (default: "mp3");
+            "wav" and "pcm16" are lossless and skip the mp3 encode/decode round trip
         max_retries: Maximum number of retry attempts
         retry_delay: Delay between retries in seconds
+        cache: Segment cache consulted before calling the API, None to disable
+        stream: Stream the response and append the audio to the file as it arrives
+            instead of decoding it once complete; the API streams pcm16 only
+        refresh: Synthesize the text again even if the cache has it, e.g. to fix a
+            mispronunciation; the new audio replaces the cached entry
+        cache_stats: Dict with "hits" and "misses" to count this lookup in, see SegmentCache.get
         
     Returns:
-        Path to the generated audio file or None if failed
+        (path to the generated audio file or None if failed, transcript of the audio
+        or None if it is not known, e.g. for a cached segment)
     """
     # Create output directory if it doesn't exist
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
     
+    if format not in SEGMENT_EXTENSIONS:
+        raise ValueError(f"Unknown audio format '{format}', expected one of {list(SEGMENT_EXTENSIONS)}")
+    extension = SEGMENT_EXTENSIONS[format]
+    if stream and format != "pcm16":
+        raise ValueError(f"Streamed audio is only available as pcm16, not '{format}'")
+
     # Full path for the output file
     full_file_path = output_path / f"{file_name}"
+
+    if cache is not None:
+        cache_key = SegmentCache.make_key(text, voice, format, model, INSTRUCTIONS)
+        if not refresh and cache.get(cache_key, extension, str(full_file_path), cache_stats):
+            logger.info(f"Loaded cached audio for text: {text}...")
+            return str(full_file_path), None
     
-    
+    # The last error is fed back into the next attempt's prompt
+    err_msg = None
     for attempt in range(max_retries):
         logger.info(f"Generating audio for text: {text}...")
         
-        err_msg = None
         try:
             if err_msg is None:
                 user_msg = f"Read out the following text: {text}"
             else:
                 user_msg = f"Previous error: {err_msg}. Just read out the following text: {text}"
-            completion = client.chat.completions.create(
+            create = lambda user_msg=user_msg: client.chat.completions.with_raw_response.create(
                 model=model,
                 modalities=["text", "audio"],
                 audio={"voice": voice, "format": format},
@@ -114,35 +233,59 @@ def generate_audio(
                         "role": "user",
                         "content": user_msg
                     }
-                ]
+                ],
+                stream=stream
             )
-            
+            tokens = estimate_tokens(INSTRUCTIONS, user_msg, text)
 
-            text = completion.choices[0].message.content
-            if text:
-                print(text)
-            
-            # Decode the base64 audio data
-            audio_bytes = base64.b64decode(completion.choices[0].message.audio.data)
-            # Save the audio file
-            with open(full_file_path, "wb") as f:
-                f.write(audio_bytes)
+            if stream:
+                # The slot is held until the last chunk is written
+                transcript = rate_limiter.call(
+                    create, tokens=tokens, consume=lambda chunks: save_audio_stream(chunks, str(full_file_path))
+                )
+                if transcript:
+                    print(transcript)
+            else:
+                completion = rate_limiter.call(create, tokens=tokens)
+
+                message = completion.choices[0].message
+                transcript = message.audio.transcript or message.content
+                if transcript:
+                    print(transcript)
+                
+                # Decode the base64 audio data
+                audio_bytes = base64.b64decode(message.audio.data)
+                # Save the audio file
+                if format == "pcm16":
+                    samples = np.frombuffer(audio_bytes[:len(audio_bytes) // 2 * 2], dtype=np.int16)
+                    sf.write(str(full_file_path), samples, PCM16_SAMPLE_RATE, format="WAV", subtype="PCM_16")
+                else:
+                    with open(full_file_path, "wb") as f:
+                        f.write(audio_bytes)
             
             logger.info(f"Audio saved to {full_file_path}")
-            return str(full_file_path)
+            if cache is not None:
+                cache.put(cache_key, extension, str(full_file_path))
+            return str(full_file_path), transcript or None
             
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
             err_msg = str(e)
+            if attempt < max_retries - 1:
+                time.sleep(rate_limiter.backoff(attempt, base_delay=retry_delay))
     
-    return None
+    return None, None
 
 def generate_story_audio(
     texts: List[str], 
     out_dir: str = None,
     story_name: str = None,
     voice: str = "alloy",
-    format: str = "mp3"
+    format: str = "mp3",
+    max_workers: int = 1,
+    stream: bool = False,
+    coalesce: bool = False,
+    refresh: Collection[int] = ()
 ) -> List[str]:
     """
     Generate audio files for a list of texts representing a story.
@@ -151,40 +294,123 @@ def generate_story_audio(
         texts: List of text segments to convert to audio
         story_name: Name of the story (used for the output directory)
         voice: Voice to use for all segments
-        format: Audio format for all segments
+        format: Audio format for all segments, see SEGMENT_EXTENSIONS
+        max_workers: Maximum number of segments synthesized at the same time
+        stream: Write each segment as its audio streams in, see generate_audio
+        coalesce: Synthesize runs of short neighbouring segments in one request and
+            split the audio back into per-segment files, see coalesce.group_segments
+        refresh: Indices of segments synthesized again instead of copied from the cache
         
     Returns:
-        List of paths to the generated audio files
+        List of paths to the generated audio files, in segment order
     """
     if out_dir is None:
         out_dir = f"out/{story_name.lower().replace(' ', '_')}"
     os.makedirs(out_dir, exist_ok=True)
+    # Cache hits and misses of this story alone; other stories share the cache at the same time
+    cache_stats = {"hits": 0, "misses": 0}
 
-    generated_files = []
-    
-    for i, text in enumerate(texts):
-        file_name = f"{i}.mp3"
+    extension = SEGMENT_EXTENSIONS[format]
+
+    def process_segment(i: int, text: str, refresh_segment: bool = False) -> Optional[str]:
+        file_name = f"{i}.{extension}"
         logger.info(f"Processing segment {i+1}/{len(texts)} for story '{story_name}'")
         
         if os.path.exists(f"{out_dir}/{file_name}"):
             logger.info(f"Skipping segment {i+1} because it already exists")
-            generated_files.append(f"{out_dir}/{file_name}")
-            continue
+            return f"{out_dir}/{file_name}"
         
         file_path = generate_audio(
             text=text,
             output_dir=out_dir,
             file_name=file_name,
             voice=voice,
-            format=format
+            format=format,
+            stream=stream,
+            refresh=refresh_segment or i in refresh,
+            cache_stats=cache_stats
         )
         
-        if file_path:
-            generated_files.append(file_path)
-        else:
+        if not file_path:
             logger.warning(f"Failed to generate audio for segment {i+1}")
+        return file_path
+
+    def segment_key(i: int) -> str:
+        # The key a request for the segment alone is cached under
+        return SegmentCache.make_key(texts[i], voice, format, model, INSTRUCTIONS)
+
+    def process_run(run: List[int]) -> List[Optional[str]]:
+        # The members of the run were already looked up in the cache
+        if len(run) == 1:
+            return [process_segment(run[0], texts[run[0]], refresh_segment=True)]
+        logger.info(f"Processing segments {run[0]+1}-{run[-1]+1}/{len(texts)} in one request for story '{story_name}'")
+        out_paths = [f"{out_dir}/{i}.{extension}" for i in run]
+
+        # Runs are requested lossless, so mp3 pieces are encoded once when split instead of twice.
+        # The run itself is not cached, its pieces are.
+        run_format = "pcm16" if format == "mp3" else format
+        run_path, transcript = generate_audio_with_transcript(
+            text=join_segments([texts[i] for i in run]),
+            output_dir=out_dir,
+            file_name=f"{run[0]}-{run[-1]}.coalesced.{SEGMENT_EXTENSIONS[run_format]}",
+            voice=voice,
+            format=run_format,
+            cache=None,
+            stream=stream
+        )
+        if not run_path:
+            logger.warning(f"Failed to generate audio for segments {run[0]+1}-{run[-1]+1}")
+            return [None] * len(run)
+        split_audio(run_path, [texts[i] for i in run], out_paths, transcript)
+        os.remove(run_path)
+        if segment_cache is not None:
+            for i, path in zip(run, out_paths):
+                segment_cache.put(segment_key(i), extension, path)
+        return out_paths
+
+    def process_group(group: List[int]) -> List[Optional[str]]:
+        if len(group) == 1:
+            return [process_segment(group[0], texts[group[0]])]
+        paths = {i: f"{out_dir}/{i}.{extension}" for i in group}
+        if all(os.path.exists(path) for path in paths.values()):
+            logger.info(f"Skipping segments {group[0]+1}-{group[-1]+1} because they already exist")
+            return list(paths.values())
+
+        # Every member is cached under its own text, so a story with one edited line
+        # only synthesizes that line again. A piece cut from a run is read in the
+        # flow of its neighbours; it is reused as if it had been read alone.
+        todo = [
+            i for i in group
+            if not os.path.exists(paths[i]) and (
+                segment_cache is None or i in refresh
+                or not segment_cache.get(segment_key(i), extension, paths[i], cache_stats)
+            )
+        ]
+        # The rest is synthesized in runs of neighbouring segments
+        runs = []
+        for i in todo:
+            if runs and runs[-1][-1] == i - 1:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+        for run in runs:
+            for i, path in zip(run, process_run(run)):
+                paths[i] = path
+        return list(paths.values())
+
+    groups = group_segments(texts) if coalesce else [[i] for i in range(len(texts))]
+    if max_workers > 1 and len(groups) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-segment") as executor:
+            # map keeps the results in segment order regardless of completion order
+            results = [path for paths in executor.map(process_group, groups) for path in paths]
+    else:
+        results = [path for group in groups for path in process_group(group)]
+
+    generated_files = [file_path for file_path in results if file_path]
     
     logger.info(f"Generated {len(generated_files)} audio files for story '{story_name}'")
+    if segment_cache is not None:
+        segment_cache.log_stats(cache_stats, label=f"TTS cache for '{story_name}'")
     return generated_files
 
 def main():
@@ -0,0 +1,172 @@
+import base64
+import importlib
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from fab_audio.tts_cache import SegmentCache
+
+
+@pytest.fixture
+def azure_oai(monkeypatch):
+    # The Azure OpenAI client is created when the module is imported
+    monkeypatch.setenv("AUDIO_AZURE_OPENAI_API_KEY", "key")
+    monkeypatch.setenv("AUDIO_AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+    module = importlib.import_module("fab_audio.azure_oai")
+    monkeypatch.setattr(module, "segment_cache", None)
+    return module
+
+
+def test_parallel_segments_keep_their_names_and_order(azure_oai, tmp_path, monkeypatch):
+    texts = ["Once upon a time", "there was a fox", "who liked to sing", "every morning"]
+    out_dir = str(tmp_path / "fox")
+    os.makedirs(out_dir)
+    with open(f"{out_dir}/2.mp3", "wb") as f:
+        f.write(b"kept")
+
+    lock = threading.Lock()
+    running = []
+    overlap = []
+    requested = []
+
+    def generate_audio(text, output_dir, file_name, **kwargs):
+        with lock:
+            requested.append((text, file_name))
+            running.append(file_name)
+            overlap.append(len(running))
+        # Earlier segments take longer, so they finish last
+        time.sleep(0.05 * (len(texts) - texts.index(text)))
+        with open(os.path.join(output_dir, file_name), "wb") as f:
+            f.write(text.encode())
+        with lock:
+            running.remove(file_name)
+        return f"{output_dir}/{file_name}"
+
+    monkeypatch.setattr(azure_oai, "generate_audio", generate_audio)
+    paths = azure_oai.generate_story_audio(texts, out_dir, "The Fox", max_workers=3)
+
+    assert paths == [f"{out_dir}/{i}.mp3" for i in range(4)]
+    # The segment already on disk is neither requested nor overwritten
+    assert sorted(requested) == sorted([(texts[i], f"{i}.mp3") for i in (0, 1, 3)])
+    with open(f"{out_dir}/2.mp3", "rb") as f:
+        assert f.read() == b"kept"
+    assert max(overlap) > 1
+
+
+def test_failed_segments_are_left_out(azure_oai, tmp_path, monkeypatch):
+    def generate_audio(text, output_dir, file_name, **kwargs):
+        return None if text == "fails" else f"{output_dir}/{file_name}"
+
+    monkeypatch.setattr(azure_oai, "generate_audio", generate_audio)
+    out_dir = str(tmp_path / "fox")
+
+    paths = azure_oai.generate_story_audio(["ok", "fails", "ok too"], out_dir, "The Fox", max_workers=2)
+    assert paths == [f"{out_dir}/0.mp3", f"{out_dir}/2.mp3"]
+
+
+def stream_chunks(audio: bytes, cuts, finish_reason="stop", transcript="Once upon a time"):
+    """Chunks of a streamed chat completion carrying `audio` split at the byte offsets `cuts`."""
+    def chunk(finish=None, **audio_fields):
+        audio = SimpleNamespace(**{"data": None, "transcript": None, **audio_fields}) if audio_fields else None
+        delta = SimpleNamespace(audio=audio)
+        return SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=finish)])
+
+    chunks = [SimpleNamespace(choices=[]), chunk(transcript=transcript)]
+    for start, end in zip([0] + cuts, cuts + [len(audio)]):
+        chunks.append(chunk(data=base64.b64encode(audio[start:end]).decode()))
+    chunks.append(chunk(finish=finish_reason))
+    return chunks
+
+
+def test_stream_is_written_across_odd_chunk_boundaries(azure_oai, tmp_path):
+    samples = np.arange(-500, 500, dtype=np.int16)
+    path = str(tmp_path / "0.wav")
+
+    # Every delta but the last ends in the middle of a sample
+    transcript = azure_oai.save_audio_stream(stream_chunks(samples.tobytes(), [3, 4, 1001]), path)
+
+    written, rate = sf.read(path, dtype="int16")
+    assert rate == azure_oai.PCM16_SAMPLE_RATE
+    assert np.array_equal(written, samples)
+    assert transcript == "Once upon a time"
+    assert not os.path.exists(path + ".part")
+
+
+@pytest.mark.parametrize("finish_reason, audio", [("length", b"\x01\x00" * 10), (None, b"\x01\x00" * 10), ("stop", b"")])
+def test_cut_off_or_empty_streams_leave_no_segment(azure_oai, tmp_path, finish_reason, audio):
+    path = str(tmp_path / "0.wav")
+
+    with pytest.raises(RuntimeError):
+        azure_oai.save_audio_stream(stream_chunks(audio, [], finish_reason), path)
+
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".part")
+
+
+class FakeRateLimiter:
+    def call(self, fn, tokens=0, consume=None):
+        result = fn()
+        return consume(result) if consume is not None else result
+
+    def backoff(self, attempt, base_delay=1.0):
+        return 0
+
+
+def test_retry_prompt_carries_the_previous_error(azure_oai, tmp_path, monkeypatch):
+    prompts = []
+
+    def create(messages, **kwargs):
+        prompts.append(messages[-1]["content"])
+        if len(prompts) == 1:
+            raise RuntimeError("content filter triggered")
+        audio = SimpleNamespace(data=base64.b64encode(b"mp3").decode(), transcript="Hello")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(audio=audio, content=None))])
+
+    completions = SimpleNamespace(with_raw_response=SimpleNamespace(create=create))
+    monkeypatch.setattr(azure_oai, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(azure_oai, "rate_limiter", FakeRateLimiter())
+
+    path = azure_oai.generate_audio("Hello", str(tmp_path), "0.mp3", cache=None)
+
+    assert path == str(tmp_path / "0.mp3")
+    assert prompts == [
+        "Read out the following text: Hello",
+        "Previous error: content filter triggered. Just read out the following text: Hello",
+    ]
+
+
+def test_coalesced_segments_are_cached_one_by_one(azure_oai, tmp_path, monkeypatch):
+    monkeypatch.setattr(azure_oai, "segment_cache", SegmentCache(str(tmp_path / "cache")))
+    requested = []
+
+    def generate_audio_with_transcript(text, output_dir, file_name, *args, **kwargs):
+        # One tone per paragraph, with a pause between them
+        requested.append(text)
+        rate = 24000
+        pieces = []
+        for k, paragraph in enumerate(text.split("\n\n")):
+            t = np.arange(int(0.1 * len(paragraph) * rate)) / rate
+            pieces += [np.zeros(int(0.3 * rate)) if k else np.zeros(0), 0.5 * np.sin(2 * np.pi * 220 * (k + 1) * t)]
+        path = os.path.join(output_dir, file_name)
+        sf.write(path, np.concatenate(pieces), rate, subtype="PCM_16")
+        return path, text.replace("\n\n", " ")
+
+    monkeypatch.setattr(azure_oai, "generate_audio_with_transcript", generate_audio_with_transcript)
+    texts = ["The fox ran.", "It hid.", "Night fell."]
+
+    first = azure_oai.generate_story_audio(texts, str(tmp_path / "first"), "The Fox", format="wav", coalesce=True)
+    assert requested == ["The fox ran.\n\nIt hid.\n\nNight fell."]
+    assert azure_oai.segment_cache.stats()["entries"] == 3
+
+    # The same story with its middle line edited only synthesizes that line
+    edited = ["The fox ran.", "It hid in a log.", "Night fell."]
+    second = azure_oai.generate_story_audio(edited, str(tmp_path / "second"), "The Fox", format="wav", coalesce=True)
+    assert requested[1:] == ["It hid in a log."]
+    for i in (0, 2):
+        with open(first[i], "rb") as old, open(second[i], "rb") as new:
+            assert old.read() == new.read()
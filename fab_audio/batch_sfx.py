@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from fab_audio.sfx import (
+    build_opening_messages,
+    build_sfx_messages,
+    save_sfx_output,
+    validate_sfx_response,
+)
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchJob:
+    """One story whose opening and SFX tags are generated through the batch API."""
+
+    def __init__(self, key: str, title: str, text: str, out_dir: str):
+        self.key = key
+        self.title = title
+        self.text = text
+        self.out_dir = out_dir
+        self.opening: Optional[str] = None
+        self.sfx_data = None
+        # Conversation per request kind, extended with feedback when a result is rejected
+        self.messages = {
+            "opening": build_opening_messages(text),
+            "sfx": build_sfx_messages(text),
+        }
+
+
+class AzureBatchBackend:
+    """Submits batch files to the Azure OpenAI batch endpoint."""
+
+    def __init__(self, client, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> List[dict]:
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.extend(self.client.files.content(file_id).text.splitlines())
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for the batch endpoint.
+
+    Each submitted batch gets a directory under `work_dir` holding the input
+    file and an output file in the batch API's result format. Every request
+    body is answered by `responder`, which returns the assistant message
+    content, so the batch mode can run offline or against canned responses.
+    """
+
+    def __init__(self, work_dir: str, responder: Callable[[dict], str]):
+        self.work_dir = work_dir
+        self.responder = responder
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch_dir = os.path.join(self.work_dir, batch_id)
+        os.makedirs(batch_dir)
+        shutil.copyfile(input_path, os.path.join(batch_dir, "input.jsonl"))
+
+        with open(os.path.join(batch_dir, "input.jsonl"), "r", encoding="utf-8") as f_in, \
+                open(os.path.join(batch_dir, "output.jsonl"), "w", encoding="utf-8") as f_out:
+            for line in f_in:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                try:
+                    content = self.responder(request["body"])
+                    result = {
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "body": {"choices": [{"message": {"role": "assistant", "content": content}}]},
+                        },
+                        "error": None,
+                    }
+                except Exception as e:
+                    result = {
+                        "custom_id": request["custom_id"],
+                        "response": None,
+                        "error": {"code": "local_error", "message": str(e)},
+                    }
+                f_out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        output_path = os.path.join(self.work_dir, batch_id, "output.jsonl")
+        return "completed" if os.path.exists(output_path) else "in_progress"
+
+    def results(self, batch_id: str) -> List[dict]:
+        with open(os.path.join(self.work_dir, batch_id, "output.jsonl"), "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def write_batch_file(jobs: Dict[str, BatchJob], pending: List[str], deployment: str, path: str):
+    """Write one chat-completions request per pending `<key>::<kind>` id to a JSONL batch file."""
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id in pending:
+            key, kind = custom_id.rsplit("::", 1)
+            body = {"model": deployment, "messages": jobs[key].messages[kind]}
+            if kind == "sfx":
+                body["response_format"] = {"type": "json_object"}
+            request = {"custom_id": custom_id, "method": "POST", "url": "/chat/completions", "body": body}
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+
+def wait_for_batch(backend, batch_id: str, poll_interval: float) -> str:
+    while True:
+        status = backend.status(batch_id)
+        if status in TERMINAL_STATUSES:
+            return status
+        logger.info(f"Batch {batch_id} is {status}, checking again in {poll_interval}s")
+        time.sleep(poll_interval)
+
+
+def result_content(result: dict) -> str:
+    """Assistant content of one batch result line, raising if the request failed."""
+    if result.get("error"):
+        raise ValueError(f"Request failed: {result['error']}")
+    response = result.get("response") or {}
+    if response.get("status_code") != 200:
+        raise ValueError(f"Request failed with status {response.get('status_code')}: {response.get('body')}")
+    return response["body"]["choices"][0]["message"]["content"]
+
+
+def run_sfx_batch(
+    jobs: List[BatchJob],
+    backend,
+    deployment: str,
+    work_dir: str,
+    max_rounds: int = 3,
+    poll_interval: float = 60
+) -> Dict[str, dict]:
+    """
+    Generate the openings and SFX tags of many stories with batch requests.
+
+    Results go through the same validation as the interactive path. Requests
+    that fail or return invalid output are re-queued, with the error fed back
+    to the model, into a follow-up batch, up to `max_rounds` batches in total.
+
+    Args:
+        jobs: Stories to process
+        backend: AzureBatchBackend or LocalBatchBackend
+        deployment: Deployment name used in the request bodies
+        work_dir: Directory for the batch input files
+        max_rounds: Maximum number of batches to submit
+        poll_interval: Seconds between status checks
+
+    Returns:
+        Dict mapping job key to the saved sfx_output dict, for the stories that succeeded
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    jobs_by_key = {job.key: job for job in jobs}
+    pending = [f"{job.key}::{kind}" for job in jobs for kind in ("opening", "sfx")]
+    outputs = {}
+
+    for round_index in range(max_rounds):
+        if not pending:
+            break
+        input_path = os.path.join(work_dir, f"sfx_batch_{round_index}.jsonl")
+        write_batch_file(jobs_by_key, pending, deployment, input_path)
+        batch_id = backend.submit(input_path)
+        logger.info(f"Submitted batch {batch_id} with {len(pending)} requests (round {round_index + 1})")
+
+        status = wait_for_batch(backend, batch_id, poll_interval)
+        results = {result["custom_id"]: result for result in backend.results(batch_id)} if status == "completed" else {}
+        if status != "completed":
+            logger.warning(f"Batch {batch_id} ended with status '{status}', re-queueing all its requests")
+
+        retry = []
+        for custom_id in pending:
+            key, kind = custom_id.rsplit("::", 1)
+            job = jobs_by_key[key]
+            answered = False
+            try:
+                if custom_id not in results:
+                    raise ValueError("No result returned for this request")
+                content = result_content(results[custom_id])
+                if kind == "opening":
+                    if not content or not content.strip():
+                        raise ValueError("The opening is empty")
+                    job.opening = content.strip()
+                else:
+                    job.messages["sfx"].append({"role": "assistant", "content": content})
+                    answered = True
+                    job.sfx_data = validate_sfx_response(content)
+            except Exception as e:
+                logger.warning(f"Round {round_index + 1}: {custom_id} is not valid: {e}")
+                # Feedback only follows an answer of the model; a lost request is resubmitted as it was
+                if answered:
+                    error_message = f"The output is not valid, the error is: {str(e)}"
+                    job.messages["sfx"].append({"role": "user", "content": error_message})
+                retry.append(custom_id)
+        pending = retry
+
+        for job in jobs:
+            if job.key not in outputs and job.opening and job.sfx_data:
+                outputs[job.key] = save_sfx_output(job.title, job.opening, job.sfx_data, job.out_dir)
+
+    failed = sorted({custom_id.rsplit("::", 1)[0] for custom_id in pending})
+    if failed:
+        logger.error(f"{len(failed)} stories could not be processed in {max_rounds} batches: {failed}")
+    return outputs
@@ -0,0 +1,75 @@
+import importlib
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def batch_sfx(tmp_path_factory, monkeypatch):
+    # fab_audio.sfx reads the sound database from data/ when it is imported
+    root = tmp_path_factory.mktemp("library")
+    for folder, name in [("sfx", "bark"), ("bg_music", "forest"), ("misc", "toy-symphony"), ("misc", "quirky-quest")]:
+        os.makedirs(root / "data" / folder, exist_ok=True)
+        (root / "data" / folder / f"{name}.mp3").write_bytes(b"")
+    monkeypatch.chdir(root)
+    return importlib.import_module("fab_audio.batch_sfx")
+
+
+VALID_SFX = json.dumps({
+    "sound_effects": {"bark": {"name": "bark", "mode": "overlay"}},
+    "text": "<bark> The dog barked.",
+    "bg_music": {"name": "forest"},
+})
+
+INVALID_SFX = json.dumps({
+    "sound_effects": {"meow": {"name": "meow", "mode": "overlay"}},
+    "text": "<meow> The dog barked.",
+    "bg_music": {"name": "forest"},
+})
+
+
+def test_invalid_results_are_requeued(batch_sfx, tmp_path):
+    calls = []
+
+    def responder(body):
+        calls.append(body)
+        if body.get("response_format"):
+            # First SFX answer uses a sound that is not in the database
+            is_retry = any("not valid" in m["content"] for m in body["messages"] if m["role"] == "user")
+            return VALID_SFX if is_retry else INVALID_SFX
+        return "Welcome to Fablette, where stories come alive!"
+
+    backend = batch_sfx.LocalBatchBackend(str(tmp_path / "backend"), responder)
+    job = batch_sfx.BatchJob("dog", "The Dog", "The dog barked.", str(tmp_path / "dog"))
+    outputs = batch_sfx.run_sfx_batch([job], backend, "o4-mini", str(tmp_path / "batches"), poll_interval=0)
+
+    assert len(calls) == 3
+    assert outputs["dog"]["text"].startswith("<opening> Welcome to Fablette")
+    assert outputs["dog"]["sound_effects"]["bg_music"]["name"] == "forest"
+    with open(tmp_path / "dog" / "sfx_output.json", encoding="utf-8") as f:
+        assert json.load(f)["text"] == outputs["dog"]["text"]
+    # The follow-up batch only holds the request that failed validation
+    with open(tmp_path / "batches" / "sfx_batch_1.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line)["custom_id"] for line in f] == ["dog::sfx"]
+
+
+def test_failed_requests_give_up_after_max_rounds(batch_sfx, tmp_path):
+    def responder(body):
+        raise RuntimeError("server error")
+
+    backend = batch_sfx.LocalBatchBackend(str(tmp_path / "backend"), responder)
+    job = batch_sfx.BatchJob("dog", "The Dog", "The dog barked.", str(tmp_path / "dog"))
+    outputs = batch_sfx.run_sfx_batch([job], backend, "o4-mini", str(tmp_path / "batches"), max_rounds=2, poll_interval=0)
+
+    assert outputs == {}
+    assert not os.path.exists(tmp_path / "dog" / "sfx_output.json")
+    assert len(os.listdir(tmp_path / "backend")) == 2
+    # Requests that got no answer are resubmitted unchanged, without feedback on output that never existed
+    rounds = []
+    for index in range(2):
+        with open(tmp_path / "batches" / f"sfx_batch_{index}.jsonl", encoding="utf-8") as f:
+            requests = {json.loads(line)["custom_id"]: json.loads(line) for line in f}
+        rounds.append(requests["dog::sfx"]["body"]["messages"])
+    assert rounds[0] == rounds[1]
+    assert [message["role"] for message in rounds[1]].count("user") == 1
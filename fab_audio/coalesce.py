@@ -0,0 +1,208 @@
+import logging
+import os
+from difflib import SequenceMatcher
+from typing import List, Optional, Sequence
+
+import numpy as np
+from pydub import AudioSegment
+
+from fab_audio.asset_library import decode_audio_file
+
+logger = logging.getLogger(__name__)
+
+# Segments of at most this many words are synthesized together with their short neighbours
+SHORT_SEGMENT_WORDS = 12
+
+# Limits of one coalesced request, so a cut-off response loses little and splits stay accurate
+MAX_RUN_WORDS = 80
+MAX_RUN_SEGMENTS = 8
+
+# Segments are read as separate paragraphs, which makes the reader pause between them
+SEGMENT_SEPARATOR = "\n\n"
+
+# Loudness analysis window and the level, relative to the loudest window, counted as silence
+WINDOW_MS = 10
+SILENCE_DB = -35
+
+# Shortest run of silent windows counted as a pause between segments
+MIN_PAUSE_MS = 80
+
+# How far from its expected position a cut may fall back to the quietest window, as a
+# share of the shorter neighbouring segment, and in ms at most
+SEARCH_SHARE = 0.5
+MAX_SEARCH_MS = 1500
+
+
+def word_count(text: str) -> int:
+    return len(text.split())
+
+
+def group_segments(
+    texts: Sequence[str],
+    short_words: int = SHORT_SEGMENT_WORDS,
+    max_words: int = MAX_RUN_WORDS,
+    max_segments: int = MAX_RUN_SEGMENTS
+) -> List[List[int]]:
+    """
+    Split segment indices into the runs synthesized by one request each.
+
+    Consecutive short segments are grouped until the run would exceed
+    `max_words` or `max_segments`; every other segment is a run of its own.
+    """
+    groups: List[List[int]] = []
+    run: List[int] = []
+    run_words = 0
+    for i, text in enumerate(texts):
+        words = word_count(text)
+        if words > short_words:
+            if run:
+                groups.append(run)
+                run, run_words = [], 0
+            groups.append([i])
+            continue
+        if run and (run_words + words > max_words or len(run) >= max_segments):
+            groups.append(run)
+            run, run_words = [], 0
+        run.append(i)
+        run_words += words
+    if run:
+        groups.append(run)
+    return groups
+
+
+def join_segments(texts: Sequence[str]) -> str:
+    return SEGMENT_SEPARATOR.join(text.strip() for text in texts)
+
+
+def transcript_weights(texts: Sequence[str], transcript: Optional[str]) -> List[float]:
+    """
+    Length of each segment in the transcript of the coalesced audio.
+
+    The joined text is aligned with the transcript character by character,
+    so words the reader skipped or added count towards the segment they
+    were in. Without a transcript the requested text stands in for it.
+    """
+    lengths = [max(1, len(text.strip())) for text in texts]
+    if not transcript or not transcript.strip():
+        return lengths
+    joined = join_segments(texts).lower()
+    spoken = " ".join(transcript.split()).lower()
+    blocks = SequenceMatcher(None, joined, spoken, autojunk=False).get_matching_blocks()
+
+    def spoken_offset(offset: int) -> int:
+        # Position in the transcript of a position in the joined text
+        for a, b, size in blocks:
+            if offset < a:
+                return b
+            if offset <= a + size:
+                return b + offset - a
+        return len(spoken)
+
+    ends = np.cumsum([len(text.strip()) + len(SEGMENT_SEPARATOR) for text in texts])[:-1]
+    bounds = [0] + [spoken_offset(int(end) - len(SEGMENT_SEPARATOR)) for end in ends] + [len(spoken)]
+    return [max(1, end - start) for start, end in zip(bounds, bounds[1:])]
+
+
+def window_levels(segment: AudioSegment) -> np.ndarray:
+    """RMS level in dB of every WINDOW_MS window, relative to the loudest one."""
+    samples = np.array(segment.set_channels(1).get_array_of_samples(), dtype=np.float64)
+    window = max(1, segment.frame_rate * WINDOW_MS // 1000)
+    count = max(1, len(samples) // window)
+    samples = np.pad(samples, (0, max(0, count * window - len(samples))))[:count * window]
+    rms = np.sqrt(np.mean(samples.reshape(count, window) ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-9) / max(rms.max(), 1e-9))
+
+
+def find_pauses(levels: np.ndarray) -> List[tuple[int, int]]:
+    """
+    (middle window, length in windows) of every run of silent windows long enough to be
+    a pause. Silence at the start or end of the audio is not between two segments and is skipped.
+    """
+    silent = np.concatenate([[False], levels <= SILENCE_DB, [False]])
+    edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+    return [
+        ((start + end - 1) // 2, end - start)
+        for start, end in zip(edges[::2], edges[1::2])
+        if end - start >= MIN_PAUSE_MS // WINDOW_MS and start > 0 and end < len(levels)
+    ]
+
+
+def split_points(levels: np.ndarray, weights: Sequence[float]) -> List[int]:
+    """
+    Windows at which to cut audio made of segments weighted `weights`.
+
+    The segments' share of the text gives the expected position of every
+    cut. The pauses of the audio are then matched to the cuts in order,
+    trading the distance from the expected position against the length of
+    the pause, so a long pause a little further away wins over a short one
+    close by. Where there are not enough pauses, the quietest window near
+    the expected position stands in.
+    """
+    if len(weights) < 2:
+        return []
+    # The shares are spread over the speech, not the silence before and after it
+    voiced = np.flatnonzero(levels > SILENCE_DB)
+    first, last = (int(voiced[0]), int(voiced[-1]) + 1) if len(voiced) else (0, len(levels))
+    total = float(sum(weights))
+    expected = first + np.cumsum(weights)[:-1] / total * (last - first)
+    shares = np.asarray(weights, dtype=np.float64) / total * (last - first)
+    cut_count = len(expected)
+
+    # Candidate cuts as (window, bonus): every pause, plus the quietest window around each expected cut.
+    # The bonus is capped so a very long pause can't pull a cut across a whole segment.
+    max_bonus = MAX_SEARCH_MS // WINDOW_MS
+    candidates = {window: min(length, max_bonus) for window, length in find_pauses(levels)}
+    for k, position in enumerate(expected):
+        search = int(min(MAX_SEARCH_MS // WINDOW_MS, SEARCH_SHARE * min(shares[k], shares[k + 1])))
+        lo = max(first + 1, int(position) - search)
+        hi = min(last - 1, int(position) + search)
+        if lo <= hi:
+            candidates.setdefault(lo + int(np.argmin(levels[lo:hi + 1])), 0)
+    windows = sorted(candidates)
+    if len(windows) < cut_count:
+        return [int(position) for position in expected]
+    bonus = np.array([candidates[window] for window in windows], dtype=np.float64)
+    positions = np.array(windows, dtype=np.float64)
+
+    # cost[k][j]: best total cost of cuts 0..k with cut k at candidate j
+    cost = np.full((cut_count, len(windows)), np.inf)
+    previous = np.zeros((cut_count, len(windows)), dtype=np.int64)
+    cost[0] = np.abs(positions - expected[0]) - bonus
+    for k in range(1, cut_count):
+        best, best_j = np.inf, -1
+        for j in range(k, len(windows)):
+            if cost[k - 1][j - 1] < best:
+                best, best_j = cost[k - 1][j - 1], j - 1
+            cost[k][j] = best + abs(positions[j] - expected[k]) - bonus[j]
+            previous[k][j] = best_j
+
+    j = int(np.argmin(cost[-1]))
+    cuts = [windows[j]]
+    for k in range(cut_count - 1, 0, -1):
+        j = int(previous[k][j])
+        cuts.append(windows[j])
+    return cuts[::-1]
+
+
+def split_audio(
+    file_path: str, texts: Sequence[str], out_paths: Sequence[str], transcript: Optional[str] = None
+) -> List[str]:
+    """
+    Split the audio of coalesced segments back into one file per segment.
+
+    Each segment's share of the transcript gives the rough position of every
+    cut, which is then moved into the pause between the segments. The pieces
+    are written in the format of their file extension; compressed formats are
+    encoded again from the decoded audio, so the coalesced audio should be
+    lossless to avoid a second generation of compression.
+
+    Returns:
+        `out_paths`
+    """
+    segment = decode_audio_file(file_path)
+    weights = transcript_weights(texts, transcript)
+    cuts_ms = [cut * WINDOW_MS for cut in split_points(window_levels(segment), weights)]
+    for out_path, start, end in zip(out_paths, [0] + cuts_ms, cuts_ms + [len(segment)]):
+        segment[start:end].export(out_path, format=os.path.splitext(out_path)[1][1:])
+    logger.info(f"Split {file_path} into {len(out_paths)} segments at {cuts_ms} ms")
+    return list(out_paths)
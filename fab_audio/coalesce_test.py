@@ -0,0 +1,79 @@
+import numpy as np
+import soundfile as sf
+
+from fab_audio.coalesce import group_segments, join_segments, split_audio, transcript_weights
+
+RATE = 24000
+
+
+def test_only_runs_of_short_segments_are_grouped():
+    texts = ["Once upon a time", "a dog", "barked.", " ".join(["word"] * 20), "Then", "silence."]
+
+    assert group_segments(texts) == [[0, 1, 2], [3], [4, 5]]
+    assert group_segments(texts, max_segments=2) == [[0, 1], [2], [3], [4, 5]]
+    assert group_segments(texts, max_words=5) == [[0], [1, 2], [3], [4, 5]]
+    assert join_segments([" a dog ", "barked."]) == "a dog\n\nbarked."
+
+
+def speech(spoken, pause, lead=0.0, trail=0.0):
+    """Tones of the given lengths separated by `pause` seconds of silence."""
+    pieces = [np.zeros(int(lead * RATE))]
+    for k, seconds in enumerate(spoken):
+        t = np.arange(int(seconds * RATE)) / RATE
+        pieces.append(0.5 * np.sin(2 * np.pi * 220 * t))
+        if k < len(spoken) - 1:
+            pieces.append(np.zeros(int(pause * RATE)))
+    pieces.append(np.zeros(int(trail * RATE)))
+    return np.concatenate(pieces)
+
+
+def test_split_lands_in_the_pauses(tmp_path):
+    # Speech lengths that differ from the text shares, separated by short pauses
+    spoken = [1.5, 0.6, 1.8]
+    pause = 0.3
+    samples = speech(spoken, pause)
+    group_path = tmp_path / "0-2.coalesced.wav"
+    sf.write(str(group_path), samples, RATE, subtype="PCM_16")
+    texts = ["The fox ran into the woods", "and hid", "until the morning came."]
+    out_paths = [str(tmp_path / f"{i}.wav") for i in range(3)]
+
+    assert split_audio(str(group_path), texts, out_paths) == out_paths
+
+    lengths = [len(sf.read(path)[0]) / RATE for path in out_paths]
+    assert abs(sum(lengths) - len(samples) / RATE) < 0.01
+    # Every cut falls inside the pause after a segment's speech
+    ends = np.cumsum(lengths)[:-1]
+    speech_ends = np.cumsum([seconds + pause for seconds in spoken])[:-1] - pause
+    assert np.all(ends >= speech_ends) and np.all(ends <= speech_ends + pause)
+
+
+def test_silence_at_the_edges_is_not_a_pause(tmp_path):
+    samples = speech([1.2, 1.0], 0.15, lead=1.0, trail=1.2)
+    group_path = tmp_path / "0-1.coalesced.wav"
+    sf.write(str(group_path), samples, RATE, subtype="PCM_16")
+    out_paths = [str(tmp_path / f"{i}.wav") for i in range(2)]
+
+    split_audio(str(group_path), ["The owl woke up and looked around.", "It was night."], out_paths)
+
+    # The cut is in the pause between the sentences, after 1.0 s of silence and 1.2 s of speech
+    first = len(sf.read(out_paths[0])[0]) / RATE
+    assert 2.2 <= first <= 2.35
+
+
+def test_transcript_decides_the_shares(tmp_path):
+    texts = ["The fox ran into the woods", "and hid", "until the morning came."]
+    # The reader added words to the first segment
+    transcript = "The fox ran quickly and silently into the dark, dark woods and hid until the morning came."
+    weights = transcript_weights(texts, transcript)
+    assert weights[0] > 2 * len(texts[0]) and abs(weights[2] - len(texts[2])) <= 2
+    assert transcript_weights(texts, None) == [len(text) for text in texts]
+
+    samples = speech([3.0, 0.4, 1.4], 0.12)
+    group_path = tmp_path / "0-2.coalesced.wav"
+    sf.write(str(group_path), samples, RATE, subtype="PCM_16")
+    out_paths = [str(tmp_path / f"{i}.wav") for i in range(3)]
+
+    split_audio(str(group_path), texts, out_paths, transcript)
+
+    first = len(sf.read(out_paths[0])[0]) / RATE
+    assert 3.0 <= first <= 3.12
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+from typing import Iterator, Optional, TextIO, Tuple
+
+
+def iter_json_array(f: TextIO, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """
+    Incrementally parse a file holding a top-level JSON array.
+
+    Only the element being decoded (plus one read chunk) is kept in memory, so
+    corpora far larger than RAM can be walked story by story.
+
+    Args:
+        f: Text file positioned at the start of the array
+        chunk_size: Number of characters read at a time
+
+    Yields:
+        Each element of the array, in order
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    while True:
+        # Skip whitespace and separators between elements
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ",")):
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            fill()
+
+        if pos >= len(buf):
+            raise ValueError("Unexpected end of file while reading JSON array")
+
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError("Expected a JSON array of stories")
+            started = True
+            pos += 1
+            continue
+
+        if buf[pos] == "]":
+            return
+
+        try:
+            element, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        if end == len(buf) and not eof:
+            # A scalar cut at the chunk boundary may still be incomplete
+            fill()
+            continue
+        pos = end
+        yield element
+
+
+def iter_stories(story_path: str) -> Iterator[dict]:
+    """Yield the stories of every .json file in `story_path`, one at a time."""
+    for json_file in sorted(os.listdir(story_path)):
+        if not json_file.endswith(".json"):
+            continue
+        with open(os.path.join(story_path, json_file), "r", encoding="utf-8") as f:
+            yield from iter_json_array(f)
+
+
+def shard_of(title: str, num_shards: int) -> int:
+    """Stable shard index for a story, identical on every machine and run."""
+    digest = hashlib.sha1(title.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % num_shards
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse an "i/N" shard spec (0 <= i < N), e.g. "0/4"."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{value}', expected the form i/N")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{value}', expected 0 <= i < N")
+    return index, count
+
+
+def in_shard(story: dict, shard: Optional[Tuple[int, int]]) -> bool:
+    if shard is None:
+        return True
+    index, count = shard
+    return shard_of(story.get("title", ""), count) == index
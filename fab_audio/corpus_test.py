@@ -0,0 +1,56 @@
+import io
+import json
+
+import pytest
+
+from fab_audio.corpus import iter_json_array, iter_stories, parse_shard, shard_of
+
+STORIES = [
+    {"title": "Alice in Wonderland", "translations": [{"language": "English", "text": "Alice [fell], {down}."}]},
+    {"title": "The Three Little Pigs", "translations": [{"language": "English", "text": "Huff \"and\" puff"}]},
+    {"title": "Ünïcode", "translations": [], "rating": 4.5},
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1 << 16])
+def test_iter_json_array_matches_json_load(chunk_size):
+    text = json.dumps(STORIES, indent=2, ensure_ascii=False)
+    assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == STORIES
+
+
+def test_iter_json_array_handles_empty_and_scalars():
+    assert list(iter_json_array(io.StringIO(" [ ] "))) == []
+    assert list(iter_json_array(io.StringIO("[1, 23, 456]"), chunk_size=2)) == [1, 23, 456]
+
+
+def test_iter_json_array_rejects_non_arrays():
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"title": "Alice"}')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('[{"title": "Alice"}')))
+
+
+def test_iter_stories_reads_json_files_only(tmp_path):
+    (tmp_path / "a.json").write_text(json.dumps(STORIES[:2]))
+    (tmp_path / "b.json").write_text(json.dumps(STORIES[2:]), encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("not a story")
+
+    assert list(iter_stories(str(tmp_path))) == STORIES
+
+
+def test_shards_partition_titles():
+    titles = [f"Story {i}" for i in range(200)]
+    shards = [{t for t in titles if shard_of(t, 4) == i} for i in range(4)]
+
+    assert set().union(*shards) == set(titles)
+    assert sum(len(s) for s in shards) == len(titles)
+    assert all(shards)
+    assert shard_of("Alice in Wonderland", 4) == shard_of("Alice in Wonderland", 4)
+
+
+def test_parse_shard():
+    assert parse_shard("0/4") == (0, 4)
+    assert parse_shard("3/4") == (3, 4)
+    for value in ["4/4", "-1/4", "1/0", "1", "a/b"]:
+        with pytest.raises(ValueError):
+            parse_shard(value)
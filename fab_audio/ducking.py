@@ -0,0 +1,48 @@
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+from scipy.signal import lfilter, lfilter_zi
+
+from fab_audio.asset_library import SAMPLE_RATE
+from fab_audio.render_plan import Ducking
+
+
+def sidechain_activity(voice: np.ndarray, ducking: Ducking) -> np.ndarray:
+    """
+    How much the narration is speaking at every frame, from 0 (silent) to 1.
+
+    The narration is cut into `window_ms` windows whose RMS level is compared
+    to the threshold. Windows are held for `hold_ms` (half before, half after,
+    so the music starts dipping just before a word) to bridge the gaps between
+    words, then smoothed with a one-pole filter of `release_ms` and
+    interpolated back to one value per frame.
+
+    Args:
+        voice: float (frames, channels) narration samples
+        ducking: Ducking settings
+
+    Returns:
+        float32 array with one value per frame
+    """
+    frames = len(voice)
+    if frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    window = max(1, int(round(ducking.window_ms * SAMPLE_RATE / 1000)))
+    windows = -(-frames // window)
+
+    power = np.zeros(windows * window, dtype=np.float64)
+    power[:frames] = np.mean(np.square(voice, dtype=np.float64), axis=1)
+    rms_db = 10 * np.log10(power.reshape(windows, window).mean(axis=1) + 1e-12) - 20 * np.log10(32768)
+    active = (rms_db > ducking.threshold_db).astype(np.float64)
+
+    held = maximum_filter1d(active, size=max(1, int(ducking.hold_ms / ducking.window_ms)), mode="nearest")
+    alpha = np.exp(-ducking.window_ms / ducking.release_ms)
+    b, a = [1 - alpha], [1, -alpha]
+    smoothed, _ = lfilter(b, a, held, zi=lfilter_zi(b, a) * held[0])
+
+    centers = (np.arange(windows) + 0.5) * window
+    return np.interp(np.arange(frames), centers, smoothed).astype(np.float32)
+
+
+def duck_gain(activity: np.ndarray, depth_db: float) -> np.ndarray:
+    """Per-frame linear gain that reaches `depth_db` where the narration is fully active."""
+    return np.power(10, activity * (depth_db / 20)).astype(np.float32)
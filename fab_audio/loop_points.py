@@ -0,0 +1,126 @@
+from typing import Optional
+
+import numpy as np
+from scipy.signal import correlate
+
+# Analysis runs on a mono copy downsampled by this factor
+DECIMATION = 20
+
+# Length of the audio compared after the loop start and the loop end
+MATCH_SECONDS = 1.0
+
+# Crossfade used for a perfect match and for the worst accepted one
+MIN_CROSSFADE_MS = 30
+MAX_CROSSFADE_MS = 1500
+
+
+def _onset(envelope: np.ndarray, threshold_db: float = -1) -> int:
+    """
+    First index where the envelope comes within `threshold_db` of the track's
+    typical (median) level, so a fade-in or quiet intro isn't part of the loop.
+    """
+    level = np.median(envelope)
+    if level <= 0:
+        return 0
+    return int(np.argmax(envelope >= level * 10 ** (threshold_db / 20)))
+
+
+def _normalized_correlation(template: np.ndarray, signal: np.ndarray) -> np.ndarray:
+    """Normalized cross-correlation of `template` at every offset of `signal`."""
+    window = len(template)
+    template = template - template.mean()
+    raw = correlate(signal, template, mode="valid", method="fft")
+    cumulative = np.concatenate([[0.0], np.cumsum(signal)])
+    cumulative_sq = np.concatenate([[0.0], np.cumsum(signal ** 2)])
+    sums = cumulative[window:] - cumulative[:-window]
+    energy = cumulative_sq[window:] - cumulative_sq[:-window] - sums ** 2 / window
+    norm = np.sqrt(np.maximum(energy, 1e-12) * np.sum(template ** 2))
+    return raw / np.maximum(norm, 1e-12)
+
+
+def find_loop_points(samples: np.ndarray, rate: int) -> Optional[dict]:
+    """
+    Find where a music file can loop back without an audible seam.
+
+    The audio right after the loop start (where the track first reaches its
+    typical level) is matched against every position in the second half of the
+    track, first on a decimated mono copy and then refined at full rate
+    around the best match. The better the match, the shorter the crossfade
+    the renderer needs to hide the jump.
+
+    Args:
+        samples: (frames, channels) samples
+        rate: Sample rate
+
+    Returns:
+        {"loop_start", "loop_end", "crossfade"} in frames plus the match "score"
+        in [-1, 1], or None if the track is too short to analyze
+    """
+    mono = samples.reshape(len(samples), -1).astype(np.float64).mean(axis=1)
+    window = int(MATCH_SECONDS * rate)
+    if len(mono) < 4 * window:
+        return None
+
+    coarse = mono[:len(mono) // DECIMATION * DECIMATION].reshape(-1, DECIMATION).mean(axis=1)
+    coarse_window = window // DECIMATION
+    envelope = np.sqrt(np.convolve(coarse ** 2, np.ones(coarse_window) / coarse_window, mode="same"))
+    start = _onset(envelope)
+    # Leave room before the loop start for the crossfade pre-roll
+    start = max(start, int(MAX_CROSSFADE_MS / 1000 * rate) // DECIMATION)
+
+    search_from = max(len(coarse) // 2, start + coarse_window)
+    template = coarse[start:start + coarse_window]
+    scores = _normalized_correlation(template, coarse[search_from:len(coarse) - coarse_window])
+    if len(scores) == 0:
+        return None
+    end = search_from + int(np.argmax(scores))
+
+    # Refine both positions at full rate around the coarse match
+    loop_start = start * DECIMATION
+    around = end * DECIMATION - DECIMATION
+    fine = _normalized_correlation(
+        mono[loop_start:loop_start + window],
+        mono[around:min(len(mono), around + window + 2 * DECIMATION)],
+    )
+    loop_end = around + int(np.argmax(fine))
+    score = float(fine.max())
+
+    quality = min(1.0, max(0.0, score))
+    crossfade_ms = MAX_CROSSFADE_MS - quality * (MAX_CROSSFADE_MS - MIN_CROSSFADE_MS)
+    crossfade = min(int(crossfade_ms / 1000 * rate), loop_start)
+    return {"loop_start": loop_start, "loop_end": loop_end, "crossfade": crossfade, "score": score}
+
+
+def looped_frames(
+    samples: np.ndarray,
+    position: int,
+    count: int,
+    loop_start: int,
+    loop_end: int,
+    crossfade: int
+) -> np.ndarray:
+    """
+    Frames [position, position + count) of a track that plays to `loop_end`
+    and then repeats [loop_start, loop_end) forever.
+
+    The last `crossfade` frames before every jump are mixed, with an
+    equal-power fade, with the frames leading up to `loop_start`, so the
+    jump lands on continuous audio. Only the requested frames are generated.
+
+    Returns:
+        float32 (count, channels) frames
+    """
+    period = loop_end - loop_start
+    positions = np.arange(position, position + count, dtype=np.int64)
+    looped = positions >= loop_end
+    positions[looped] = loop_start + (positions[looped] - loop_end) % period
+
+    out = samples[positions].astype(np.float32)
+    if crossfade > 0:
+        fading = positions >= loop_end - crossfade
+        if fading.any():
+            t = (positions[fading] - (loop_end - crossfade) + 0.5) / crossfade
+            fade_out = np.cos(t * np.pi / 2).astype(np.float32)[:, None]
+            fade_in = np.sin(t * np.pi / 2).astype(np.float32)[:, None]
+            out[fading] = out[fading] * fade_out + samples[positions[fading] - period].astype(np.float32) * fade_in
+    return out
@@ -0,0 +1,49 @@
+import numpy as np
+
+from fab_audio.loop_points import find_loop_points, looped_frames
+
+RATE = 44100
+PHRASE_SECONDS = 0.75
+
+
+def music(seconds=12.0, fade_in=1.0):
+    """A chord whose top note pulses once per phrase, after a fade-in."""
+    t = np.arange(int(seconds * RATE)) / RATE
+    x = 0.3 * np.sin(2 * np.pi * 220 * t)
+    x += 0.2 * np.sin(2 * np.pi * 330 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * t / PHRASE_SECONDS))
+    x *= np.minimum(1.0, t / fade_in)
+    tone = (0.8 * 32767 * x).astype(np.int16)
+    return np.stack([tone, tone], axis=1)
+
+
+def test_loop_region_spans_whole_phrases_after_the_intro():
+    points = find_loop_points(music(), RATE)
+
+    assert points["loop_start"] >= RATE
+    phrases = (points["loop_end"] - points["loop_start"]) / (PHRASE_SECONDS * RATE)
+    assert abs(phrases - round(phrases)) < 0.01
+    assert points["score"] > 0.99
+    # A near-perfect match only needs a short crossfade
+    assert 0 < points["crossfade"] < 0.1 * RATE
+
+
+def test_short_tracks_are_not_analyzed():
+    assert find_loop_points(music(seconds=3.0), RATE) is None
+
+
+def test_looped_frames_have_no_seam():
+    samples = music()
+    points = find_loop_points(samples, RATE)
+    out = looped_frames(samples, 0, 40 * RATE, points["loop_start"], points["loop_end"], points["crossfade"])
+
+    # Plays the file as is up to the first crossfade
+    head = points["loop_end"] - points["crossfade"]
+    assert np.array_equal(out[:head], samples[:head].astype(np.float32))
+
+    # No step across the jumps is larger than the music's own steps
+    max_step = np.abs(np.diff(samples[RATE * 2:, 0].astype(np.float32))).max()
+    assert np.abs(np.diff(out[:, 0])).max() <= max_step * 1.05
+
+    # Any window of the loop is generated on its own, identical to the full run
+    window = looped_frames(samples, 25 * RATE, RATE, points["loop_start"], points["loop_end"], points["crossfade"])
+    assert np.array_equal(window, out[25 * RATE:26 * RATE])
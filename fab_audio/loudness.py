@@ -0,0 +1,163 @@
+import json
+import math
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+from scipy.signal import lfilter
+
+# Gating block and hop of ITU-R BS.1770 / EBU R128
+BLOCK_SECONDS = 0.4
+HOP_SECONDS = 0.1
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+
+# Hops filtered at a time, to bound memory on long files
+CHUNK_HOPS = 256
+
+SIDECAR_NAME = "loudness.json"
+
+
+def k_weighting(rate: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    (b, a) of the two K-weighting stages at `rate`: the high shelf modelling
+    the head, then the RLB high pass. Same bilinear design as libebur128,
+    which matches the BS.1770 48 kHz coefficients and works at any rate.
+    """
+    # High shelf
+    f0, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = np.array([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0])
+    shelf_a = np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+
+    # High pass
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / rate)
+    a0 = 1 + k / q + k * k
+    pass_b = np.array([1.0, -2.0, 1.0])
+    pass_a = np.array([1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+
+    return [(shelf_b, shelf_a), (pass_b, pass_a)]
+
+
+def integrated_loudness(samples: np.ndarray, rate: int) -> float:
+    """
+    Integrated loudness in LUFS (ITU-R BS.1770-4, as used by EBU R128).
+
+    The signal is K-weighted chunk by chunk, reduced to the energy of each
+    100 ms hop, and the overlapping 400 ms gating blocks are then built from
+    the hops, so memory stays small even for long music beds.
+
+    Args:
+        samples: (frames, channels) int16 or float samples
+        rate: Sample rate
+
+    Returns:
+        Loudness in LUFS, -inf for silence
+    """
+    samples = samples.reshape(len(samples), -1)
+    channels = samples.shape[1]
+    scale = 32768.0 if samples.dtype == np.int16 else 1.0
+    hop = int(round(HOP_SECONDS * rate))
+    hops_per_block = int(round(BLOCK_SECONDS / HOP_SECONDS))
+
+    filters = k_weighting(rate)
+    states = [np.zeros((2, channels)) for _ in filters]
+    hop_energy = []
+    chunk = hop * CHUNK_HOPS
+    for start in range(0, len(samples), chunk):
+        x = samples[start:start + chunk].astype(np.float64) / scale
+        for index, (b, a) in enumerate(filters):
+            x, states[index] = lfilter(b, a, x, axis=0, zi=states[index])
+        squared = np.square(x)
+        hops = len(squared) // hop
+        energy = squared[:hops * hop].reshape(hops, hop, channels).sum(axis=1)
+        if len(squared) > hops * hop:
+            # Partial hop at the end of the file
+            energy = np.vstack([energy, squared[hops * hop:].sum(axis=0, keepdims=True)])
+        hop_energy.append(energy)
+
+    if not hop_energy:
+        return float("-inf")
+    hop_energy = np.vstack(hop_energy)
+    if len(hop_energy) < hops_per_block:
+        # Shorter than one gating block: measure it as a whole
+        blocks = hop_energy.sum(axis=0, keepdims=True) / len(samples)
+    else:
+        cumulative = np.vstack([np.zeros((1, channels)), np.cumsum(hop_energy, axis=0)])
+        blocks = (cumulative[hops_per_block:] - cumulative[:-hops_per_block]) / (hop * hops_per_block)
+
+    # All channels of a stereo file are weighted 1.0
+    block_power = blocks.sum(axis=1)
+    with np.errstate(divide="ignore"):
+        block_loudness = -0.691 + 10 * np.log10(block_power)
+
+    gated = block_power[block_loudness > ABSOLUTE_GATE_LUFS]
+    if len(gated) == 0:
+        return float("-inf")
+    relative_gate = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE_LU
+    gated = block_power[(block_loudness > ABSOLUTE_GATE_LUFS) & (block_loudness > relative_gate)]
+    return float(-0.691 + 10 * math.log10(gated.mean()))
+
+
+class LoudnessSidecar:
+    """
+    Loudness of the TTS segments of one story, in `loudness.json` next to them.
+
+    Entries are keyed by file name and remember the file's mtime and size,
+    so a regenerated segment is measured again.
+    """
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, SIDECAR_NAME)
+        self._lock = threading.Lock()
+        self._entries: Optional[dict] = None
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            else:
+                self._entries = {}
+        return self._entries
+
+    def get(self, file_path: str, load: Callable[[str], np.ndarray], rate: int) -> Optional[float]:
+        """Loudness of a segment, measured on `load(file_path)` samples at `rate` if not known yet."""
+        stat = os.stat(file_path)
+        name = os.path.basename(file_path)
+        with self._lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                return entry["loudness_lufs"]
+
+        loudness = integrated_loudness(load(file_path), rate)
+        value = loudness if math.isfinite(loudness) else None
+        with self._lock:
+            self.entries[name] = {"mtime": stat.st_mtime, "size": stat.st_size, "loudness_lufs": value}
+            self._save()
+        return value
+
+    def _save(self):
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".loudness-", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def measure_segments(file_paths: list[str], load: Callable[[str], np.ndarray], rate: int) -> dict[str, Optional[float]]:
+    """Measure freshly generated TTS segments into their story's sidecar."""
+    sidecars: dict[str, LoudnessSidecar] = {}
+    loudness = {}
+    for file_path in file_paths:
+        directory = os.path.dirname(file_path)
+        sidecar = sidecars.setdefault(directory, LoudnessSidecar(directory))
+        loudness[file_path] = sidecar.get(file_path, load, rate)
+    return loudness
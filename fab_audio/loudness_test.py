@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from fab_audio.loudness import LoudnessSidecar, integrated_loudness
+
+RATE = 48000
+
+
+def sine(amplitude, seconds=3.0, freq=1000):
+    t = np.arange(int(seconds * RATE)) / RATE
+    tone = amplitude * np.sin(2 * np.pi * freq * t)
+    return np.stack([tone, tone], axis=1)
+
+
+def test_reference_tone():
+    # BS.1770: a 997 Hz sine at -20 dBFS peak on both channels reads -20 LUFS
+    assert integrated_loudness(sine(0.1, freq=997), RATE) == pytest.approx(-20.0, abs=0.05)
+
+
+def test_gain_and_silence():
+    quiet = integrated_loudness(sine(0.05), RATE)
+    loud = integrated_loudness(sine(0.1), RATE)
+    assert loud - quiet == pytest.approx(20 * np.log10(2), abs=0.05)
+
+    # Silence is gated out (only blocks straddling the edge still count), instead of reading 3 dB lower
+    padded = np.vstack([sine(0.1), np.zeros((3 * RATE, 2))])
+    assert integrated_loudness(padded, RATE) == pytest.approx(loud, abs=0.5)
+    assert integrated_loudness(np.zeros((RATE, 2)), RATE) == float("-inf")
+
+
+def test_int16_and_short_clips():
+    tone = sine(0.1, seconds=0.2)
+    assert integrated_loudness((tone * 32768).astype(np.int16), RATE) == pytest.approx(
+        integrated_loudness(tone, RATE), abs=0.05
+    )
+
+
+def test_sidecar_measures_each_segment_once(tmp_path):
+    segment = tmp_path / "0.mp3"
+    segment.write_bytes(b"audio")
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        return sine(0.1)
+
+    assert LoudnessSidecar(str(tmp_path)).get(str(segment), load, RATE) == pytest.approx(-20.0, abs=0.1)
+    assert LoudnessSidecar(str(tmp_path)).get(str(segment), load, RATE) is not None
+    assert len(loads) == 1
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+STAGES = ("sfx", "parse", "tts", "mix")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    story TEXT NOT NULL,
+    language TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL,
+    artifact_hash TEXT,
+    error TEXT,
+    PRIMARY KEY (story, language, stage)
+);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    story TEXT NOT NULL,
+    language TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    path TEXT NOT NULL,
+    format TEXT,
+    bitrate TEXT,
+    size INTEGER,
+    PRIMARY KEY (story, language, path)
+);
+"""
+
+
+def hash_artifacts(paths: Iterable[str]) -> str:
+    """Hash the content of one or more artifact files, in the given order."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class JobManifest:
+    """
+    SQLite record of every (story, language, stage) the pipeline has run.
+
+    Each row keeps the stage status ("running", "done" or "failed"), attempt
+    count, timings, the hash of the produced artifacts and the last error, so a
+    run can be resumed or inspected without probing the output tree.
+    """
+
+    def __init__(self, db_path: str = "out/manifest.db"):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # Several stage threads (and shard processes) share the same database file
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def start(self, story: str, language: str, stage: str):
+        self._execute(
+            """
+            INSERT INTO stages (story, language, stage, status, attempts, started_at)
+            VALUES (?, ?, ?, 'running', 1, ?)
+            ON CONFLICT (story, language, stage) DO UPDATE SET
+                status = 'running', attempts = attempts + 1, started_at = excluded.started_at,
+                finished_at = NULL, duration = NULL, error = NULL
+            """,
+            (story, language, stage, time.time()),
+        )
+
+    def finish(self, story: str, language: str, stage: str, artifact_hash: Optional[str] = None):
+        now = time.time()
+        self._execute(
+            """
+            INSERT INTO stages (story, language, stage, status, attempts, started_at, finished_at, duration, artifact_hash)
+            VALUES (?, ?, ?, 'done', 0, ?, ?, 0, ?)
+            ON CONFLICT (story, language, stage) DO UPDATE SET
+                status = 'done', finished_at = excluded.finished_at,
+                duration = excluded.finished_at - COALESCE(started_at, excluded.finished_at),
+                artifact_hash = excluded.artifact_hash, error = NULL
+            """,
+            (story, language, stage, now, now, artifact_hash),
+        )
+
+    def fail(self, story: str, language: str, stage: str, error: str):
+        now = time.time()
+        self._execute(
+            """
+            UPDATE stages SET status = 'failed', finished_at = ?, duration = ? - COALESCE(started_at, ?), error = ?
+            WHERE story = ? AND language = ? AND stage = ?
+            """,
+            (now, now, now, error, story, language, stage),
+        )
+
+    def record_artifacts(self, story: str, language: str, stage: str, artifacts: Iterable[dict]):
+        """Record output files of a stage, as dicts with "path" and optional "format" and "bitrate"."""
+        for artifact in artifacts:
+            path = artifact["path"]
+            self._execute(
+                """
+                INSERT OR REPLACE INTO artifacts (story, language, stage, path, format, bitrate, size)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (story, language, stage, path, artifact.get("format"), artifact.get("bitrate"),
+                 os.path.getsize(path) if os.path.exists(path) else None),
+            )
+
+    def artifacts(self, story: str, language: str, stage: Optional[str] = None) -> list[dict]:
+        sql = "SELECT stage, path, format, bitrate, size FROM artifacts WHERE story = ? AND language = ?"
+        params = (story, language)
+        if stage is not None:
+            sql += " AND stage = ?"
+            params += (stage,)
+        return [
+            {"stage": stage, "path": path, "format": format, "bitrate": bitrate, "size": size}
+            for stage, path, format, bitrate, size in self._execute(sql + " ORDER BY path", params)
+        ]
+
+    @contextmanager
+    def track(self, story: str, language: str, stage: str):
+        """
+        Record a stage run. The body may set `result["artifact_hash"]` and add
+        output files to `result["artifacts"]`; any exception marks the stage as
+        failed and is re-raised.
+        """
+        result = {"artifact_hash": None, "artifacts": []}
+        self.start(story, language, stage)
+        try:
+            yield result
+        except Exception as e:
+            self.fail(story, language, stage, str(e))
+            raise
+        self.record_artifacts(story, language, stage, result["artifacts"])
+        self.finish(story, language, stage, result["artifact_hash"])
+
+    def is_done(self, story: str, language: str, stage: str) -> bool:
+        rows = self._execute(
+            "SELECT 1 FROM stages WHERE story = ? AND language = ? AND stage = ? AND status = 'done'",
+            (story, language, stage),
+        )
+        return bool(rows)
+
+    def finished_stories(self, language: str) -> set[str]:
+        """Stories whose final (mix) stage is done, i.e. everything a resume can skip."""
+        rows = self._execute(
+            "SELECT story FROM stages WHERE language = ? AND stage = ? AND status = 'done'",
+            (language, STAGES[-1]),
+        )
+        return {row[0] for row in rows}
+
+    def progress(self, language: Optional[str] = None) -> dict:
+        """Count rows per stage and status, e.g. {"tts": {"done": 10, "failed": 2}}."""
+        sql = "SELECT stage, status, COUNT(*) FROM stages"
+        params = ()
+        if language is not None:
+            sql += " WHERE language = ?"
+            params = (language,)
+        sql += " GROUP BY stage, status"
+        progress = {}
+        for stage, status, count in self._execute(sql, params):
+            progress.setdefault(stage, {})[status] = count
+        return progress
+
+    def failures(self, language: Optional[str] = None) -> list[dict]:
+        sql = "SELECT story, language, stage, attempts, error FROM stages WHERE status = 'failed'"
+        params = ()
+        if language is not None:
+            sql += " AND language = ?"
+            params = (language,)
+        return [
+            {"story": story, "language": lang, "stage": stage, "attempts": attempts, "error": error}
+            for story, lang, stage, attempts, error in self._execute(sql, params)
+        ]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    manifest = JobManifest(sys.argv[1] if len(sys.argv) > 1 else "out/manifest.db")
+    print(json.dumps(manifest.progress(), indent=2))
+    for failure in manifest.failures():
+        print(f"{failure['story']} ({failure['language']}) failed at {failure['stage']} "
+              f"after {failure['attempts']} attempts: {failure['error']}")
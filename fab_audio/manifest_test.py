@@ -0,0 +1,71 @@
+import pytest
+
+from fab_audio.manifest import JobManifest, hash_artifacts
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = JobManifest(str(tmp_path / "manifest.db"))
+    yield manifest
+    manifest.close()
+
+
+def test_track_records_done_stage(manifest, tmp_path):
+    artifact = tmp_path / "sfx_output.json"
+    artifact.write_text("{}")
+
+    with manifest.track("Alice", "en", "sfx") as result:
+        result["artifact_hash"] = hash_artifacts([str(artifact)])
+
+    assert manifest.is_done("Alice", "en", "sfx")
+    assert not manifest.is_done("Alice", "en", "parse")
+    assert not manifest.is_done("Alice", "fr", "sfx")
+    assert manifest.progress() == {"sfx": {"done": 1}}
+
+
+def test_failed_attempts_are_counted(manifest):
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            with manifest.track("Alice", "en", "tts"):
+                raise RuntimeError("quota exceeded")
+
+    assert not manifest.is_done("Alice", "en", "tts")
+    assert manifest.failures() == [
+        {"story": "Alice", "language": "en", "stage": "tts", "attempts": 2, "error": "quota exceeded"}
+    ]
+
+    with manifest.track("Alice", "en", "tts"):
+        pass
+    assert manifest.is_done("Alice", "en", "tts")
+    assert manifest.failures() == []
+
+
+def test_finished_stories_only_includes_mixed(manifest):
+    manifest.finish("Alice", "en", "tts")
+    manifest.finish("Bob", "en", "mix")
+    manifest.finish("Carol", "fr", "mix")
+
+    assert manifest.finished_stories("en") == {"Bob"}
+
+
+def test_state_is_shared_across_connections(manifest):
+    manifest.finish("Alice", "en", "mix")
+
+    reopened = JobManifest(manifest.db_path)
+    assert reopened.finished_stories("en") == {"Alice"}
+    reopened.close()
+
+
+def test_track_records_artifacts(manifest, tmp_path):
+    mixed = tmp_path / "mixed.mp3"
+    mixed.write_bytes(b"x" * 10)
+
+    with manifest.track("Alice", "en", "mix") as result:
+        result["artifacts"].append({"path": str(mixed), "format": "mp3", "bitrate": None})
+        result["artifacts"].append({"path": str(tmp_path / "mixed_64k.mp3"), "format": "mp3", "bitrate": "64k"})
+
+    assert manifest.artifacts("Alice", "en") == [
+        {"stage": "mix", "path": str(mixed), "format": "mp3", "bitrate": None, "size": 10},
+        {"stage": "mix", "path": str(tmp_path / "mixed_64k.mp3"), "format": "mp3", "bitrate": "64k", "size": None},
+    ]
+    assert manifest.artifacts("Alice", "en", "tts") == []
@@ -1,10 +1,16 @@
 import json
 import os
 from pydub import AudioSegment
+from fab_audio.asset_library import DecodeCache, asset_library, decode_audio_file
+from fab_audio.mix_engine import EXPORT_FORMATS, export_targets, mix_audio_numpy
+from fab_audio.remix import remix_numpy
+from fab_audio.render_plan import Ducking, Normalization
+
+MIX_BACKENDS = ("numpy", "pydub")
 
 def load_audio_file(file_path):
     """
-    Load an audio file with fallback to explicit codec if needed.
+    Load an audio file, using the pre-decoded asset library when possible.
     
     Args:
         file_path: Path to the audio file
@@ -12,21 +18,89 @@ def load_audio_file(file_path):
     Returns:
         AudioSegment object
     """
-    try:
-        return AudioSegment.from_file(file_path)
-    except Exception as e:
-        try:
-            return AudioSegment.from_file(file_path, format="wav", codec="adpcm_ms")
-        except Exception as inner_e:
-            raise Exception(f"Failed to load audio file {file_path}: {str(e)}, then tried with codec: {str(inner_e)}")
+    segment = asset_library.load_segment(file_path)
+    if segment is not None:
+        return segment
+    return decode_audio_file(file_path)
 
-def mix_audio(parsed_sfx_output: dict, out_path: str):
+def mix_audio(
+    parsed_sfx_output: dict,
+    out_path: str,
+    backend: str = "numpy",
+    plan_path: str = None,
+    stream: bool = False,
+    exports: list[str] = (),
+    duck: bool = False,
+    normalize: bool = False,
+    stems_dir: str = None
+):
     """
     Mix audio files according to specified modes.
     
     Args:
         parsed_sfx_output: Parsed SFX output
         out_path: Output path for the mixed audio file
+        backend: "numpy" for the preallocated timeline engine, "pydub" for the
+            reference implementation built from AudioSegment concatenation
+        plan_path: Where the numpy backend saves its render plan as JSON, if given
+        stream: With the numpy backend, encode block by block in bounded memory
+        exports: Extra "format[:bitrate]" outputs, e.g. ["mp3:64k", "opus:32k"], written next to out_path
+        duck: With the numpy backend, lower music and SFX wherever the narration
+            speaks instead of applying the fixed drops
+        normalize: With the numpy backend, bring every file to its track's
+            loudness target through the clip gains
+        stems_dir: With the numpy backend, keep per-track stems there and only
+            re-render the parts of the story whose files changed since the last mix
+    """
+    if backend == "numpy" and stems_dir:
+        return remix_numpy(
+            parsed_sfx_output, out_path, stems_dir, plan_path, stream=stream, exports=exports,
+            ducking=Ducking() if duck else None,
+            normalization=Normalization() if normalize else None
+        )
+    if backend == "numpy":
+        return mix_audio_numpy(
+            parsed_sfx_output, out_path, plan_path, stream=stream, exports=exports,
+            ducking=Ducking() if duck else None,
+            normalization=Normalization() if normalize else None
+        )
+    if backend == "pydub":
+        if duck:
+            raise ValueError("Ducking needs the numpy backend, the pydub backend only applies the fixed volume drops")
+        if normalize:
+            raise ValueError("Loudness normalization needs the numpy backend, the pydub backend mixes files as they are")
+        return mix_audio_pydub(parsed_sfx_output, out_path, exports=exports)
+    raise ValueError(f"Unknown mix backend '{backend}', expected one of {MIX_BACKENDS}")
+
+def mix_audio_pydub(parsed_sfx_output: dict, out_path: str, exports: list[str] = ()):
+    """
+    Reference mixer working on AudioSegments, kept to check the numpy engine against.
+    
+    Args:
+        parsed_sfx_output: Parsed SFX output
+        out_path: Output path for the mixed audio file
+        exports: Extra "format[:bitrate]" outputs
+    """
+    cache = DecodeCache(load_audio_file)
+    mixed = render_mix_pydub(parsed_sfx_output, cache)
+    # Export the final mixed audio
+    for target in export_targets(out_path, exports):
+        muxer, codec, _ = EXPORT_FORMATS[target["format"]]
+        mixed.export(target["path"], format=muxer, codec=codec, bitrate=target["bitrate"])
+    cache.log_stats(out_path)
+
+    return out_path
+
+def render_mix_pydub(parsed_sfx_output: dict, cache: DecodeCache = None) -> AudioSegment:
+    """
+    Build the mixed story by concatenating and overlaying AudioSegments.
+    
+    Args:
+        parsed_sfx_output: Parsed SFX output
+        cache: Decode cache for this mix, a new one by default
+        
+    Returns:
+        The mixed AudioSegment
     """
     audio_paths = parsed_sfx_output["audio_paths"]
     mixing_modes = parsed_sfx_output["mixing_instructions"]
@@ -34,6 +108,10 @@ def mix_audio(parsed_sfx_output: dict, out_path: str):
     if len(audio_paths) != len(mixing_modes):
         raise ValueError("audio_paths and mixing_modes must have the same length")
     
+    # Each distinct file is decoded once, even when peeked at or repeated
+    cache = cache if cache is not None else DecodeCache(load_audio_file)
+    load = cache.get
+
     # Initialize empty result
     mixed = AudioSegment.empty()
     bg_audio = None
@@ -45,7 +123,7 @@ def mix_audio(parsed_sfx_output: dict, out_path: str):
         current_mode = mixing_modes[i]
         
         # Load current audio
-        current_audio = load_audio_file(current_path)
+        current_audio = load(current_path)
         
         if current_mode == "opening":
             # Initial 3 seconds at full volume
@@ -54,7 +132,7 @@ def mix_audio(parsed_sfx_output: dict, out_path: str):
             
             if i + 1 < len(audio_paths):
                 # Load next story segment
-                next_story = load_audio_file(audio_paths[i + 1])
+                next_story = load(audio_paths[i + 1])
                 
                 # Create background music with fade from full to reduced volume
                 bg_music = current_audio[3000:3000 + len(next_story)]
@@ -82,7 +160,7 @@ def mix_audio(parsed_sfx_output: dict, out_path: str):
                 i += 1  # Skip next segment as we've processed it
             
         elif current_mode == "title":
-            next_audio = load_audio_file(audio_paths[i + 1])
+            next_audio = load(audio_paths[i + 1])
             silence = AudioSegment.silent(duration=1000)
             mixed += silence
             mixed += next_audio
@@ -116,7 +194,7 @@ def mix_audio(parsed_sfx_output: dict, out_path: str):
             sfx = current_audio
             if i + 1 < len(audio_paths) and mixing_modes[i + 1] == "story":
                 # Load next story segment
-                next_story = load_audio_file(audio_paths[i + 1])
+                next_story = load(audio_paths[i + 1])
                 
                 # First 3 seconds at full volume
                 initial_sfx = sfx[:3000]
@@ -186,10 +264,7 @@ def mix_audio(parsed_sfx_output: dict, out_path: str):
         final_mixed += mixed[bg_start_timestamp:].overlay(bg_segment)
         mixed = final_mixed
 
-    # Export the final mixed audio
-    mixed.export(out_path, format="mp3")
-
-    return out_path
+    return mixed
 
 def read_tts_audio(audio_dir: str):
     """Read all .wav files in the given directory.
@@ -0,0 +1,545 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import soundfile as sf
+from pydub import AudioSegment
+
+from fab_audio.asset_library import (
+    CHANNELS,
+    SAMPLE_RATE,
+    DecodeCache,
+    array_to_segment,
+    asset_library,
+    decode_audio_file,
+    read_pcm_file,
+    segment_to_array,
+)
+from fab_audio.ducking import duck_gain, sidechain_activity
+from fab_audio.loop_points import looped_frames
+from fab_audio.loudness import LoudnessSidecar
+from fab_audio.render_plan import TRACKS, Ducking, LoopPoints, Normalization, RenderPlan, plan_mix
+
+# Frames processed at a time when adding a clip, to bound temporary memory
+CHUNK_FRAMES = 1 << 18
+
+# Length of the blocks rendered by the streaming exporter
+BLOCK_MS = 10000
+
+# ffmpeg muxer, encoder and file extension of each export format
+EXPORT_FORMATS = {
+    "mp3": ("mp3", "libmp3lame", "mp3"),
+    "opus": ("opus", "libopus", "opus"),
+    "aac": ("adts", "aac", "aac"),
+    "wav": ("wav", None, "wav"),
+}
+
+# Piecewise-linear gain curve: (time in ms from the clip start, linear gain) points
+Envelope = Sequence[Tuple[float, float]]
+
+
+def ms_to_frames(ms: float) -> int:
+    return int(round(ms * SAMPLE_RATE / 1000))
+
+
+def frames_to_ms(frames: int) -> int:
+    # Same rounding as len(AudioSegment)
+    return int(round(frames * 1000 / SAMPLE_RATE))
+
+
+def load_audio_array(file_path: str) -> np.ndarray:
+    """
+    int16 (frames, CHANNELS) samples of a file, memory-mapped from the asset library when
+    possible and read without ffmpeg for WAV/FLAC segments.
+    """
+    samples = asset_library.load(file_path)
+    if samples is not None:
+        return samples
+    samples = read_pcm_file(file_path)
+    if samples is not None:
+        return samples
+    return segment_to_array(decode_audio_file(file_path))
+
+
+def envelope_gains(envelope: Optional[Envelope], start_frame: int, frames: int) -> Optional[np.ndarray]:
+    """Per-frame gains of `envelope` for frames [start_frame, start_frame + frames) of a clip."""
+    if envelope is None:
+        return None
+    times, gains = zip(*envelope)
+    frame_ms = (np.arange(start_frame, start_frame + frames, dtype=np.float64) * (1000 / SAMPLE_RATE))
+    return np.interp(frame_ms, times, gains).astype(np.float32)
+
+
+class Timeline:
+    """
+    Preallocated float32 mix buffer.
+
+    Clips are summed in place at their start position, with a gain envelope
+    applied on the fly, so building a story costs one buffer instead of a copy
+    of the whole mix per appended segment.
+
+    A timeline can also hold just a window of the mix, starting at
+    `start_frame`; clips are then cropped to the window, which is how the
+    streaming renderer produces a story block by block.
+    """
+
+    def __init__(self, length_ms: int, start_frame: int = 0, frames: Optional[int] = None):
+        self.start_frame = start_frame
+        if frames is None:
+            frames = ms_to_frames(length_ms) - start_frame
+        self.buffer = np.zeros((max(0, frames), CHANNELS), dtype=np.float32)
+
+    def add(
+        self,
+        samples: np.ndarray,
+        start_ms: int,
+        offset_ms: int = 0,
+        length_ms: Optional[int] = None,
+        envelope: Optional[Envelope] = None,
+        gain: float = 1.0,
+        loop: bool = False,
+        loop_points: Optional[LoopPoints] = None
+    ):
+        """
+        Mix `samples[offset_ms:offset_ms + length_ms]` into the timeline at `start_ms`.
+
+        Looped clips are generated chunk by chunk from their position in the
+        loop, so only the frames that land in the timeline are produced.
+
+        Args:
+            samples: int16 (frames, CHANNELS) source samples
+            start_ms: Position of the clip in the timeline
+            offset_ms: Where the clip starts in the source
+            length_ms: Clip length, by default the rest of the source
+            envelope: Gain curve relative to the clip start, None for constant gain
+            gain: Constant linear gain applied on top of the envelope
+            loop: Repeat the source to fill `length_ms`
+            loop_points: With `loop`, play to loop_end then repeat from loop_start with a
+                crossfaded seam, instead of repeating the whole source
+        """
+        source_frames = len(samples)
+        if source_frames == 0:
+            return
+        if loop_points is not None and loop_points.loop_end > source_frames:
+            # Stale analysis of a file that changed since
+            loop_points = None
+        offset = ms_to_frames(offset_ms)
+        if loop and loop_points is None:
+            offset %= source_frames
+        start = ms_to_frames(start_ms) - self.start_frame
+        if length_ms is None:
+            frames = source_frames - offset
+        else:
+            frames = ms_to_frames(length_ms)
+            if not loop:
+                frames = min(frames, source_frames - offset)
+        frames = min(frames, len(self.buffer) - start)
+
+        # Skip the part of the clip before the window
+        done = max(0, -start)
+        while done < frames:
+            source_pos = offset + done
+            if loop and loop_points is not None:
+                count = min(CHUNK_FRAMES, frames - done)
+                chunk = looped_frames(
+                    samples, source_pos, count, loop_points.loop_start, loop_points.loop_end, loop_points.crossfade
+                )
+            else:
+                if loop:
+                    source_pos %= source_frames
+                count = min(CHUNK_FRAMES, frames - done, source_frames - source_pos)
+                chunk = samples[source_pos:source_pos + count].astype(np.float32)
+            chunk *= gain
+            gains = envelope_gains(envelope, done, count)
+            if gains is not None:
+                chunk *= gains[:, None]
+            self.buffer[start + done:start + done + count] += chunk
+            done += count
+
+    def to_int16(self) -> np.ndarray:
+        return np.clip(self.buffer, -32768, 32767).astype(np.int16)
+
+    def export(self, out_path: str, format: str = "mp3", bitrate: Optional[str] = None):
+        array_to_segment(self.to_int16()).export(out_path, format=format, bitrate=bitrate)
+
+
+def probe_duration_ms(file_path: str) -> int:
+    """Duration of an audio file, from the asset index or the file header when possible."""
+    duration = asset_library.duration_ms(file_path)
+    if duration is not None:
+        return duration
+    try:
+        return int(round(sf.info(file_path).duration * 1000))
+    except Exception:
+        # Formats libsndfile can't read
+        return frames_to_ms(len(load_audio_array(file_path)))
+
+
+class LoudnessLookup:
+    """
+    Loudness of the files of a mix: library assets from the asset index,
+    TTS segments from the loudness sidecar of their story directory.
+    """
+
+    def __init__(self, load: Callable[[str], np.ndarray] = load_audio_array):
+        self.load = load
+        self._sidecars: dict[str, LoudnessSidecar] = {}
+
+    def __call__(self, file_path: str) -> Optional[float]:
+        if asset_library.duration_ms(file_path) is not None:
+            return asset_library.loudness(file_path)
+        directory = os.path.dirname(file_path)
+        sidecar = self._sidecars.setdefault(directory, LoudnessSidecar(directory))
+        return sidecar.get(file_path, self.load, SAMPLE_RATE)
+
+
+def render_window(
+    plan: RenderPlan,
+    load: Callable[[str], np.ndarray],
+    start_frame: int,
+    frames: int,
+    tracks: Optional[Sequence[str]] = None,
+    max_workers: int = 1
+) -> Timeline:
+    """
+    Render frames [start_frame, start_frame + frames) of a plan.
+
+    When the plan has ducking settings, the voice track is rendered with
+    enough context around the window to compute the same sidechain gains as
+    a full render, and the music and SFX tracks are scaled by them.
+    """
+    tracks = [track for track in TRACKS if tracks is None or track in tracks]
+    ducking = plan.ducking
+
+    def render_tracks(names: Sequence[str], start: int, count: int) -> Timeline:
+        timeline = Timeline(plan.length_ms, start, count)
+        for track in names:
+            for event in plan.track_events(track):
+                if ms_to_frames(event.start_ms) < start + count and ms_to_frames(event.end_ms) > start:
+                    timeline.add(
+                        load(event.source),
+                        event.start_ms,
+                        event.offset_ms,
+                        event.length_ms,
+                        envelope=event.envelope,
+                        gain=event.gain,
+                        loop=event.loop,
+                        loop_points=event.loop_points,
+                    )
+        return timeline
+
+    if ducking is None and (max_workers <= 1 or len(tracks) <= 1):
+        return render_tracks(tracks, start_frame, frames)
+
+    windows = {track: (start_frame, frames) for track in tracks}
+    if ducking is not None:
+        # The sidechain needs the narration around the window, even if voice isn't output
+        context = ms_to_frames(ducking.context_ms)
+        # Start on the RMS window grid of a full render
+        window = max(1, ms_to_frames(ducking.window_ms))
+        voice_start = max(0, (start_frame - context) // window * window)
+        voice_end = min(ms_to_frames(plan.length_ms), start_frame + frames + context)
+        windows["voice"] = (voice_start, voice_end - voice_start)
+
+    def render_track(track: str) -> Timeline:
+        return render_tracks([track], *windows[track])
+
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            rendered = dict(zip(windows, executor.map(render_track, windows)))
+    else:
+        rendered = {track: render_track(track) for track in windows}
+
+    timeline = Timeline(plan.length_ms, start_frame, frames)
+    activity = None
+    if ducking is not None:
+        crop = slice(start_frame - windows["voice"][0], start_frame - windows["voice"][0] + frames)
+        activity = sidechain_activity(rendered["voice"].buffer, ducking)[crop]
+        rendered["voice"].buffer = rendered["voice"].buffer[crop]
+    for track in tracks:
+        buffer = rendered[track].buffer
+        if activity is not None and ducking.depth_db(track):
+            buffer *= duck_gain(activity, ducking.depth_db(track))[:, None]
+        timeline.buffer += buffer
+    return timeline
+
+
+def render_plan(
+    plan: RenderPlan,
+    load: Callable[[str], np.ndarray] = load_audio_array,
+    tracks: Optional[Sequence[str]] = None,
+    max_workers: int = 1
+) -> Timeline:
+    """
+    Execute a render plan.
+
+    Args:
+        plan: Plan from `plan_mix`
+        load: Returns the int16 samples of a source file
+        tracks: Only render these tracks, all by default
+        max_workers: Render tracks on separate buffers in this many threads, then sum them
+
+    Returns:
+        The rendered Timeline
+    """
+    return render_window(plan, load, 0, ms_to_frames(plan.length_ms), tracks, max_workers)
+
+
+def iter_plan_blocks(
+    plan: RenderPlan,
+    load: Callable[[str], np.ndarray] = load_audio_array,
+    block_ms: int = BLOCK_MS,
+    release: Optional[Callable[[str], None]] = None
+) -> Iterator[np.ndarray]:
+    """
+    Render a plan in fixed-size blocks.
+
+    Only one block is held at a time, plus the sources of the clips it
+    overlaps. Each source is passed to `release` after the block holding
+    its last clip, so a decode cache can drop it.
+
+    Yields:
+        int16 (frames, CHANNELS) blocks, in order
+    """
+    total_frames = ms_to_frames(plan.length_ms)
+    block_frames = ms_to_frames(block_ms)
+    # Narration stays in use while later blocks still need it as sidechain context
+    context = ms_to_frames(plan.ducking.context_ms) if plan.ducking is not None else 0
+    last_use = {}
+    for event in plan.events:
+        end = ms_to_frames(event.end_ms) + (context if event.track == "voice" else 0)
+        last_use[event.source] = max(end, last_use.get(event.source, 0))
+
+    for block_start in range(0, total_frames, block_frames):
+        block_end = min(total_frames, block_start + block_frames)
+        yield render_window(plan, load, block_start, block_end - block_start).to_int16()
+
+        if release is not None:
+            for source, end in list(last_use.items()):
+                if end <= block_end:
+                    release(source)
+                    del last_use[source]
+
+
+class StreamEncoder:
+    """
+    Long-lived ffmpeg process that encodes raw PCM blocks written to it.
+
+    The output is written to a temporary file and moved into place on
+    `close`, so an interrupted mix never leaves a truncated file behind.
+    """
+
+    def __init__(self, out_path: str, format: str = "mp3", bitrate: Optional[str] = None, codec: Optional[str] = None):
+        self.out_path = out_path
+        self.tmp_path = f"{out_path}.part"
+        command = [
+            AudioSegment.converter, "-y", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS), "-i", "pipe:0",
+        ]
+        if codec:
+            command += ["-acodec", codec]
+        if bitrate:
+            command += ["-b:a", bitrate]
+        command += ["-f", format, self.tmp_path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, block: np.ndarray):
+        self.process.stdin.write(np.ascontiguousarray(block, dtype=np.int16).tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        stderr = self.process.stderr.read()
+        if self.process.wait() != 0:
+            raise Exception(f"Encoding {self.out_path} failed: {stderr.decode(errors='replace')}")
+        os.replace(self.tmp_path, self.out_path)
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def parse_export(spec: str) -> Tuple[str, Optional[str]]:
+    """Parse a "format[:bitrate]" export spec, e.g. "mp3:64k" or "opus:32k"."""
+    format, _, bitrate = spec.partition(":")
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{format}', expected one of {list(EXPORT_FORMATS)}")
+    return format, bitrate or None
+
+
+def export_targets(out_path: str, exports: Sequence[str] = ()) -> List[dict]:
+    """
+    Output files of a mix: `out_path` as mp3, plus one file per extra export
+    spec, named after `out_path` with the bitrate, e.g. mixed_64k.mp3.
+
+    Returns:
+        Dicts with "path", "format" and "bitrate"
+    """
+    targets = [{"path": out_path, "format": "mp3", "bitrate": None}]
+    stem = os.path.splitext(out_path)[0]
+    for spec in exports:
+        format, bitrate = parse_export(spec)
+        extension = EXPORT_FORMATS[format][2]
+        path = f"{stem}_{bitrate}.{extension}" if bitrate else f"{stem}.{extension}"
+        if all(target["path"] != path for target in targets):
+            targets.append({"path": path, "format": format, "bitrate": bitrate})
+    return targets
+
+
+class MultiEncoder:
+    """
+    Fans every block out to one StreamEncoder per target.
+
+    Blocks are written to all encoders from separate threads, so the ffmpeg
+    processes encode in parallel instead of waiting on each other's pipes.
+    """
+
+    def __init__(self, targets: Sequence[dict]):
+        self.encoders = []
+        try:
+            for target in targets:
+                muxer, codec, _ = EXPORT_FORMATS[target["format"]]
+                self.encoders.append(StreamEncoder(target["path"], format=muxer, bitrate=target["bitrate"], codec=codec))
+        except Exception:
+            self.abort()
+            raise
+        self._executor = ThreadPoolExecutor(max_workers=len(self.encoders))
+
+    def write(self, block: np.ndarray):
+        block = np.ascontiguousarray(block, dtype=np.int16)
+        for future in [self._executor.submit(encoder.write, block) for encoder in self.encoders]:
+            future.result()
+
+    def close(self):
+        self._executor.shutdown()
+        errors = []
+        for encoder in self.encoders:
+            try:
+                encoder.close()
+            except Exception as e:
+                errors.append(str(e))
+        if errors:
+            raise Exception("; ".join(errors))
+
+    def abort(self):
+        if hasattr(self, "_executor"):
+            self._executor.shutdown()
+        for encoder in self.encoders:
+            encoder.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def stream_plan(
+    plan: RenderPlan,
+    targets: Sequence[dict],
+    load: Callable[[str], np.ndarray] = load_audio_array,
+    block_ms: int = BLOCK_MS,
+    release: Optional[Callable[[str], None]] = None
+):
+    """Render a plan block by block straight into one encoder process per target."""
+    with MultiEncoder(targets) as encoder:
+        for block in iter_plan_blocks(plan, load, block_ms, release):
+            encoder.write(block)
+
+
+def render_timeline(
+    parsed_sfx_output: dict,
+    plan_path: Optional[str] = None,
+    cache: Optional[DecodeCache] = None,
+    ducking: Optional[Ducking] = None,
+    normalization: Optional[Normalization] = None
+) -> Timeline:
+    """
+    Mix a story on a preallocated NumPy timeline.
+
+    The parsed output is compiled into a render plan first, which gives the
+    total length, then every clip is written into one float32 buffer instead
+    of concatenating AudioSegments.
+
+    Args:
+        parsed_sfx_output: Parsed SFX output
+        plan_path: Where to save the render plan as JSON, if given
+        cache: Decode cache for this mix, a new one by default
+        ducking: Duck music and SFX under the narration instead of the fixed drops
+        normalization: Loudness targets folded into the clip gains
+
+    Returns:
+        The rendered Timeline
+    """
+    # Files decoded to measure them are reused by the renderer
+    cache = cache if cache is not None else DecodeCache(load_audio_array)
+    plan = plan_mix(
+        parsed_sfx_output,
+        lambda file_path: frames_to_ms(len(cache.get(file_path))),
+        ducking,
+        normalization,
+        LoudnessLookup(cache.get),
+        asset_library.loop_points,
+    )
+    if plan_path:
+        plan.save(plan_path)
+    return render_plan(plan, cache.get)
+
+
+def mix_audio_numpy(
+    parsed_sfx_output: dict,
+    out_path: str,
+    plan_path: Optional[str] = None,
+    stream: bool = False,
+    exports: Sequence[str] = (),
+    ducking: Optional[Ducking] = None,
+    normalization: Optional[Normalization] = None
+):
+    """
+    Mix audio files according to specified modes with the NumPy engine.
+
+    Args:
+        parsed_sfx_output: Parsed SFX output
+        out_path: Output path for the mixed audio file
+        plan_path: Where to save the render plan as JSON, if given
+        stream: Render in blocks piped to ffmpeg, so memory doesn't grow with the story length
+        exports: Extra "format[:bitrate]" outputs encoded from the same render, see `export_targets`
+        ducking: Duck music and SFX under the narration instead of the fixed drops
+        normalization: Loudness targets folded into the clip gains
+    """
+    cache = DecodeCache(load_audio_array)
+    targets = export_targets(out_path, exports)
+    if stream:
+        # Durations come from file headers, and sources are dropped after their last clip
+        plan = plan_mix(
+            parsed_sfx_output,
+            probe_duration_ms,
+            ducking,
+            normalization,
+            LoudnessLookup(cache.get),
+            asset_library.loop_points,
+        )
+        if plan_path:
+            plan.save(plan_path)
+        stream_plan(plan, targets, cache.get, release=cache.discard)
+    else:
+        samples = render_timeline(parsed_sfx_output, plan_path, cache, ducking, normalization).to_int16()
+        with MultiEncoder(targets) as encoder:
+            encoder.write(samples)
+    cache.log_stats(out_path)
+    return out_path
@@ -0,0 +1,250 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from fab_audio.asset_library import SAMPLE_RATE, segment_to_array
+from fab_audio.mix_audio import mix_audio, render_mix_pydub
+from fab_audio.mix_engine import (
+    MultiEncoder,
+    StreamEncoder,
+    export_targets,
+    Timeline,
+    frames_to_ms,
+    iter_plan_blocks,
+    ms_to_frames,
+    probe_duration_ms,
+    render_plan,
+    render_timeline,
+)
+from fab_audio.render_plan import Ducking, LoopPoints, Normalization, RenderPlan, plan_mix
+
+
+def write_wav(path, seconds, freq):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = 0.3 * np.sin(2 * np.pi * freq * t)
+    sf.write(str(path), np.stack([tone, tone], axis=1), SAMPLE_RATE, subtype="PCM_16")
+    return str(path)
+
+
+def assert_matches_reference(parsed):
+    reference = segment_to_array(render_mix_pydub(parsed)).astype(np.float32)
+    mixed = render_timeline(parsed).to_int16().astype(np.float32)
+
+    assert abs(frames_to_ms(len(mixed)) - frames_to_ms(len(reference))) <= 1
+    frames = min(len(mixed), len(reference))
+    # pydub fades in 1 ms steps and rounds to int16 after every operation
+    error = np.abs(mixed[:frames] - reference[:frames])
+    assert np.sqrt(np.mean(error ** 2)) < 0.01 * 32767 * 0.3
+    assert np.percentile(error, 99) < 0.05 * 32767
+
+
+def test_matches_pydub_for_all_modes(tmp_path):
+    paths = {
+        "opening": write_wav(tmp_path / "opening.wav", 30, 220),
+        "bg": write_wav(tmp_path / "bg.wav", 7, 110),
+        "sfx": write_wav(tmp_path / "sfx.wav", 8, 660),
+        "short_sfx": write_wav(tmp_path / "short.wav", 2.5, 880),
+    }
+    stories = [write_wav(tmp_path / f"{i}.wav", seconds, 330 + 50 * i) for i, seconds in enumerate([2, 4, 3, 5, 2, 9])]
+
+    parsed = {
+        "audio_paths": [
+            paths["opening"], stories[1],
+            paths["bg"],
+            stories[2],
+            paths["sfx"],
+            paths["short_sfx"],
+            paths["sfx"], stories[3],
+            stories[4],
+            paths["sfx"], stories[5],
+            paths["sfx"],
+        ],
+        "mixing_instructions": [
+            "opening", "story",
+            "bg_music",
+            "story",
+            "exclusive",
+            "exclusive",
+            "overlay", "story",
+            "story",
+            "overlay", "story",
+            "overlay",
+        ],
+    }
+    assert_matches_reference(parsed)
+
+
+def test_title_is_framed_by_silence(tmp_path):
+    title = write_wav(tmp_path / "title.wav", 2, 440)
+    parsed = {"audio_paths": [title, title], "mixing_instructions": ["title", "title"]}
+
+    reference = segment_to_array(render_mix_pydub(parsed))
+    mixed = render_timeline(parsed).to_int16()
+
+    # pydub's silence is resampled from 11025 Hz and comes out a few frames short
+    assert abs(frames_to_ms(len(mixed)) - frames_to_ms(len(reference))) <= 1
+    assert frames_to_ms(len(mixed)) == 6000
+    assert not mixed[:SAMPLE_RATE].any()
+    assert not mixed[3 * SAMPLE_RATE:].any()
+    assert np.array_equal(mixed[SAMPLE_RATE:3 * SAMPLE_RATE], segment_to_array(render_mix_pydub(
+        {"audio_paths": [title], "mixing_instructions": ["story"]}
+    )))
+
+
+def test_timeline_loops_and_applies_envelope():
+    source = np.full((SAMPLE_RATE // 10, 2), 1000, dtype=np.int16)
+    timeline = Timeline(1000)
+    timeline.add(source, start_ms=500, length_ms=1000, envelope=[(0, 1.0), (500, 0.0)], loop=True)
+
+    buffer = timeline.buffer
+    assert len(buffer) == SAMPLE_RATE
+    assert np.all(buffer[:SAMPLE_RATE // 2] == 0)
+    assert abs(buffer[SAMPLE_RATE // 2, 0] - 1000) < 1
+    assert abs(buffer[3 * SAMPLE_RATE // 4, 0] - 500) < 1
+    assert abs(buffer[-1, 0]) < 1
+
+
+def test_render_plan_round_trips_and_renders_by_track(tmp_path):
+    story = write_wav(tmp_path / "story.wav", 3, 330)
+    sfx = write_wav(tmp_path / "sfx.wav", 6, 660)
+    parsed = {"audio_paths": [sfx, story], "mixing_instructions": ["overlay", "story"]}
+    durations = {story: 3000, sfx: 6000}
+
+    plan = plan_mix(parsed, durations.__getitem__)
+    assert plan.length_ms == 6000
+    assert [(event.track, event.start_ms, event.length_ms) for event in plan.events] == [
+        ("sfx", 0, 3000), ("voice", 3000, 3000), ("sfx", 3000, 3000)
+    ]
+
+    plan.save(str(tmp_path / "plan.json"))
+    assert RenderPlan.load(str(tmp_path / "plan.json")) == plan
+
+    full = render_plan(plan).buffer
+    voice = render_plan(plan, tracks=["voice"]).buffer
+    sfx_only = render_plan(plan, tracks=["sfx"]).buffer
+    assert np.allclose(voice + sfx_only, full)
+    assert np.allclose(render_plan(plan, max_workers=2).buffer, full)
+    assert not voice[:3 * SAMPLE_RATE].any()
+
+
+def test_plan_rejects_events_past_the_end():
+    with pytest.raises(ValueError):
+        RenderPlan(length_ms=1000, events=[{"source": "a.wav", "start_ms": 500, "length_ms": 1000}])
+
+
+def test_blocks_match_full_render(tmp_path):
+    story = write_wav(tmp_path / "story.wav", 4, 330)
+    sfx = write_wav(tmp_path / "sfx.wav", 6, 660)
+    bg = write_wav(tmp_path / "bg.wav", 1.5, 110)
+    parsed = {
+        "audio_paths": [bg, sfx, story, sfx, story],
+        "mixing_instructions": ["bg_music", "overlay", "story", "exclusive", "story"],
+    }
+    plan = plan_mix(parsed, probe_duration_ms)
+    released = []
+
+    blocks = list(iter_plan_blocks(plan, block_ms=700, release=released.append))
+
+    assert np.array_equal(np.concatenate(blocks), render_plan(plan).to_int16())
+    assert all(len(block) == ms_to_frames(700) for block in blocks[:-1])
+    assert sorted(released) == sorted(plan.sources())
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_stream_encoder_writes_complete_file(tmp_path):
+    out_path = str(tmp_path / "out.wav")
+    with StreamEncoder(out_path, format="wav") as encoder:
+        for _ in range(3):
+            encoder.write(np.full((SAMPLE_RATE, 2), 100, dtype=np.int16))
+
+    assert sf.info(out_path).frames == 3 * SAMPLE_RATE
+    assert not os.path.exists(out_path + ".part")
+
+
+def test_export_targets_are_named_after_the_bitrate():
+    assert export_targets("out/a/mixed.mp3", ["mp3:64k", "opus:32k", "wav", "mp3:64k"]) == [
+        {"path": "out/a/mixed.mp3", "format": "mp3", "bitrate": None},
+        {"path": "out/a/mixed_64k.mp3", "format": "mp3", "bitrate": "64k"},
+        {"path": "out/a/mixed_32k.opus", "format": "opus", "bitrate": "32k"},
+        {"path": "out/a/mixed.wav", "format": "wav", "bitrate": None},
+    ]
+    with pytest.raises(ValueError):
+        export_targets("out/a/mixed.mp3", ["flac"])
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_one_render_feeds_every_encoder(tmp_path):
+    targets = export_targets(str(tmp_path / "mixed.mp3"), ["wav", "mp3:64k"])
+    with MultiEncoder(targets) as encoder:
+        encoder.write(np.full((SAMPLE_RATE, 2), 100, dtype=np.int16))
+
+    assert all(os.path.getsize(target["path"]) > 0 for target in targets)
+
+
+def test_ducking_lowers_music_only_under_the_narration(tmp_path):
+    bg = write_wav(tmp_path / "bg.wav", 2, 110)
+    story = write_wav(tmp_path / "story.wav", 3, 330)
+    silence = str(tmp_path / "silence.wav")
+    sf.write(silence, np.zeros((3 * SAMPLE_RATE, 2)), SAMPLE_RATE, subtype="PCM_16")
+    parsed = {
+        "audio_paths": [bg, silence, story, silence, silence],
+        "mixing_instructions": ["bg_music", "story", "story", "story", "story"],
+    }
+    plan = plan_mix(parsed, probe_duration_ms, Ducking())
+    music = render_plan(plan, tracks=["music"]).buffer
+    full_music = render_plan(plan_mix(parsed, probe_duration_ms), tracks=["music"]).buffer
+
+    def level(buffer, start_s, end_s):
+        return np.sqrt(np.mean(buffer[int(start_s * SAMPLE_RATE):int(end_s * SAMPLE_RATE)] ** 2))
+
+    # Full volume before the narration, about -15dB in the middle of it, back up after it
+    assert level(music, 1, 2.5) == pytest.approx(level(full_music, 1, 2.5), rel=0.01)
+    assert level(music, 4, 5) == pytest.approx(level(music, 1, 2.5) * 10 ** (-15 / 20), rel=0.05)
+    assert level(music, 9, 10) == pytest.approx(level(music, 1, 2.5), rel=0.01)
+
+    # Blocks get the same gains as a full render
+    blocks = np.concatenate(list(iter_plan_blocks(plan, block_ms=1300)))
+    assert np.abs(blocks.astype(np.float32) - render_plan(plan).to_int16()).max() <= 2
+
+
+def test_normalization_is_folded_into_clip_gains(tmp_path):
+    story = write_wav(tmp_path / "story.wav", 3, 330)
+    sfx = write_wav(tmp_path / "sfx.wav", 4, 660)
+    parsed = {"audio_paths": [story, sfx], "mixing_instructions": ["story", "exclusive"]}
+    loudness = {story: -24.0, sfx: -40.0}
+
+    plan = plan_mix(parsed, probe_duration_ms, normalization=Normalization(), loudness_lufs=loudness.get)
+
+    voice, effect = plan.events
+    assert voice.gain == pytest.approx(10 ** (6 / 20))
+    # Quiet files are boosted by at most max_boost_db
+    assert effect.gain == pytest.approx(10 ** (12 / 20))
+    with pytest.raises(ValueError):
+        plan_mix(parsed, probe_duration_ms, normalization=Normalization())
+
+
+def test_timeline_loops_between_loop_points_in_any_window():
+    source = np.arange(SAMPLE_RATE, dtype=np.int16)[:, None].repeat(2, axis=1)
+    points = LoopPoints(loop_start=1000, loop_end=SAMPLE_RATE - 1000, crossfade=500)
+    full = Timeline(5000)
+    full.add(source, start_ms=0, length_ms=5000, loop=True, loop_points=points)
+
+    frames = full.buffer[:, 0]
+    period = points.loop_end - points.loop_start
+    assert frames[points.loop_end] == points.loop_start
+    assert frames[points.loop_end + period + 10] == points.loop_start + 10
+
+    window = Timeline(5000, start_frame=3 * SAMPLE_RATE, frames=SAMPLE_RATE)
+    window.add(source, start_ms=0, length_ms=5000, loop=True, loop_points=points)
+    assert np.array_equal(window.buffer, full.buffer[3 * SAMPLE_RATE:4 * SAMPLE_RATE])
+
+
+def test_pydub_backend_rejects_numpy_only_options(tmp_path):
+    parsed = {"audio_paths": [], "mixing_instructions": []}
+    with pytest.raises(ValueError, match="Ducking"):
+        mix_audio(parsed, str(tmp_path / "mixed.mp3"), backend="pydub", duck=True)
+    with pytest.raises(ValueError, match="normalization"):
+        mix_audio(parsed, str(tmp_path / "mixed.mp3"), backend="pydub", normalize=True)
@@ -0,0 +1,112 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpus() -> int:
+    """Cores this process may run on, which can be fewer than the machine has (containers, taskset)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _warm_worker():
+    """Process initializer: map every ingested library asset once, for all jobs of this worker."""
+    from fab_audio.asset_library import asset_library
+
+    for file_path in list(asset_library.index):
+        asset_library.load(file_path)
+
+
+def _timed_job(fn: Callable[..., Any], args: tuple, kwargs: dict) -> dict:
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return {"pid": os.getpid(), "seconds": time.perf_counter() - start, "result": result}
+
+
+def _mix_job(parsed_sfx_output: dict, out_path: str, **kwargs) -> dict:
+    from fab_audio.mix_audio import mix_audio
+    from fab_audio.render_plan import RenderPlan
+
+    mix_audio(parsed_sfx_output, out_path, **kwargs)
+    plan_path = kwargs.get("plan_path")
+    audio_seconds = RenderPlan.load(plan_path).length_ms / 1000 if plan_path and os.path.exists(plan_path) else None
+    return {"out_path": out_path, "audio_seconds": audio_seconds}
+
+
+class MixFarm:
+    """
+    Pool of mixing processes fed by the pipeline's mix stage.
+
+    Mixing is CPU bound, so the pipeline threads hand each story to one of
+    these processes instead of mixing under the GIL. Workers live for the
+    whole run and map the asset library when they start, so library assets
+    stay warm from one job to the next. Per-worker busy time and throughput
+    are kept to size machines.
+
+    Workers are started lazily from a pipeline thread while other threads
+    hold locks, so they are spawned rather than forked: a forked child could
+    inherit a lock held by another thread and deadlock on it.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or available_cpus()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_worker
+        )
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.workers: dict[int, dict] = {}
+
+    def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` in a worker process and wait for its result."""
+        report = self._executor.submit(_timed_job, fn, args, kwargs).result()
+        with self._lock:
+            stats = self.workers.setdefault(report["pid"], {"jobs": 0, "seconds": 0.0, "audio_seconds": 0.0})
+            stats["jobs"] += 1
+            stats["seconds"] += report["seconds"]
+            if isinstance(report["result"], dict) and report["result"].get("audio_seconds"):
+                stats["audio_seconds"] += report["result"]["audio_seconds"]
+        return report["result"]
+
+    def mix(self, parsed_sfx_output: dict, out_path: str, **kwargs) -> str:
+        """`mix_audio` in a worker process; blocks the calling thread until it is done."""
+        return self.run(_mix_job, parsed_sfx_output, out_path, **kwargs)["out_path"]
+
+    def stats(self) -> dict:
+        """Per-worker jobs, busy seconds, utilization and audio seconds mixed per busy second."""
+        elapsed = time.perf_counter() - self._started
+        with self._lock:
+            return {
+                pid: {
+                    **stats,
+                    "utilization": stats["seconds"] / elapsed if elapsed else 0.0,
+                    "realtime_factor": stats["audio_seconds"] / stats["seconds"] if stats["seconds"] else 0.0,
+                }
+                for pid, stats in self.workers.items()
+            }
+
+    def log_stats(self):
+        for pid, stats in sorted(self.stats().items()):
+            logger.info(
+                f"Mix worker {pid}: {stats['jobs']} jobs, {stats['seconds']:.1f}s busy "
+                f"({stats['utilization']:.0%}), {stats['audio_seconds']:.0f}s of audio "
+                f"at {stats['realtime_factor']:.1f}x realtime"
+            )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
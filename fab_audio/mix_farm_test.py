@@ -0,0 +1,88 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from fab_audio import mix_audio as mix_audio_module
+from fab_audio.asset_library import SAMPLE_RATE, AssetLibrary
+from fab_audio.mix_farm import MixFarm, _mix_job
+from fab_audio.render_plan import RenderPlan
+
+
+def square(x):
+    return {"value": x * x, "pid": os.getpid(), "audio_seconds": 2.0}
+
+
+def warm_assets():
+    from fab_audio.asset_library import asset_library
+
+    # Mapped by the initializer before any job ran
+    return sorted(asset_library._arrays)
+
+
+def write_wav(path, seconds):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t)
+    sf.write(str(path), np.stack([tone, tone], axis=1), SAMPLE_RATE, subtype="PCM_16")
+    return str(path)
+
+
+def test_jobs_run_in_worker_processes():
+    with MixFarm(max_workers=2) as farm:
+        results = [farm.run(square, x) for x in range(4)]
+        stats = farm.stats()
+
+    assert [result["value"] for result in results] == [0, 1, 4, 9]
+    assert all(result["pid"] != os.getpid() for result in results)
+    assert set(stats) == {result["pid"] for result in results}
+    assert sum(worker["jobs"] for worker in stats.values()) == 4
+    assert sum(worker["audio_seconds"] for worker in stats.values()) == 8.0
+    for worker in stats.values():
+        assert 0 < worker["utilization"] <= 1
+        assert worker["realtime_factor"] == pytest.approx(worker["audio_seconds"] / worker["seconds"])
+
+
+def test_workers_start_with_the_library_mapped(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "sfx")
+    asset = write_wav(tmp_path / "sfx" / "bark.wav", 0.5)
+    AssetLibrary(str(tmp_path / "decoded")).ingest([str(tmp_path / "sfx")])
+    # Spawned workers build their asset library from the environment
+    monkeypatch.setenv("ASSET_CACHE_DIR", str(tmp_path / "decoded"))
+
+    with MixFarm(max_workers=1) as farm:
+        assert farm.run(warm_assets) == [os.path.normpath(asset)]
+
+
+def test_mix_job_reports_the_length_of_the_plan(tmp_path, monkeypatch):
+    mixed = []
+
+    def mix_audio(parsed_sfx_output, out_path, plan_path=None, **kwargs):
+        mixed.append((out_path, kwargs))
+        if plan_path:
+            RenderPlan(length_ms=2500, events=[]).save(plan_path)
+
+    monkeypatch.setattr(mix_audio_module, "mix_audio", mix_audio)
+    plan_path = str(tmp_path / "render_plan.json")
+
+    assert _mix_job({}, "mixed.mp3", plan_path=plan_path, duck=True) == {"out_path": "mixed.mp3", "audio_seconds": 2.5}
+    assert mixed == [("mixed.mp3", {"duck": True})]
+    assert _mix_job({}, "mixed.mp3") == {"out_path": "mixed.mp3", "audio_seconds": None}
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_stories_are_mixed_in_the_workers(tmp_path):
+    parsed = {
+        "audio_paths": [write_wav(tmp_path / "0.wav", 1.0), write_wav(tmp_path / "1.wav", 0.5)],
+        "mixing_instructions": ["story", "story"],
+    }
+    plan_path = str(tmp_path / "render_plan.json")
+
+    with MixFarm(max_workers=1) as farm:
+        assert farm.mix(parsed, str(tmp_path / "mixed.mp3"), plan_path=plan_path) == str(tmp_path / "mixed.mp3")
+        (stats,) = farm.stats().values()
+
+    assert os.path.getsize(tmp_path / "mixed.mp3") > 0
+    assert stats["jobs"] == 1
+    assert stats["audio_seconds"] == RenderPlan.load(plan_path).length_ms / 1000
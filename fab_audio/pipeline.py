@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StoryPipeline:
+    """
+    Run story jobs through an ordered chain of stages.
+
+    Every stage has its own bounded worker pool, so while one story is being
+    mixed the next one can already be in the SFX or TTS stage. A stage function
+    receives the job object and returns it (possibly updated) for the next stage.
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[Any], Any], int]]):
+        """
+        Args:
+            stages: List of (name, function, workers) tuples, in execution order
+        """
+        if not stages:
+            raise ValueError("At least one stage is required")
+
+        self.stages = stages
+        self._executors = [
+            ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"stage-{name}")
+            for name, _, workers in stages
+        ]
+        self._lock = threading.Lock()
+        self._in_flight: set[Future] = set()
+        self.stats = {name: {"done": 0, "failed": 0, "seconds": 0.0} for name, _, _ in stages}
+
+    def submit(self, job: Any) -> Future:
+        """
+        Queue a job at the first stage.
+
+        Returns:
+            Future resolved with the job once it has passed every stage, or with
+            the exception raised by the stage that failed
+        """
+        result = Future()
+        with self._lock:
+            self._in_flight.add(result)
+        self._run_stage(0, job, result)
+        return result
+
+    def wait_for_slot(self, limit: int) -> List[Future]:
+        """
+        Block until fewer than `limit` jobs are in flight, or none at all.
+
+        Returns:
+            Result futures of the jobs that finished since the last call
+        """
+        finished = []
+        while True:
+            with self._lock:
+                done = {future for future in self._in_flight if future.done()}
+                self._in_flight -= done
+                in_flight = list(self._in_flight)
+            finished.extend(done)
+            if not in_flight or len(in_flight) < limit:
+                return finished
+            wait(in_flight, return_when=FIRST_COMPLETED)
+
+    def _run_stage(self, index: int, job: Any, result: Future):
+        if index == len(self.stages):
+            result.set_result(job)
+            return
+
+        stage_future = self._executors[index].submit(self._timed_call, index, job)
+        stage_future.add_done_callback(lambda f: self._advance(index, f, result))
+
+    def _timed_call(self, index: int, job: Any) -> Any:
+        name, fn, _ = self.stages[index]
+        start = time.perf_counter()
+        try:
+            job = fn(job)
+        except Exception:
+            self._record(name, "failed", time.perf_counter() - start)
+            raise
+        self._record(name, "done", time.perf_counter() - start)
+        return job
+
+    def _record(self, name: str, outcome: str, seconds: float):
+        with self._lock:
+            self.stats[name][outcome] += 1
+            self.stats[name]["seconds"] += seconds
+
+    def _advance(self, index: int, stage_future: Future, result: Future):
+        error = stage_future.exception()
+        if error is not None:
+            result.set_exception(error)
+            return
+        self._run_stage(index + 1, stage_future.result(), result)
+
+    def shutdown(self):
+        """Wait for queued work and stop all worker pools, first stage first."""
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+
+    def log_stats(self):
+        for name, stats in self.stats.items():
+            logger.info(
+                f"Stage '{name}': {stats['done']} done, {stats['failed']} failed, "
+                f"{stats['seconds']:.1f}s busy"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from fab_audio.pipeline import StoryPipeline
+
+
+def test_jobs_pass_every_stage_in_order():
+    with StoryPipeline([
+        ("sfx", lambda job: job + ["sfx"], 2),
+        ("tts", lambda job: job + ["tts"], 2),
+        ("mix", lambda job: job + ["mix"], 1),
+    ]) as pipeline:
+        futures = [pipeline.submit([i]) for i in range(5)]
+        results = [future.result(timeout=5) for future in futures]
+
+    assert results == [[i, "sfx", "tts", "mix"] for i in range(5)]
+    assert all(stats["done"] == 5 and stats["failed"] == 0 for stats in pipeline.stats.values())
+
+
+def test_failing_stage_only_fails_its_own_job():
+    mixed = []
+
+    def tts(job):
+        if job == 1:
+            raise RuntimeError("quota exceeded")
+        return job
+
+    with StoryPipeline([("tts", tts, 1), ("mix", lambda job: mixed.append(job) or job, 1)]) as pipeline:
+        futures = [pipeline.submit(i) for i in range(3)]
+        with pytest.raises(RuntimeError, match="quota exceeded"):
+            futures[1].result(timeout=5)
+        assert [futures[0].result(timeout=5), futures[2].result(timeout=5)] == [0, 2]
+
+    # The failed job never reaches the later stages
+    assert sorted(mixed) == [0, 2]
+    assert pipeline.stats["tts"]["done"] == 2 and pipeline.stats["tts"]["failed"] == 1
+    assert pipeline.stats["mix"]["done"] == 2 and pipeline.stats["mix"]["failed"] == 0
+
+
+def test_a_later_stage_works_while_an_earlier_one_is_busy():
+    release = threading.Event()
+    mixed = threading.Event()
+
+    def sfx(job):
+        if job == 1:
+            # Story 1 is still being tagged when story 0 reaches the mix stage
+            assert release.wait(5)
+        return job
+
+    def mix(job):
+        if job == 0:
+            mixed.set()
+        return job
+
+    with StoryPipeline([("sfx", sfx, 2), ("mix", mix, 1)]) as pipeline:
+        futures = [pipeline.submit(i) for i in range(2)]
+        assert mixed.wait(5)
+        release.set()
+        assert [future.result(timeout=5) for future in futures] == [0, 1]
+
+
+def test_wait_for_slot_bounds_the_jobs_in_flight():
+    release = threading.Event()
+
+    def stage(job):
+        assert release.wait(5)
+        return job
+
+    with StoryPipeline([("tts", stage, 4)]) as pipeline:
+        for i in range(2):
+            pipeline.submit(i)
+        # Below the limit: returns right away
+        assert pipeline.wait_for_slot(3) == []
+
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.extend(pipeline.wait_for_slot(2)))
+        waiter.start()
+        waiter.join(0.2)
+        assert waiter.is_alive()
+
+        release.set()
+        waiter.join(5)
+        assert not waiter.is_alive()
+        # Every job that finished is handed back once
+        finished = waited + pipeline.wait_for_slot(1)
+        assert sorted(future.result() for future in finished) == [0, 1]
+        assert pipeline.wait_for_slot(1) == []
+
+
+def test_at_least_one_stage_is_required():
+    with pytest.raises(ValueError):
+        StoryPipeline([])
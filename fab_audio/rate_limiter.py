@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Mapping, Optional
+
+from openai import APIStatusError, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token count of a request (about four characters per token)."""
+    return sum(len(text) for text in texts if text) // 4 + 1
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds to wait according to the `retry-after-ms` / `retry-after` headers."""
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue
+    return None
+
+
+# How long a budget the server reported as used up is assumed to stay so without a reset header
+DEFAULT_RESET_SECONDS = 1.0
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds of an `x-ratelimit-reset-*` header, either a number of seconds or a duration like "6m0s"."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts or "".join(number + unit for number, unit in parts) != value.strip():
+        return None
+    scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+class TokenBucket:
+    """
+    Continuously refilling budget of `per_minute` units.
+
+    Independently of `per_minute`, the budget the server last reported as
+    remaining is spent down until its reset time, so the headers pace calls
+    even when no budget is configured.
+    """
+
+    def __init__(self, per_minute: Optional[float]):
+        self.per_minute = per_minute
+        self.level = per_minute or 0.0
+        self._updated = time.monotonic()
+        self.reported: Optional[float] = None
+        self.reset_at = 0.0
+
+    def _refill(self, now: float):
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def _reported_wait(self, amount: float, now: float) -> float:
+        if self.reported is None:
+            return 0.0
+        if now >= self.reset_at:
+            # The server's window has reset; its budget is unknown until the next response
+            self.reported = None
+            return 0.0
+        return 0.0 if self.reported >= amount else self.reset_at - now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available (0 if it is available now)."""
+        reported_wait = self._reported_wait(amount, now)
+        if not self.per_minute:
+            return reported_wait
+        self._refill(now)
+        # Requests larger than the whole budget are let through once the bucket is full
+        amount = min(amount, self.per_minute)
+        if self.level >= amount:
+            return reported_wait
+        return max(reported_wait, (amount - self.level) * 60 / self.per_minute)
+
+    def take(self, amount: float, now: float):
+        if self.reported is not None:
+            self.reported -= amount
+        if self.per_minute:
+            self._refill(now)
+            self.level -= min(amount, self.per_minute)
+
+    def report(self, remaining: float, reset_seconds: Optional[float], now: float):
+        """Record the budget the server reports as remaining until `reset_seconds` from now."""
+        self.clamp(remaining, now)
+        self.reported = remaining
+        self.reset_at = now + (DEFAULT_RESET_SECONDS if reset_seconds is None else reset_seconds)
+
+    def clamp(self, remaining: float, now: float):
+        """Lower the budget to what the server reports as remaining."""
+        if self.per_minute:
+            self._refill(now)
+            self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """
+    Paces calls to one Azure OpenAI deployment across all threads and tasks.
+
+    Calls are gated by a requests/min and a tokens/min budget, which are kept
+    in line with the `x-ratelimit-remaining-*` headers (which pause callers
+    until `x-ratelimit-reset-*` even with no budget set), and by a concurrency
+    limit that follows an AIMD policy: it grows by roughly one slot per round
+    of successful calls and is halved on every 429. A `Retry-After` from the
+    server pauses every caller until it has passed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._cond = threading.Condition()
+
+    def _try_acquire(self, tokens: int) -> float:
+        # Called with the lock held; returns 0 once a slot was taken, else seconds to wait
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= int(self.concurrency):
+            return 0.05
+        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+        self.in_flight += 1
+        return 0.0
+
+    def _release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, tokens: int = 1):
+        """Block until a call of about `tokens` tokens may start."""
+        with self._cond:
+            while (wait := self._try_acquire(tokens)) > 0:
+                self._cond.wait(timeout=wait)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def async_slot(self, tokens: int = 1):
+        """Async version of `slot` for the realtime path."""
+        while True:
+            with self._cond:
+                wait = self._try_acquire(tokens)
+            if wait == 0:
+                break
+            await asyncio.sleep(wait)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def on_success(self):
+        with self._cond:
+            # Additive increase: about one extra slot per window of successful calls
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        with self._cond:
+            self.throttled += 1
+            # Multiplicative decrease
+            self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        logger.warning(
+            f"Rate limited on '{self.name}', concurrency now {int(self.concurrency)}"
+            + (f", pausing {retry_after:.1f}s" if retry_after else "")
+        )
+
+    def update_from_headers(self, headers: Optional[Mapping[str, str]]):
+        if not headers:
+            return
+        now = time.monotonic()
+        with self._cond:
+            for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                value = headers.get(f"x-ratelimit-remaining-{kind}")
+                if value is not None:
+                    try:
+                        remaining = float(value)
+                    except ValueError:
+                        continue
+                    bucket.report(remaining, parse_reset(headers.get(f"x-ratelimit-reset-{kind}")), now)
+
+    def update_from_realtime(self, rate_limits: list):
+        """Apply the limits of a realtime `rate_limits.updated` message."""
+        now = time.monotonic()
+        with self._cond:
+            for limit in rate_limits:
+                bucket = {"requests": self.requests, "tokens": self.tokens}.get(limit.name)
+                if bucket is not None:
+                    bucket.clamp(limit.remaining, now)
+                if limit.remaining <= 0:
+                    self.blocked_until = max(self.blocked_until, now + limit.reset_seconds)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None, base_delay: Optional[float] = None) -> float:
+        """Delay before retry `attempt` (0-based): Retry-After if known, else exponential with full jitter."""
+        if retry_after is not None:
+            return retry_after
+        base = self.base_delay if base_delay is None else base_delay
+        return random.uniform(0, min(self.max_delay, base * 2 ** attempt))
+
+    def call(
+        self,
+        create: Callable[[], Any],
+        tokens: int = 1,
+        max_retries: int = 5,
+        consume: Optional[Callable[[Any], Any]] = None
+    ) -> Any:
+        """
+        Run an OpenAI `with_raw_response` call under the limiter and return the parsed result.
+
+        429s are retried here with backoff; any other error is raised to the caller.
+        With `consume`, its result on the parsed response is returned instead, and
+        the slot is held until it returns, e.g. while a streamed response is read.
+        """
+        for attempt in range(max_retries + 1):
+            with self.slot(tokens):
+                try:
+                    raw = create()
+                except RateLimitError as e:
+                    retry_after = parse_retry_after(e.response.headers)
+                    self.update_from_headers(e.response.headers)
+                    self.on_rate_limited(retry_after)
+                    if attempt == max_retries:
+                        raise
+                    delay = self.backoff(attempt, retry_after)
+                except APIStatusError as e:
+                    self.update_from_headers(e.response.headers)
+                    raise
+                else:
+                    self.update_from_headers(raw.headers)
+                    self.on_success()
+                    result = raw.parse()
+                    return consume(result) if consume is not None else result
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "concurrency": int(self.concurrency),
+                "in_flight": self.in_flight,
+                "throttled": self.throttled,
+                "requests_remaining": self.requests.level if self.requests.per_minute else None,
+                "tokens_remaining": self.tokens.level if self.tokens.per_minute else None,
+            }
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """
+    Process-wide limiter for a deployment. Budgets come from the
+    `<NAME>_RPM`, `<NAME>_TPM` and `<NAME>_MAX_CONCURRENCY` environment variables
+    (name upper-cased, dashes and dots replaced by underscores). Unset budgets
+    are not paced up front; 429s and Retry-After still are.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            prefix = name.upper().replace("-", "_").replace(".", "_")
+            rpm = os.getenv(f"{prefix}_RPM")
+            tpm = os.getenv(f"{prefix}_TPM")
+            _limiters[name] = RateLimiter(
+                name,
+                requests_per_minute=float(rpm) if rpm else None,
+                tokens_per_minute=float(tpm) if tpm else None,
+                max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "16")),
+            )
+        return _limiters[name]
@@ -0,0 +1,129 @@
+import time
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+from fab_audio.rate_limiter import RateLimiter, parse_reset, parse_retry_after
+
+
+class RawResponse:
+    def __init__(self, value, headers=None):
+        self.value = value
+        self.headers = headers or {}
+
+    def parse(self):
+        return self.value
+
+
+def rate_limit_error(headers):
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://example.com"))
+    return RateLimitError("Too many requests", response=response, body=None)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after({"retry-after-ms": "1500"}) == 1.5
+    assert parse_retry_after({"retry-after": "3"}) == 3.0
+    assert parse_retry_after({"retry-after": "soon"}) is None
+    assert parse_retry_after({}) is None
+
+
+def test_backoff_is_exponential_with_jitter():
+    limiter = RateLimiter("test", base_delay=1.0, max_delay=10.0)
+    for attempt in range(6):
+        delay = limiter.backoff(attempt)
+        assert 0 <= delay <= min(10.0, 2 ** attempt)
+    assert limiter.backoff(3, retry_after=7.0) == 7.0
+
+
+def test_concurrency_follows_aimd():
+    limiter = RateLimiter("test", max_concurrency=8)
+    limiter.on_rate_limited()
+    assert int(limiter.concurrency) == 4
+    limiter.on_rate_limited()
+    assert int(limiter.concurrency) == 2
+    for _ in range(20):
+        limiter.on_success()
+    assert 2 < limiter.concurrency <= 8
+
+
+def test_call_retries_rate_limited_requests():
+    limiter = RateLimiter("test")
+    responses = [rate_limit_error({"retry-after-ms": "1"}), RawResponse("ok", {"x-ratelimit-remaining-requests": "5"})]
+
+    def create():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert limiter.call(create) == "ok"
+    assert limiter.stats()["throttled"] == 1
+    assert limiter.in_flight == 0
+
+
+def test_call_holds_the_slot_while_consuming():
+    limiter = RateLimiter("test")
+
+    def consume(chunks):
+        assert limiter.in_flight == 1
+        return "".join(chunks)
+
+    assert limiter.call(lambda: RawResponse(iter(["a", "b"]), {}), consume=consume) == "ab"
+    assert limiter.in_flight == 0
+
+
+def test_call_gives_up_after_max_retries():
+    limiter = RateLimiter("test")
+
+    def create():
+        raise rate_limit_error({"retry-after-ms": "1"})
+
+    with pytest.raises(RateLimitError):
+        limiter.call(create, max_retries=2)
+    assert limiter.stats()["throttled"] == 3
+
+
+def test_remaining_headers_lower_the_budget():
+    limiter = RateLimiter("test", requests_per_minute=600, tokens_per_minute=6000)
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "2", "x-ratelimit-remaining-tokens": "100"})
+
+    assert limiter.requests.level <= 2.5
+    assert limiter.tokens.level <= 150
+    with limiter.slot(tokens=50):
+        assert limiter.in_flight == 1
+
+
+def test_parse_reset():
+    assert parse_reset("6m0s") == 360.0
+    assert parse_reset("1s") == 1.0
+    assert parse_reset("20ms") == 0.02
+    assert parse_reset("2.5") == 2.5
+    assert parse_reset("soon") is None
+    assert parse_reset(None) is None
+
+
+def test_remaining_headers_pace_calls_without_a_configured_budget():
+    limiter = RateLimiter("test")
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "200ms"})
+
+    started = time.monotonic()
+    with limiter.slot():
+        waited = time.monotonic() - started
+    assert 0.15 <= waited <= 1.0
+
+    # Once the window has reset, calls go through until the server reports again
+    started = time.monotonic()
+    with limiter.slot():
+        assert time.monotonic() - started < 0.05
+
+
+def test_reported_tokens_are_spent_down_until_the_reset():
+    limiter = RateLimiter("test")
+    limiter.update_from_headers({"x-ratelimit-remaining-tokens": "1000", "x-ratelimit-reset-tokens": "10s"})
+
+    with limiter.slot(tokens=800):
+        pass
+    assert limiter._try_acquire(800) > 5
+    assert limiter._try_acquire(100) == 0
+    limiter._release()
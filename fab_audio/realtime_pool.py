@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+from azure.core.credentials import AzureKeyCredential
+
+from fab_audio.realtime_tts import configure_session, get_env_var, synthesize_segment
+from rtclient import RTClient
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SegmentJob:
+    out_dir: str
+    fname: str
+    text: str
+    future: asyncio.Future
+    attempts: int = 0
+
+
+@dataclass
+class SessionStats:
+    segments: int = 0
+    failures: int = 0
+    reconnects: int = 0
+    last_error: Optional[str] = None
+
+
+async def open_azure_session() -> RTClient:
+    """Connect and configure a realtime session from the REALTIME_AZURE_OPENAI_* variables."""
+    client = RTClient(
+        url=get_env_var("REALTIME_AZURE_OPENAI_ENDPOINT"),
+        key_credential=AzureKeyCredential(get_env_var("REALTIME_AZURE_OPENAI_API_KEY")),
+        azure_deployment=get_env_var("REALTIME_AZURE_OPENAI_DEPLOYMENT"),
+    )
+    await client.connect()
+    try:
+        await configure_session(client)
+    except BaseException:
+        await client.close()
+        raise
+    return client
+
+
+async def session_alive(client: RTClient) -> bool:
+    """Whether a session's websocket is still open and answers a ping."""
+    if client.closed:
+        return False
+    try:
+        await client.ping()
+    except Exception:
+        return False
+    return True
+
+
+async def synthesize_and_check(client: RTClient, job: SegmentJob):
+    response = await synthesize_segment(client, job.out_dir, job.fname, job.text, forget=True)
+    if response.status != "completed":
+        raise RuntimeError(f"Response {response.id} for {job.fname} ended as {response.status}")
+
+
+class RealtimeSessionPool:
+    """
+    N connected, already-configured realtime sessions fed from one queue.
+
+    Segments of every story go into a shared queue and whichever session is
+    free takes the next one, so throughput scales with the number of
+    sessions instead of being bound to one session per story. A session that
+    fails is closed and replaced in the background while the others keep
+    working; its segment goes back into the queue for another attempt.
+    Sessions are also checked before every segment and every
+    `health_check_interval` seconds while idle, so one the server has
+    dropped is replaced before work is handed to it.
+    Each segment's items are deleted from the conversation once it is read,
+    so a session carries no context from one story to the next.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        open_session: Callable[[], Awaitable[RTClient]] = open_azure_session,
+        synthesize: Callable[[RTClient, SegmentJob], Awaitable[None]] = synthesize_and_check,
+        max_attempts: int = 3,
+        reconnect_delay: float = 1.0,
+        is_alive: Callable[[RTClient], Awaitable[bool]] = session_alive,
+        health_check_interval: float = 30.0
+    ):
+        self.size = size
+        self.open_session = open_session
+        self.synthesize = synthesize
+        self.max_attempts = max_attempts
+        self.reconnect_delay = reconnect_delay
+        self.is_alive = is_alive
+        self.health_check_interval = health_check_interval
+        self.stats = [SessionStats() for _ in range(size)]
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self):
+        """
+        Open every session before the first segment arrives.
+
+        Each session gets `max_attempts` tries; if one still can't connect, e.g.
+        because of a missing variable or a bad key, the sessions already open
+        are closed and its error is raised.
+        """
+        self._queue = asyncio.Queue()
+        results = await asyncio.gather(
+            *(self._connect(index, attempts=self.max_attempts) for index in range(self.size)),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for result in results:
+                if not isinstance(result, BaseException):
+                    await self._close(result)
+            raise errors[0]
+        self._workers = [asyncio.create_task(self._work(index, session)) for index, session in enumerate(results)]
+
+    async def _connect(self, index: int, attempts: Optional[int] = None) -> RTClient:
+        """Open a session, retrying with backoff up to `attempts` times, or forever when reconnecting."""
+        delay = self.reconnect_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self.open_session()
+            except Exception as e:
+                self.stats[index].last_error = str(e)
+                if attempts is not None and attempt >= attempts:
+                    raise
+                logger.warning(f"Realtime session {index} failed to connect: {e}; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(60.0, delay * 2)
+
+    async def _close(self, session: RTClient):
+        try:
+            await session.close()
+        except Exception:
+            pass
+
+    async def _reconnect(self, index: int, session: RTClient) -> RTClient:
+        await self._close(session)
+        session = await self._connect(index)
+        self.stats[index].reconnects += 1
+        return session
+
+    async def _check(self, index: int, session: RTClient) -> RTClient:
+        """The session, or a new one if it was dropped."""
+        if await self.is_alive(session):
+            return session
+        logger.warning(f"Realtime session {index} was disconnected; reconnecting")
+        self.stats[index].last_error = "disconnected"
+        return await self._reconnect(index, session)
+
+    async def _work(self, index: int, session: RTClient):
+        stats = self.stats[index]
+        getter: Optional[asyncio.Future] = None
+        try:
+            while True:
+                # The pending get is kept across health checks, so no job is lost to a timeout
+                if getter is None:
+                    getter = asyncio.ensure_future(self._queue.get())
+                done, _ = await asyncio.wait({getter}, timeout=self.health_check_interval)
+                if not done:
+                    session = await self._check(index, session)
+                    continue
+                job: SegmentJob = getter.result()
+                getter = None
+                try:
+                    session = await self._check(index, session)
+                    job.attempts += 1
+                    await self.synthesize(session, job)
+                    stats.segments += 1
+                    if not job.future.done():
+                        job.future.set_result(os.path.join(job.out_dir, f"{job.fname}.wav"))
+                except Exception as e:
+                    stats.failures += 1
+                    stats.last_error = str(e)
+                    logger.warning(f"Realtime session {index} failed on {job.out_dir}/{job.fname}: {e}")
+                    if job.attempts < self.max_attempts:
+                        # Another session picks it up while this one reconnects
+                        self._queue.put_nowait(job)
+                    elif not job.future.done():
+                        job.future.set_exception(e)
+                    session = await self._reconnect(index, session)
+                finally:
+                    self._queue.task_done()
+        finally:
+            if getter is not None:
+                getter.cancel()
+            await self._close(session)
+
+    def submit(self, out_dir: str, fname: str, text: str) -> asyncio.Future:
+        """
+        Queue one segment.
+
+        Returns:
+            Future resolved with the path of the written WAV file
+        """
+        if self._queue is None:
+            raise RuntimeError("The session pool is not started")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(SegmentJob(out_dir, fname, text, future))
+        return future
+
+    async def synthesize_story(self, out_dir: str, segments: List[str]) -> List[str]:
+        """Read every segment of a story on whichever sessions are free; files are named 0.wav, 1.wav, ..."""
+        os.makedirs(out_dir, exist_ok=True)
+        return await asyncio.gather(*(self.submit(out_dir, f"{i}", text) for i, text in enumerate(segments)))
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+async def with_session_pool(stories: List[tuple[str, List[str]]], size: int = 4):
+    """Read several stories, given as (out_dir, text segments), over one pool of sessions."""
+    async with RealtimeSessionPool(size) as pool:
+        return await asyncio.gather(*(pool.synthesize_story(out_dir, segments) for out_dir, segments in stories))
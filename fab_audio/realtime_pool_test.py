@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from fab_audio.realtime_pool import RealtimeSessionPool
+
+
+class FakeSession:
+    opened = 0
+
+    def __init__(self):
+        FakeSession.opened += 1
+        self.number = FakeSession.opened
+        self.closed = False
+        self.dropped = False
+
+    async def ping(self):
+        if self.dropped:
+            raise ConnectionResetError("Cannot write to closing transport")
+
+    async def close(self):
+        self.closed = True
+
+
+async def open_session():
+    return FakeSession()
+
+
+def test_segments_spread_over_sessions_and_dead_ones_are_replaced(tmp_path):
+    served = {}
+
+    async def synthesize(session, job):
+        if session.number == 1:
+            raise ConnectionError("socket closed")
+        await asyncio.sleep(0.01)
+        served.setdefault(session.number, []).append(job.fname)
+        (tmp_path / f"{job.fname}.wav").write_bytes(b"")
+
+    async def main():
+        async with RealtimeSessionPool(3, open_session, synthesize, reconnect_delay=0) as pool:
+            paths = await pool.synthesize_story(str(tmp_path), [f"segment {i}" for i in range(12)])
+            return paths, pool.stats
+
+    FakeSession.opened = 0
+    paths, stats = asyncio.run(main())
+
+    assert paths == [str(tmp_path / f"{i}.wav") for i in range(12)]
+    # Session 1 died on its first segment and was replaced by session 4
+    assert 1 not in served and 4 in served
+    assert stats[0].failures == 1 and stats[0].reconnects == 1
+    assert sum(len(fnames) for fnames in served.values()) == 12
+    assert len(served) == 3
+
+
+def test_segment_fails_after_max_attempts(tmp_path):
+    async def synthesize(session, job):
+        raise RuntimeError("content filter")
+
+    async def main():
+        async with RealtimeSessionPool(2, open_session, synthesize, max_attempts=2, reconnect_delay=0) as pool:
+            await pool.synthesize_story(str(tmp_path), ["segment"])
+
+    with pytest.raises(RuntimeError, match="content filter"):
+        asyncio.run(main())
+
+
+def test_start_fails_when_a_session_cannot_connect():
+    attempts = []
+    opened = []
+
+    async def open_failing():
+        attempts.append(1)
+        if len(attempts) > 1:
+            raise OSError("Environment variable 'REALTIME_AZURE_OPENAI_API_KEY' is not set or is empty.")
+        opened.append(FakeSession())
+        return opened[-1]
+
+    async def synthesize(session, job):
+        pass
+
+    async def main():
+        async with RealtimeSessionPool(2, open_failing, synthesize, max_attempts=3, reconnect_delay=0):
+            pass
+
+    FakeSession.opened = 0
+    with pytest.raises(OSError, match="REALTIME_AZURE_OPENAI_API_KEY"):
+        asyncio.run(main())
+    # One session connected, the other gave up after three tries
+    assert len(attempts) == 4
+    assert len(opened) == 1 and opened[0].closed
+
+
+def test_idle_sessions_dropped_by_the_server_are_replaced(tmp_path):
+    served = []
+
+    async def synthesize(session, job):
+        served.append(session.number)
+
+    async def main():
+        opened = []
+
+        async def open_tracked():
+            opened.append(FakeSession())
+            return opened[-1]
+
+        async with RealtimeSessionPool(1, open_tracked, synthesize, reconnect_delay=0, health_check_interval=0.01) as pool:
+            opened[0].dropped = True
+            await asyncio.sleep(0.1)
+            # Replaced while idle, before any segment was handed to it
+            assert opened[0].closed and len(opened) == 2
+            await pool.synthesize_story(str(tmp_path), ["segment"])
+            return pool.stats[0]
+
+    FakeSession.opened = 0
+    stats = asyncio.run(main())
+
+    assert served == [2]
+    assert stats.failures == 0 and stats.reconnects == 1
@@ -7,10 +7,10 @@ import sys
 import time
 import json
 import re
-import numpy as np
-import soundfile as sf
+from contextlib import AsyncExitStack
 from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
+from fab_audio.rate_limiter import estimate_tokens, get_rate_limiter
 
 from rtclient import (
     InputTextContentPart,
@@ -20,12 +20,16 @@ from rtclient import (
     RTMessageItem,
     RTResponse,
     NoTurnDetection,
+    ResponseCreateParams,
     UserMessageItem,
 )
 load_dotenv()
 
 start_time = time.time()
 
+# Responses queued on one session at once in pipelined mode
+PIPELINE_DEPTH = 3
+
 INSTRUCTIONS="""
 Read the children's story with lively, expressive emotions, creating an engaging, fun, and captivating experience for young listeners.
 
@@ -74,26 +78,18 @@ async def receive_message_item(item: RTMessageItem, out_dir: str, fname: str):
     async for contentPart in item:
         if contentPart.type == "audio":
 
-            async def collect_audio(audioContentPart: RTAudioContent):
-                audio_data = bytearray()
-                async for chunk in audioContentPart.audio_chunks():
-                    audio_data.extend(chunk)
-                return audio_data
-
             async def collect_transcript(audioContentPart: RTAudioContent):
                 audio_transcript: str = ""
                 async for chunk in audioContentPart.transcript_chunks():
                     audio_transcript += chunk
                 return audio_transcript
 
-            audio_task = asyncio.create_task(collect_audio(contentPart))
+            # The audio goes straight to disk as it streams in
+            audio_task = asyncio.create_task(contentPart.save_to(os.path.join(out_dir, f"{fname}.wav")))
             transcript_task = asyncio.create_task(collect_transcript(contentPart))
-            audio_data, audio_transcript = await asyncio.gather(audio_task, transcript_task)
-            print(prefix, f"Audio received with length: {len(audio_data)}")
+            audio_frames, audio_transcript = await asyncio.gather(audio_task, transcript_task)
+            print(prefix, f"Audio received with length: {audio_frames * 2}")
             print(prefix, f"Audio Transcript: {audio_transcript}")
-            with open(os.path.join(out_dir, f"{fname}.wav"), "wb") as out:
-                audio_array = np.frombuffer(audio_data, dtype=np.int16)
-                sf.write(out, audio_array, samplerate=24000)
             with open(
                 os.path.join(out_dir, f"{fname}.audio_transcript.txt"),
                 "w",
@@ -119,19 +115,72 @@ async def receive_function_call_item(item: RTFunctionCallItem, out_dir: str, fna
 
 async def receive_response(client: RTClient, response: RTResponse, out_dir: str, fname: str):
     prefix = f"[response={response.id}]"
+    item_tasks = []
     async for item in response:
         print(prefix, f"Received item {item.id}")
         if item.type == "message":
-            asyncio.create_task(receive_message_item(item, out_dir, fname))
+            item_tasks.append(asyncio.create_task(receive_message_item(item, out_dir, fname)))
         elif item.type == "function_call":
-            asyncio.create_task(receive_function_call_item(item, out_dir, fname))
+            item_tasks.append(asyncio.create_task(receive_function_call_item(item, out_dir, fname)))
 
+    # The files of this response are written once its items are done
+    await asyncio.gather(*item_tasks)
     print(prefix, f"Response completed ({response.status})")
 
 
-async def run(client: RTClient, out_dir: str, story: list[str]):
+async def run_pipelined(client: RTClient, out_dir: str, story: list[str], depth: int = PIPELINE_DEPTH):
+    """
+    Queue the next segments' responses while the previous audio is still streaming.
+
+    Each segment's text is appended to the conversation by its own response,
+    created with cancel_previous=False so the server queues it behind the
+    running one instead of cancelling it. Responses are created one at a time
+    and in order, and every item streamed back carries its response id, so
+    the audio of segment i always lands in {i}.wav.
+    """
+    rate_limiter = get_rate_limiter(os.getenv("REALTIME_AZURE_OPENAI_DEPLOYMENT", "realtime"))
+    in_flight = asyncio.Semaphore(depth)
+
+    async def receive(slots: AsyncExitStack, response: RTResponse, fname: str):
+        async with slots:
+            await receive_response(client, response, out_dir, fname)
+        rate_limits = client.latest_rate_limits()
+        if rate_limits:
+            rate_limiter.update_from_realtime(rate_limits)
+
+    receivers = []
+    for i, user_message in enumerate(story):
+        msg = f"Read out the following text: {user_message}"
+        # Held until the segment's audio is received
+        slots = AsyncExitStack()
+        await slots.enter_async_context(in_flight)
+        await slots.enter_async_context(rate_limiter.async_slot(estimate_tokens(INSTRUCTIONS, msg, user_message)))
+        try:
+            log(f"Queueing response for: {msg}")
+            response = await client.generate_response(ResponseCreateParams(
+                cancel_previous=False,
+                append_input_items=[UserMessageItem(content=[InputTextContentPart(text=msg)])],
+            ))
+        except BaseException:
+            await slots.aclose()
+            raise
+        log(f"Response {response.id} queued for segment {i}")
+        receivers.append(asyncio.create_task(receive(slots, response, f"{i}")))
+    await asyncio.gather(*receivers)
+
+
+async def run(client: RTClient, out_dir: str, story: list[str], pipelined: bool = False):
     user_messages = story
 
+    await configure_session(client)
+    if pipelined:
+        await run_pipelined(client, out_dir, story)
+        return
+    for i, user_message in enumerate(user_messages):
+        await synthesize_segment(client, out_dir, f"{i}", user_message)
+
+
+async def configure_session(client: RTClient):
     log("Configuring Session...")
     await client.configure(
         instructions=INSTRUCTIONS,
@@ -139,14 +188,33 @@ async def run(client: RTClient, out_dir: str, story: list[str]):
         voice="alloy",
     )
     log("Done")
-    for i, user_message in enumerate(user_messages):
-        msg = f"Read out the following text: {user_message}"
+
+
+async def synthesize_segment(
+    client: RTClient, out_dir: str, fname: str, user_message: str, forget: bool = False
+) -> RTResponse:
+    """
+    Read one segment out on a session and write {fname}.wav to out_dir.
+
+    Args:
+        forget: Delete the segment's items from the conversation afterwards, so a
+            session shared between stories doesn't carry their context along
+    """
+    rate_limiter = get_rate_limiter(os.getenv("REALTIME_AZURE_OPENAI_DEPLOYMENT", "realtime"))
+    msg = f"Read out the following text: {user_message}"
+    async with rate_limiter.async_slot(estimate_tokens(INSTRUCTIONS, msg, user_message)):
         log(f"Sending User Message: {msg}")
-        await client.send_item(UserMessageItem(content=[InputTextContentPart(text=msg)]))
+        item = await client.send_item(UserMessageItem(content=[InputTextContentPart(text=msg)]))
         log("Done")
         response = await client.generate_response()
-        fname = f"{i}"
         await receive_response(client, response, out_dir, fname)
+    rate_limits = client.latest_rate_limits()
+    if rate_limits:
+        rate_limiter.update_from_realtime(rate_limits)
+    if forget:
+        for item_id in [item.id] + [output.id for output in response.output]:
+            await client.remove_item(item_id)
+    return response
 
 
 def get_env_var(var_name: str) -> str:
@@ -156,22 +224,22 @@ def get_env_var(var_name: str) -> str:
     return value
 
 
-async def with_azure_openai(out_dir: str, story: list[str]):
+async def with_azure_openai(out_dir: str, story: list[str], pipelined: bool = False):
     endpoint = get_env_var("REALTIME_AZURE_OPENAI_ENDPOINT")
     key = get_env_var("REALTIME_AZURE_OPENAI_API_KEY")
     deployment = get_env_var("REALTIME_AZURE_OPENAI_DEPLOYMENT")
     os.makedirs(out_dir, exist_ok=True)
     async with RTClient(url=endpoint, key_credential=AzureKeyCredential(key), azure_deployment=deployment) as client:
-        await run(client, out_dir, story)
+        await run(client, out_dir, story, pipelined)
 
     await client.close()
 
-async def with_openai(out_dir: str, story: list[str]):
+async def with_openai(out_dir: str, story: list[str], pipelined: bool = False):
     key = get_env_var("OPENAI_API_KEY")
     model = get_env_var("OPENAI_MODEL")
     os.makedirs(out_dir, exist_ok=True)
     async with RTClient(key_credential=AzureKeyCredential(key), model=model) as client:
-        await run(client, out_dir, story)
+        await run(client, out_dir, story, pipelined)
     await client.close()
 
 
@@ -184,4 +252,4 @@ if __name__ == "__main__":
     text_segments = sfx_data["text_segments"]
     
     # Run the text-to-speech generation
-    asyncio.run(with_azure_openai("out/alice", text_segments))
+    asyncio.run(with_azure_openai("out/alice", text_segments, pipelined="--pipelined" in sys.argv))
@@ -0,0 +1,98 @@
+import asyncio
+import base64
+
+import numpy as np
+import soundfile as sf
+from azure.core.credentials import AzureKeyCredential
+
+from fab_audio.realtime_tts import run_pipelined
+from rtclient import RTClient
+from rtclient.models import create_message_from_dict
+
+
+def audio_of(response: int, chunk: int) -> np.ndarray:
+    return np.full(100, response * 1000 + chunk, dtype=np.int16)
+
+
+class FakeServer:
+    """Answers response.create and then streams the two responses' items interleaved."""
+
+    def __init__(self):
+        self.sent = []
+        self.messages: asyncio.Queue = asyncio.Queue()
+        self.events = 0
+
+    def push(self, **message):
+        self.events += 1
+        self.messages.put_nowait(create_message_from_dict({"event_id": f"event_{self.events}", **message}))
+
+    def response(self, index: int, status: str = "in_progress") -> dict:
+        return {"id": f"resp_{index}", "status": status, "status_details": None, "output": [], "usage": None}
+
+    def item(self, index: int, status: str = "in_progress") -> dict:
+        return {"id": f"item_{index}", "type": "message", "status": status, "role": "assistant", "content": []}
+
+    async def send(self, message):
+        self.sent.append(message)
+        if message.type != "response.create":
+            return
+        index = sum(1 for sent in self.sent if sent.type == "response.create") - 1
+        self.push(type="response.created", response=self.response(index))
+        if index == 1:
+            self.stream_both()
+
+    def stream_both(self):
+        part = {"type": "audio", "transcript": None}
+        for r in (1, 0):
+            self.push(type="response.output_item.added", response_id=f"resp_{r}", output_index=0, item=self.item(r))
+            self.push(type="conversation.item.created", previous_item_id=None, item=self.item(r))
+            self.push(
+                type="response.content_part.added", response_id=f"resp_{r}", item_id=f"item_{r}",
+                output_index=0, content_index=0, part=part
+            )
+        for chunk in range(3):
+            for r in (1, 0):
+                self.push(
+                    type="response.audio.delta", response_id=f"resp_{r}", item_id=f"item_{r}", output_index=0,
+                    content_index=0, delta=base64.b64encode(audio_of(r, chunk).tobytes()).decode()
+                )
+        for r in (0, 1):
+            self.push(
+                type="response.content_part.done", response_id=f"resp_{r}", item_id=f"item_{r}",
+                output_index=0, content_index=0, part={"type": "audio", "transcript": f"segment {r}"}
+            )
+            self.push(
+                type="response.output_item.done", response_id=f"resp_{r}", output_index=0,
+                item=self.item(r, "completed")
+            )
+            self.push(type="response.done", response=self.response(r, "completed"))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.messages.get()
+
+
+def test_pipelined_audio_lands_in_the_file_of_its_response(tmp_path):
+    async def main():
+        client = RTClient(key_credential=AzureKeyCredential("key"), model="gpt-4o-realtime-preview")
+        await client._client._session.close()
+        server = FakeServer()
+        client._client = server
+        await asyncio.wait_for(run_pipelined(client, str(tmp_path), ["Once upon a time", "there was a fox"]), 10)
+        return server.sent
+
+    sent = asyncio.run(main())
+
+    for r in (0, 1):
+        written, rate = sf.read(str(tmp_path / f"{r}.wav"), dtype="int16")
+        assert rate == 24000
+        assert np.array_equal(written, np.concatenate([audio_of(r, chunk) for chunk in range(3)]))
+    creates = [message for message in sent if message.type == "response.create"]
+    assert len(creates) == 2
+    for create, text in zip(creates, ["Once upon a time", "there was a fox"]):
+        # Queued behind the running response instead of cancelling it, with the segment as its input
+        assert create.response.cancel_previous is False
+        assert '"cancel_previous":false' in create.model_dump_json(exclude_unset=True)
+        assert create.response.append_input_items[0].content[0].text.endswith(text)
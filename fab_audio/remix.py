@@ -0,0 +1,292 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fab_audio.asset_library import CHANNELS, DecodeCache, asset_library
+from fab_audio.mix_engine import (
+    LoudnessLookup,
+    MultiEncoder,
+    export_targets,
+    load_audio_array,
+    ms_to_frames,
+    probe_duration_ms,
+    render_plan,
+    render_window,
+    stream_plan,
+)
+from fab_audio.render_plan import TRACKS, ClipEvent, Ducking, Normalization, RenderPlan, plan_mix
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = "mix_state.json"
+
+
+def fingerprint(file_path: str) -> List[float]:
+    stat = os.stat(file_path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def mix_inputs_key(parsed_sfx_output: dict, ducking: Optional[Ducking], normalization: Optional[Normalization]) -> str:
+    """Hash of everything besides the source files that decides what a mix sounds like."""
+    inputs = {
+        "audio_paths": parsed_sfx_output["audio_paths"],
+        "mixing_instructions": parsed_sfx_output["mixing_instructions"],
+        "ducking": ducking.model_dump() if ducking is not None else None,
+        "normalization": normalization.model_dump() if normalization is not None else None,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def foreground(plan: RenderPlan) -> RenderPlan:
+    """The clips kept in the stems: everything but looped beds, which follow the story length and are cheap to regenerate."""
+    return plan.model_copy(update={"events": [event for event in plan.events if not event.loop], "ducking": None})
+
+
+def changed_range(
+    old_plan: RenderPlan,
+    old_fingerprints: Dict[str, List[float]],
+    new_plan: RenderPlan,
+    new_fingerprints: Dict[str, List[float]]
+) -> Optional[Tuple[int, int, int, FrozenSet[str]]]:
+    """
+    Time range of a new plan whose stems must be rendered again.
+
+    Clips are compared in plan order: a run of identical leading clips stays
+    in place, a run of identical trailing clips moved by the change in story
+    length is shifted, and everything in between is dirty. The range is
+    widened so no kept clip reaches into it from either side.
+
+    Returns:
+        (start_ms, end_ms, shift_ms, tracks) in the new plan, where the old
+        stems from end_ms - shift_ms onwards become the new stems from end_ms
+        and only the stems of `tracks` changed, or None if the foreground did
+        not change
+    """
+    def key(event: ClipEvent, fingerprints: Dict[str, List[float]]) -> str:
+        return json.dumps([event.model_dump(exclude={"start_ms"}), fingerprints.get(event.source)])
+
+    old_events = foreground(old_plan).events
+    new_events = foreground(new_plan).events
+    old_keys = [key(event, old_fingerprints) for event in old_events]
+    new_keys = [key(event, new_fingerprints) for event in new_events]
+    shift = new_plan.length_ms - old_plan.length_ms
+
+    prefix = 0
+    while (
+        prefix < min(len(old_events), len(new_events))
+        and old_keys[prefix] == new_keys[prefix]
+        and old_events[prefix].start_ms == new_events[prefix].start_ms
+    ):
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < min(len(old_events), len(new_events)) - prefix
+        and old_keys[-1 - suffix] == new_keys[-1 - suffix]
+        and old_events[-1 - suffix].start_ms + shift == new_events[-1 - suffix].start_ms
+    ):
+        suffix += 1
+
+    changed_old = old_events[prefix:len(old_events) - suffix]
+    changed_new = new_events[prefix:len(new_events) - suffix]
+    if shift == 0 and not changed_old and not changed_new:
+        return None
+
+    kept_before = new_events[:prefix]
+    kept_after = new_events[len(new_events) - suffix:]
+    starts = [event.start_ms for event in changed_old + changed_new]
+    ends = [event.end_ms for event in changed_new] + [event.end_ms + shift for event in changed_old]
+    if shift != 0:
+        # Moved clips must not reach into the part kept in place, and the other way around
+        starts += [event.start_ms - max(0, shift) for event in kept_after]
+        ends += [event.end_ms + max(0, shift) for event in kept_before]
+
+    start = max(0, min(starts, default=min(old_plan.length_ms, new_plan.length_ms)))
+    end = min(new_plan.length_ms, max(ends + [start]))
+    # A change of length moves every track; otherwise the other stems stay as they are
+    tracks = frozenset(TRACKS) if shift != 0 else frozenset(event.track for event in changed_old + changed_new)
+    return start, end, shift, tracks
+
+
+class StemCache:
+    """
+    Per-track stems of a story's last mix, for re-mixing only what changed.
+
+    The voice, SFX and music tracks are kept as int16 .npy files before
+    ducking and without the looped music bed, next to the plan they were
+    rendered from and the mtime and size of every source. When a segment is
+    regenerated, only the stretch of the stems around it is rendered again,
+    on its own track unless its length changed; the rest is copied, shifted
+    if the segment's length changed, and the final mix is rebuilt from the
+    memory-mapped stems.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.state_path = os.path.join(directory, STATE_NAME)
+
+    def stem_path(self, track: str) -> str:
+        return os.path.join(self.directory, f"{track}.npy")
+
+    def load_state(self) -> Optional[dict]:
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if not all(os.path.exists(self.stem_path(track)) for track in TRACKS):
+            return None
+        return state
+
+    def is_stale(self, parsed_sfx_output: dict, ducking: Optional[Ducking], normalization: Optional[Normalization]) -> bool:
+        """Whether the sources or settings of a mix changed since its stems were saved, without decoding anything."""
+        state = self.load_state()
+        if state is None or state["inputs"] != mix_inputs_key(parsed_sfx_output, ducking, normalization):
+            return True
+        for source, recorded in state["fingerprints"].items():
+            if not os.path.exists(source) or fingerprint(source) != recorded:
+                return True
+        return False
+
+    def update(
+        self,
+        plan: RenderPlan,
+        fingerprints: Dict[str, List[float]],
+        inputs: str,
+        load: Callable[[str], np.ndarray]
+    ) -> Dict[str, np.ndarray]:
+        """
+        Bring the stems up to date with `plan`, rendering as little as possible.
+
+        Returns:
+            Memory-mapped stems by track
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        state = self.load_state()
+        total_frames = ms_to_frames(plan.length_ms)
+        fg = foreground(plan)
+
+        dirty = (0, total_frames, 0, 0, frozenset(TRACKS))
+        if state is not None:
+            old_plan = RenderPlan.model_validate(state["plan"])
+            changed = changed_range(old_plan, state["fingerprints"], plan, fingerprints)
+            if changed is None:
+                dirty = None
+            else:
+                start_ms, end_ms, shift_ms, tracks = changed
+                old_frames = ms_to_frames(old_plan.length_ms)
+                start = ms_to_frames(start_ms)
+                # Frames copied from the end of the old stems; the split is moved
+                # so the rounding of the shift never leaves a gap
+                tail = max(0, min(total_frames - ms_to_frames(end_ms), old_frames - ms_to_frames(end_ms - shift_ms)))
+                dirty = (start, total_frames - tail, old_frames - tail, tail, tracks)
+
+        if dirty is not None:
+            start, end, old_tail_start, tail, tracks = dirty
+            old_stems = {track: np.load(self.stem_path(track), mmap_mode="r") for track in TRACKS} if state else {}
+            # The old state goes first, so a crash never pairs new stems with an old plan
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
+            for track in tracks:
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{track}-", suffix=".npy")
+                os.close(fd)
+                stem = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.int16, shape=(total_frames, CHANNELS))
+                if track in old_stems:
+                    stem[:start] = old_stems[track][:start]
+                    stem[end:] = old_stems[track][old_tail_start:old_tail_start + tail]
+                stem[start:end] = render_window(fg, load, start, end - start, tracks=[track]).to_int16()
+                stem.flush()
+                del stem
+                os.replace(tmp_path, self.stem_path(track))
+            logger.info(
+                f"Re-rendered {(end - start) / max(1, total_frames):.0%} of the {', '.join(sorted(tracks))} "
+                f"stems in {self.directory}"
+            )
+
+        self._save_state({"inputs": inputs, "fingerprints": fingerprints, "plan": plan.model_dump()})
+        return {track: np.load(self.stem_path(track), mmap_mode="r") for track in TRACKS}
+
+    def _save_state(self, state: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".mix_state-", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def stem_plan(self, plan: RenderPlan) -> RenderPlan:
+        """The final mix as a plan: one clip per stem, plus the looped beds, with the plan's ducking."""
+        events = [
+            ClipEvent(source=self.stem_path(track), start_ms=0, length_ms=plan.length_ms, track=track)
+            for track in TRACKS
+        ]
+        events += [event for event in plan.events if event.loop]
+        return RenderPlan(length_ms=plan.length_ms, events=events, ducking=plan.ducking)
+
+    def stem_loader(self, stems: Dict[str, np.ndarray], load: Callable[[str], np.ndarray]) -> Callable[[str], np.ndarray]:
+        """Source loader for a `stem_plan`: the stems by path, anything else through `load`."""
+        paths = {self.stem_path(track): stem for track, stem in stems.items()}
+        return lambda file_path: paths[file_path] if file_path in paths else load(file_path)
+
+
+def remix_numpy(
+    parsed_sfx_output: dict,
+    out_path: str,
+    stems_dir: str,
+    plan_path: Optional[str] = None,
+    stream: bool = False,
+    exports: Sequence[str] = (),
+    ducking: Optional[Ducking] = None,
+    normalization: Optional[Normalization] = None
+):
+    """
+    Mix a story with the NumPy engine, re-rendering only what changed since its last mix.
+
+    Args:
+        parsed_sfx_output: Parsed SFX output
+        out_path: Output path for the mixed audio file
+        stems_dir: Where the stems and their state are kept between mixes
+        plan_path: Where to save the render plan as JSON, if given
+        stream: Encode block by block from the memory-mapped stems
+        exports: Extra "format[:bitrate]" outputs, see `export_targets`
+        ducking: Duck music and SFX under the narration instead of the fixed drops
+        normalization: Loudness targets folded into the clip gains
+    """
+    missing = [source for source in parsed_sfx_output["audio_paths"] if not os.path.exists(source)]
+    if missing:
+        # A deleted segment has to be synthesized again, which is the TTS stage's job
+        raise FileNotFoundError(f"Cannot mix {out_path}, sources are missing: {', '.join(missing)}")
+
+    started = time.perf_counter()
+    cache = DecodeCache(load_audio_array)
+    stems = StemCache(stems_dir)
+    # Durations come from file headers, so unchanged segments are never decoded
+    plan = plan_mix(
+        parsed_sfx_output,
+        probe_duration_ms,
+        ducking,
+        normalization,
+        LoudnessLookup(cache.get),
+        asset_library.loop_points,
+    )
+    if plan_path:
+        plan.save(plan_path)
+
+    fingerprints = {source: fingerprint(source) for source in plan.sources()}
+    inputs = mix_inputs_key(parsed_sfx_output, ducking, normalization)
+    arrays = stems.update(plan, fingerprints, inputs, cache.get)
+    final = stems.stem_plan(plan)
+    load = stems.stem_loader(arrays, cache.get)
+
+    targets = export_targets(out_path, exports)
+    if stream:
+        stream_plan(final, targets, load)
+    else:
+        samples = render_plan(final, load).to_int16()
+        with MultiEncoder(targets) as encoder:
+            encoder.write(samples)
+    cache.log_stats(out_path)
+    logger.info(f"Mixed {out_path} from stems in {time.perf_counter() - started:.1f}s")
+    return out_path
@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from fab_audio.asset_library import SAMPLE_RATE
+from fab_audio.mix_engine import load_audio_array, probe_duration_ms, render_plan
+from fab_audio.remix import StemCache, changed_range, fingerprint, mix_inputs_key, remix_numpy
+from fab_audio.render_plan import TRACKS, plan_mix
+
+
+def write_wav(path, seconds, freq):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = 0.3 * np.sin(2 * np.pi * freq * t)
+    sf.write(str(path), np.stack([tone, tone], axis=1), SAMPLE_RATE, subtype="PCM_16")
+    return str(path)
+
+
+def story(tmp_path):
+    return {
+        "audio_paths": [
+            write_wav(tmp_path / "bg.wav", 2.0, 110),
+            write_wav(tmp_path / "0.wav", 2.0, 220),
+            write_wav(tmp_path / "door.wav", 4.0, 880),
+            write_wav(tmp_path / "1.wav", 1.5, 330),
+            write_wav(tmp_path / "2.wav", 2.0, 440),
+        ],
+        "mixing_instructions": ["bg_music", "story", "overlay", "story", "story"],
+    }
+
+
+def update(stems, parsed, loaded=None):
+    def load(file_path):
+        if loaded is not None:
+            loaded.append(os.path.basename(file_path))
+        return load_audio_array(file_path)
+
+    plan = plan_mix(parsed, probe_duration_ms)
+    fingerprints = {source: fingerprint(source) for source in plan.sources()}
+    return plan, stems.update(plan, fingerprints, mix_inputs_key(parsed, None, None), load)
+
+
+def test_regenerated_segment_only_re_renders_its_range(tmp_path):
+    parsed = story(tmp_path)
+    stems = StemCache(str(tmp_path / "stems"))
+    old_plan, _ = update(stems, parsed)
+    assert not stems.is_stale(parsed, None, None)
+
+    # Fix the middle segment; it comes back 250 ms longer
+    write_wav(tmp_path / "1.wav", 1.75, 660)
+    assert stems.is_stale(parsed, None, None)
+    loaded = []
+    plan, arrays = update(stems, parsed, loaded)
+
+    assert plan.length_ms == old_plan.length_ms + 250
+    assert "0.wav" not in loaded and "2.wav" not in loaded
+    assert not stems.is_stale(parsed, None, None)
+
+    # Same stems as a full render of the new story
+    _, fresh = update(StemCache(str(tmp_path / "fresh")), parsed)
+    for track in TRACKS:
+        assert np.array_equal(arrays[track], fresh[track])
+
+    # And the final mix from the stems, with the bed looped over the new length
+    final = render_plan(stems.stem_plan(plan), stems.stem_loader(arrays, load_audio_array))
+    reference = render_plan(plan).to_int16().astype(np.int32)
+    assert np.abs(final.to_int16().astype(np.int32) - reference).max() <= 2
+
+
+def test_unchanged_story_has_no_dirty_range(tmp_path):
+    parsed = story(tmp_path)
+    plan = plan_mix(parsed, probe_duration_ms)
+    fingerprints = {source: fingerprint(source) for source in plan.sources()}
+    assert changed_range(plan, fingerprints, plan, fingerprints) is None
+
+    touched = dict(fingerprints, **{parsed["audio_paths"][4]: [0.0, 0]})
+    start, end, shift, tracks = changed_range(plan, fingerprints, plan, touched)
+    assert (start, end, shift, tracks) == (plan.length_ms - 2000, plan.length_ms, 0, {"voice"})
+
+
+def test_deleted_segment_is_rebuilt_on_its_own_stem(tmp_path):
+    parsed = story(tmp_path)
+    stems = StemCache(str(tmp_path / "stems"))
+    plan, arrays = update(stems, parsed)
+    del arrays
+    untouched = {track: os.stat(stems.stem_path(track)).st_mtime_ns for track in ("sfx", "music")}
+
+    # Deleted to be synthesized again: the mix can't go ahead without it
+    os.remove(tmp_path / "1.wav")
+    assert stems.is_stale(parsed, None, None)
+    with pytest.raises(FileNotFoundError, match="1.wav"):
+        remix_numpy(parsed, str(tmp_path / "mixed.mp3"), stems.directory)
+
+    # It comes back as long as before
+    write_wav(tmp_path / "1.wav", 1.5, 660)
+    loaded = []
+    new_plan, arrays = update(stems, parsed, loaded)
+
+    assert new_plan.length_ms == plan.length_ms
+    assert set(loaded) == {"1.wav"}
+    assert {track: os.stat(stems.stem_path(track)).st_mtime_ns for track in ("sfx", "music")} == untouched
+    _, fresh = update(StemCache(str(tmp_path / "fresh")), parsed)
+    for track in TRACKS:
+        assert np.array_equal(arrays[track], fresh[track])
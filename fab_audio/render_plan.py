@@ -0,0 +1,289 @@
+import json
+import sys
+from typing import Callable, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, model_validator
+
+# Tracks a plan's events are rendered on
+TRACKS = ("voice", "sfx", "music")
+
+
+def db_to_gain(db: float) -> float:
+    return 10 ** (db / 20)
+
+
+class LoopPoints(BaseModel):
+    """Seamless loop region of a source, in frames, see `fab_audio.loop_points`."""
+    loop_start: int = Field(ge=0, description="First frame repeated after the loop end")
+    loop_end: int = Field(gt=0, description="Frame where playback jumps back to loop_start")
+    crossfade: int = Field(0, ge=0, description="Frames before loop_end crossfaded into the ones before loop_start")
+
+    @model_validator(mode="after")
+    def check_region(self):
+        if self.loop_end <= self.loop_start or self.crossfade > self.loop_start:
+            raise ValueError(f"Invalid loop region {self.loop_start}-{self.loop_end} with a {self.crossfade} frame crossfade")
+        return self
+
+
+class ClipEvent(BaseModel):
+    """One clip of a source file placed on the mix timeline."""
+    source: str = Field(description="Path of the audio file")
+    start_ms: int = Field(ge=0, description="Position of the clip in the mix")
+    offset_ms: int = Field(0, ge=0, description="Where the clip starts in the source")
+    length_ms: int = Field(ge=0, description="Length of the clip")
+    gain: float = Field(1.0, description="Constant linear gain")
+    envelope: Optional[List[Tuple[float, float]]] = Field(
+        None, description="Piecewise-linear (ms from clip start, linear gain) points on top of gain"
+    )
+    track: str = Field("voice", description="One of TRACKS")
+    loop: bool = Field(False, description="Repeat the source to fill length_ms")
+    loop_points: Optional[LoopPoints] = Field(None, description="Where to loop, the whole source by default")
+
+    @property
+    def end_ms(self) -> int:
+        return self.start_ms + self.length_ms
+
+
+class Ducking(BaseModel):
+    """Sidechain ducking of the music and SFX tracks under the narration."""
+    music_db: float = Field(-15, description="Music gain while the narration is speaking")
+    sfx_db: float = Field(-10, description="SFX gain while the narration is speaking")
+    threshold_db: float = Field(-45, description="Narration RMS level (dBFS) counted as speaking")
+    window_ms: float = Field(10, gt=0, description="RMS window")
+    hold_ms: float = Field(300, ge=0, description="How long a spoken window keeps the music down")
+    release_ms: float = Field(250, gt=0, description="Time constant of the gain smoothing")
+
+    def depth_db(self, track: str) -> float:
+        return {"music": self.music_db, "sfx": self.sfx_db}.get(track, 0.0)
+
+    @property
+    def context_ms(self) -> float:
+        """Narration needed around a window to compute its gains as in a full render."""
+        return self.hold_ms + 10 * self.release_ms + 2 * self.window_ms
+
+
+class Normalization(BaseModel):
+    """Loudness targets per track; every clip's gain is corrected from its measured loudness."""
+    voice_lufs: float = Field(-18, description="Target integrated loudness of the narration")
+    sfx_lufs: float = Field(-20, description="Target integrated loudness of the SFX")
+    music_lufs: float = Field(-20, description="Target integrated loudness of the music, before its drops")
+    max_boost_db: float = Field(12, ge=0, description="Largest gain applied to quiet files")
+
+    def correction_db(self, track: str, loudness_lufs: Optional[float]) -> float:
+        if loudness_lufs is None:
+            return 0.0
+        target = {"voice": self.voice_lufs, "sfx": self.sfx_lufs, "music": self.music_lufs}[track]
+        return min(target - loudness_lufs, self.max_boost_db)
+
+
+class RenderPlan(BaseModel):
+    """Every clip of a mix with its timing, as produced by `plan_mix`."""
+    length_ms: int = Field(ge=0)
+    events: List[ClipEvent] = Field(default_factory=list)
+    ducking: Optional[Ducking] = Field(None, description="Duck music and SFX under the voice track instead of fixed drops")
+    normalization: Optional[Normalization] = Field(None, description="Loudness targets folded into the clip gains")
+
+    @model_validator(mode="after")
+    def check_events(self):
+        for event in self.events:
+            if event.track not in TRACKS:
+                raise ValueError(f"Unknown track '{event.track}' for {event.source}")
+            if event.end_ms > self.length_ms:
+                raise ValueError(f"Event {event.source} at {event.start_ms}ms runs past the end of the mix")
+        return self
+
+    def sources(self) -> List[str]:
+        """Distinct source files, in order of first use."""
+        return list(dict.fromkeys(event.source for event in self.events))
+
+    def track_events(self, track: str) -> List[ClipEvent]:
+        return [event for event in self.events if event.track == track]
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.model_dump_json(indent=2))
+
+    @classmethod
+    def load(cls, path: str) -> "RenderPlan":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.model_validate_json(f.read())
+
+
+def fade_out_envelope(length_ms: int, fade_ms: int = 2000) -> List[Tuple[float, float]]:
+    fade_start = max(0, length_ms - fade_ms)
+    return [(0, 1.0), (fade_start, 1.0), (length_ms, 0.0)]
+
+
+def plan_mix(
+    parsed_sfx_output: dict,
+    duration_ms: Callable[[str], int],
+    ducking: Optional[Ducking] = None,
+    normalization: Optional[Normalization] = None,
+    loudness_lufs: Optional[Callable[[str], Optional[float]]] = None,
+    loop_points: Optional[Callable[[str], Optional[dict]]] = None
+) -> RenderPlan:
+    """
+    Compile the parsed SFX output into a render plan.
+
+    Only the durations of the files are needed, so a plan can be built,
+    checked and measured without decoding any audio. The arrangement is the
+    one of the original mixer: opening, title, bg_music, story, exclusive
+    and overlay modes.
+
+    With `ducking`, the fixed -15dB/-10dB drops and their fades are left out
+    of the music and overlay clips, and the renderer lowers those tracks
+    wherever the narration is speaking instead.
+
+    With `normalization`, each clip's gain also brings its source to the
+    loudness target of its track, so rendering needs no extra pass.
+
+    Args:
+        parsed_sfx_output: Parsed SFX output
+        duration_ms: Returns the duration of an audio file in milliseconds
+        ducking: Sidechain ducking settings, None for the fixed drops
+        normalization: Loudness targets, None to mix files at their own level
+        loudness_lufs: Returns the integrated loudness of a file, required with `normalization`
+        loop_points: Returns the seamless loop region of a file, or None to loop the whole file
+
+    Returns:
+        RenderPlan with one event per clip
+    """
+    audio_paths = parsed_sfx_output["audio_paths"]
+    mixing_modes = parsed_sfx_output["mixing_instructions"]
+
+    if len(audio_paths) != len(mixing_modes):
+        raise ValueError("audio_paths and mixing_modes must have the same length")
+    if normalization is not None and loudness_lufs is None:
+        raise ValueError("loudness_lufs is required to normalize")
+
+    minus_5db = db_to_gain(-5)
+    # The ducker takes care of the drops under the narration
+    minus_10db = db_to_gain(-10) if ducking is None else 1.0
+    minus_15db = db_to_gain(-15) if ducking is None else 1.0
+
+    events: List[ClipEvent] = []
+    cursor = 0
+    bg_path = None
+    bg_start_timestamp = 0
+
+    loudness_cache: dict[str, Optional[float]] = {}
+
+    def add(source: str, start: int, length: int, track: str, gain: float = 1.0, **kwargs):
+        if length <= 0:
+            return
+        if normalization is not None:
+            if source not in loudness_cache:
+                loudness_cache[source] = loudness_lufs(source)
+            gain *= db_to_gain(normalization.correction_db(track, loudness_cache[source]))
+        events.append(ClipEvent(source=source, start_ms=start, length_ms=length, track=track, gain=gain, **kwargs))
+
+    i = 0
+    while i < len(audio_paths):
+        current_path = audio_paths[i]
+        current_mode = mixing_modes[i]
+
+        if current_mode == "opening":
+            # Skip the first 6 seconds, 3 seconds at full volume, all 5dB down
+            body_length = max(0, duration_ms(current_path) - 6000)
+            head = min(3000, body_length)
+            add(current_path, cursor, head, "music", offset_ms=6000, gain=minus_5db)
+            cursor += head
+
+            if i + 1 < len(audio_paths):
+                story_path = audio_paths[i + 1]
+                story_length = duration_ms(story_path)
+                add(story_path, cursor, story_length, "voice")
+
+                # Music under the story fades from full volume to -15dB over 2 seconds
+                bed_length = min(story_length, max(0, body_length - 3000))
+                add(current_path, cursor, bed_length, "music", offset_ms=9000, gain=minus_5db,
+                    envelope=[(0, 1.0), (2000, minus_15db), (max(2000, bed_length), minus_15db)])
+                cursor += story_length
+
+                # Then back up to full volume, hold, and fade out
+                final_length = min(6000, max(0, body_length - 3000 - story_length))
+                add(current_path, cursor, final_length, "music", offset_ms=9000 + story_length, gain=minus_5db,
+                    envelope=[(0, minus_15db), (2000, 1.0), (4000, 1.0), (6000, 0.0)])
+                cursor += final_length
+
+                i += 1  # Skip next segment as we've processed it
+
+        elif current_mode == "title":
+            title_path = audio_paths[i + 1]
+            title_length = duration_ms(title_path)
+            # 1 second of silence, the title, then 3 seconds of silence
+            add(title_path, cursor + 1000, title_length, "voice")
+            cursor += 1000 + title_length + 3000
+            i += 1
+
+        elif current_mode == "bg_music":
+            # Save the background music and current timestamp
+            bg_path = current_path
+            bg_start_timestamp = cursor
+
+        elif current_mode == "story":
+            story_length = duration_ms(current_path)
+            add(current_path, cursor, story_length, "voice")
+            cursor += story_length
+
+        elif current_mode == "exclusive":
+            # Limit to 5 seconds, with a 2 second fade out if longer than 3 seconds
+            sfx_length = min(5000, duration_ms(current_path))
+            envelope = fade_out_envelope(sfx_length) if sfx_length > 3000 else None
+            add(current_path, cursor, sfx_length, "sfx", envelope=envelope)
+            cursor += sfx_length
+
+        elif current_mode == "overlay":
+            sfx_length = duration_ms(current_path)
+            if i + 1 < len(audio_paths) and mixing_modes[i + 1] == "story":
+                story_path = audio_paths[i + 1]
+                story_length = duration_ms(story_path)
+
+                # First 3 seconds at full volume
+                head = min(3000, sfx_length)
+                add(current_path, cursor, head, "sfx")
+                cursor += head
+
+                # The rest plays 10dB down under at most 6 seconds of the story
+                add(story_path, cursor, story_length, "voice")
+                tail_length = min(6000, story_length, max(0, sfx_length - 3000))
+                add(current_path, cursor, tail_length, "sfx", offset_ms=3000, gain=minus_10db)
+                cursor += story_length
+
+                i += 1
+            else:
+                # If no next story segment, treat as exclusive
+                sfx_length = min(5000, sfx_length)
+                add(current_path, cursor, sfx_length, "sfx", envelope=fade_out_envelope(sfx_length))
+                cursor += sfx_length
+
+        i += 1
+
+    # Background music loops from its marker to the end: 3 seconds at full volume,
+    # a 2 second fade down to -15dB, then back up to full volume near the end
+    if bg_path is not None and duration_ms(bg_path) > 0:
+        total_length = cursor - bg_start_timestamp
+        main_end = 3000 + max(0, total_length - 6000)
+        points = loop_points(bg_path) if loop_points is not None else None
+        add(bg_path, bg_start_timestamp, total_length, "music", loop=True, loop_points=points, envelope=[
+            (0, 1.0),
+            (3000, 1.0),
+            (5000, minus_15db),
+            (max(5000, main_end), minus_15db),
+            (max(7000, main_end + 2000), 1.0),
+            (max(9000, main_end + 4000), 1.0),
+            (max(11000, main_end + 6000), 0.0),
+        ])
+
+    return RenderPlan(length_ms=cursor, events=events, ducking=ducking, normalization=normalization)
+
+
+if __name__ == "__main__":
+    # Dry run: print the plan of a parsed_sfx_output.json without rendering it
+    from fab_audio.asset_library import asset_library
+    from fab_audio.mix_engine import probe_duration_ms
+
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        plan = plan_mix(json.load(f), probe_duration_ms, loop_points=asset_library.loop_points)
+    print(plan.model_dump_json(indent=2))
+    print(f"{len(plan.events)} events from {len(plan.sources())} files, {plan.length_ms / 1000:.1f}s of audio")
@@ -1,11 +1,14 @@
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel, Field
 from typing import Dict
 import json
 import os
-from openai import AzureOpenAI
+from openai import APIError, AzureOpenAI
 # from langfuse.openai import AzureOpenAI
 from dotenv import load_dotenv
+from fab_audio.rate_limiter import estimate_tokens, get_rate_limiter
 # from langfuse.decorators import observe, langfuse_context
 
 
@@ -148,6 +151,9 @@ The dog barked loudly and ran toward the gate.
 }}
 """
 
+# Upper bound on the length of a generated opening (40-50 words)
+OPENING_MAX_CHARS = 400
+
 OPENING_GENERATION_PROMPT = """
 # System Instruction: Create an Opening for the "Fablette" Children's Storytelling Podcast
 
@@ -232,6 +238,93 @@ class SfxResponse(BaseModel):
     text: str = Field(description="Story text with embedded sound effect tags")
     bg_music: BgMusic = Field(description="Background music properties")
 
+
+def build_opening_messages(text: str) -> list[dict]:
+    return [
+        {"role": "system", "content": OPENING_GENERATION_PROMPT},
+        {"role": "user", "content": text}
+    ]
+
+
+def build_sfx_messages(text: str) -> list[dict]:
+    return [
+        {
+            "role": "system", 
+            "content": SFX_GENERATION_WITH_DATABASE_PROMPT.format(
+                all_sfx_names=all_sfx_names,
+                all_bgm_names=all_bgm_names
+            )
+        },
+        {"role": "user", "content": text}
+    ]
+
+
+def validate_sfx_response(content: str) -> SfxResponse:
+    """
+    Validate the SFX tagging output of the LLM.
+
+    Raises:
+        ValueError: If the output is not valid JSON for SfxResponse, or uses
+            tags or sounds that are not in the database
+    """
+    # Validate using Pydantic
+    sfx_data = SfxResponse.model_validate_json(content)
+
+    # Extract all tags from the text
+    tags = re.findall(r'<(\w+)>', sfx_data.text)
+    
+    # Check if all tags have corresponding sound effects
+    missing_tags = [tag for tag in tags if tag not in sfx_data.sound_effects]
+    if missing_tags:
+        raise ValueError(f"Tags found in text but missing from sound_effects: {missing_tags}")
+
+    # # Check if all sound effects have corresponding tags
+    # unused_effects = [effect for effect in sfx_data.sound_effects if effect not in tags]
+    # if unused_effects:
+    #     raise ValueError(f"Sound effects defined but not used in text: {unused_effects}")
+
+    # Check if sound effects exist in database
+    for effect_name, effect in sfx_data.sound_effects.items():
+        if effect_name not in ["opening", "title", "bg_music"]:  # Skip special effects
+            if effect.name not in all_sfx:
+                raise ValueError(f"Sound effect '{effect_name}' not found in database")
+
+    # Check if background music exists in database
+    if sfx_data.bg_music.name not in all_bgm:
+        raise ValueError(f"Background music '{sfx_data.bg_music.name}' not found in database")
+
+    return sfx_data
+
+
+def save_sfx_output(title: str, opening: str, sfx_data: SfxResponse, out_dir: str) -> dict:
+    """Prepend the opening and title to the tagged story and save it as sfx_output.json."""
+    # Add opening to the beginning of the SFX text
+    sfx_data.text = f"<opening> {opening} <title> {title} <bg_music> {sfx_data.text}"
+
+
+    sfx_data.sound_effects["opening"] = SfxEffect(
+        name="toy-symphony",
+        mode="opening"
+    )
+    sfx_data.sound_effects["title"] = SfxEffect(
+        name="quirky-quest",
+        mode="title"
+    )
+    sfx_data.sound_effects["bg_music"] = SfxEffect(
+        name=sfx_data.bg_music.name,
+        mode="bg_music"
+    )
+
+    # Save to file
+    os.makedirs(out_dir, exist_ok=True)
+    output_file = os.path.join(out_dir, "sfx_output.json")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(sfx_data.model_dump_json(indent=2))
+    
+    print(f"Successfully generated and saved SFX to {output_file}")
+    return sfx_data.model_dump()
+
+
 class Sfx:
     def __init__(self):
         # Load environment variables from .env file
@@ -259,7 +352,10 @@ class Sfx:
             api_version=api_version,
             azure_endpoint=endpoint,
             api_key=subscription_key,
+            # Retries and backoff are handled by the shared rate limiter
+            max_retries=0,
         )
+        self.rate_limiter = get_rate_limiter(self.deployment_name)
 
         # 4.1
         # self.deployment_name = "gpt-4.1"
@@ -272,65 +368,53 @@ class Sfx:
         #     api_key=subscription_key,
         # )
     
+    def _complete(self, messages: list[dict], expected_output: int = 0, **kwargs):
+        """Run a chat completion under the deployment's shared rate limiter."""
+        return self.rate_limiter.call(
+            lambda: self.client.chat.completions.with_raw_response.create(
+                model=self.deployment_name,
+                messages=messages,
+                **kwargs,
+            ),
+            tokens=estimate_tokens(*(m["content"] for m in messages)) + expected_output // 4,
+        )
+
+    def _backoff_on_api_error(self, error: Exception, attempt: int, max_retries: int):
+        # Invalid output is retried right away with feedback; API failures wait first
+        if isinstance(error, APIError) and attempt < max_retries - 1:
+            time.sleep(self.rate_limiter.backoff(attempt))
+
     def generate(
         self, 
         title: str,
         text: str, 
         out_dir: str
     ) -> SfxResponse | None:
-        # Generate opening first
-        print("Generating opening...")
-        opening = self.generate_opening(text)
+        # The opening and the SFX tagging don't depend on each other, so run both at once
+        print("Generating opening and SFX...")
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="sfx-llm") as executor:
+            opening_future = executor.submit(self.generate_opening, text)
+            sfx_future = executor.submit(self.generate_sfx_with_database, text)
+            opening = opening_future.result()
+            sfx_data = sfx_future.result()
+
         if not opening:
             print("Failed to generate opening")
             return None
         
-        # Generate SFX with original text
-        print("Generating SFX...")
-        sfx_data = self.generate_sfx_with_database(text)
         if not sfx_data:
             print("Failed to generate SFX")
             return None
         
-        # Add opening to the beginning of the SFX text
-        sfx_data.text = f"<opening> {opening} <title> {title} <bg_music> {sfx_data.text}"
-
-
-        sfx_data.sound_effects["opening"] = SfxEffect(
-            name="toy-symphony",
-            mode="opening"
-        )
-        sfx_data.sound_effects["title"] = SfxEffect(
-            name="quirky-quest",
-            mode="title"
-        )
-        sfx_data.sound_effects["bg_music"] = SfxEffect(
-            name=sfx_data.bg_music.name,
-            mode="bg_music"
-        )
-
-        # Save to file
-        os.makedirs(out_dir, exist_ok=True)
-        output_file = os.path.join(out_dir, "sfx_output.json")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(sfx_data.model_dump_json(indent=2))
-        
-        print(f"Successfully generated and saved SFX to {output_file}")
-        return sfx_data.model_dump()
+        return save_sfx_output(title, opening, sfx_data, out_dir)
     
     def generate_opening(self, text: str) -> str | None:
         max_retries = 3
-        messages = [
-            {"role": "system", "content": OPENING_GENERATION_PROMPT},
-            {"role": "user", "content": text}
-        ]
+        messages = build_opening_messages(text)
         
         for attempt in range(max_retries):
             try:
-                response = self.client.chat.completions.create(
-                    model=self.deployment_name,
-                    messages=messages,
-                )
+                response = self._complete(messages, expected_output=OPENING_MAX_CHARS)
                 
                 opening = response.choices[0].message.content
 
@@ -338,6 +422,7 @@ class Sfx:
                 
             except Exception as e:
                 print(f"Attempt {attempt + 1}: Failed to generate opening - {str(e)}")
+                self._backoff_on_api_error(e, attempt, max_retries)
                 
             if attempt < max_retries - 1:
                 print("Retrying...")
@@ -349,59 +434,22 @@ class Sfx:
     def generate_sfx_with_database(self, text: str) -> SfxResponse | None:
         max_retries = 3
 
-        messages = [
-            {
-                "role": "system", 
-                "content": SFX_GENERATION_WITH_DATABASE_PROMPT.format(
-                    all_sfx_names=all_sfx_names,
-                    all_bgm_names=all_bgm_names
-                )
-            },
-            {"role": "user", "content": text}
-        ]
+        messages = build_sfx_messages(text)
 
         for attempt in range(max_retries):
             try:
-                response = self.client.chat.completions.create(
-                    model=self.deployment_name,
-                    messages=messages,
-                    response_format={"type": "json_object"},
-                )
+                response = self._complete(messages, expected_output=len(text), response_format={"type": "json_object"})
                 
                 content = response.choices[0].message.content
                 messages.append({"role": "assistant", "content": content})
                 
-                # Validate using Pydantic
-                sfx_data = SfxResponse.model_validate_json(content)
-
-                # Extract all tags from the text
-                tags = re.findall(r'<(\w+)>', sfx_data.text)
-                
-                # Check if all tags have corresponding sound effects
-                missing_tags = [tag for tag in tags if tag not in sfx_data.sound_effects]
-                if missing_tags:
-                    raise ValueError(f"Tags found in text but missing from sound_effects: {missing_tags}")
-
-                # # Check if all sound effects have corresponding tags
-                # unused_effects = [effect for effect in sfx_data.sound_effects if effect not in tags]
-                # if unused_effects:
-                #     raise ValueError(f"Sound effects defined but not used in text: {unused_effects}")
-
-                # Check if sound effects exist in database
-                for effect_name, effect in sfx_data.sound_effects.items():
-                    if effect_name not in ["opening", "title", "bg_music"]:  # Skip special effects
-                        if effect.name not in all_sfx:
-                            raise ValueError(f"Sound effect '{effect_name}' not found in database")
-
-                # Check if background music exists in database
-                if sfx_data.bg_music.name not in all_bgm:
-                    raise ValueError(f"Background music '{sfx_data.bg_music.name}' not found in database")
-                
+                sfx_data = validate_sfx_response(content)
                 return sfx_data
                 
             except Exception as e:
                 error_message = f"The output is not valid, the error is: {str(e)}"
                 print(f"Attempt {attempt + 1}: {error_message}")
+                self._backoff_on_api_error(e, attempt, max_retries)
                 messages.append({"role": "user", "content": error_message})
             
             if attempt < max_retries - 1:
@@ -420,11 +468,7 @@ class Sfx:
         
         for attempt in range(max_retries):
             try:
-                response = self.client.chat.completions.create(
-                    model=self.deployment_name,
-                    messages=messages,
-                    response_format={"type": "json_object"},
-                )
+                response = self._complete(messages, expected_output=len(text), response_format={"type": "json_object"})
                 
                 content = response.choices[0].message.content
                 # Add the assistant's response to message history
@@ -439,6 +483,7 @@ class Sfx:
             except Exception as e:
                 error_message = f"The output is not valid, the error is: {str(e)}"
                 print(f"Attempt {attempt + 1}: {error_message}")
+                self._backoff_on_api_error(e, attempt, max_retries)
                 
                 # Add error feedback to message history
                 messages.append({"role": "user", "content": error_message})
@@ -454,6 +499,7 @@ def parse_sfx_output(
     story_json: dict, 
     out_dir: str, 
     audio_files: dict[str, str],
+    segment_ext: str = "mp3",
 ) -> tuple[list[str], list[str]]:
     """
     Parse the SFX output and generate audio for each text segment between sound effects.
@@ -462,6 +508,7 @@ def parse_sfx_output(
         story_json: Dictionary containing the story text with sound effect tags
         out_dir: Output directory for the generated audio files
         sfx_files: Dictionary mapping sound effect names to their file paths
+        segment_ext: File extension of the TTS segments, see azure_oai.SEGMENT_EXTENSIONS
     
     Returns:
         Tuple containing:
@@ -533,7 +580,7 @@ def parse_sfx_output(
         
         # Insert the text segment paths in their correct positions
         for i, pos in enumerate(text_positions):
-            segment_path = os.path.join(out_dir, f"{i}.mp3")
+            segment_path = os.path.join(out_dir, f"{i}.{segment_ext}")
             final_audio_paths[pos] = segment_path
             final_mixing_instructions[pos] = "story"
         
@@ -0,0 +1,81 @@
+import importlib
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def sfx(tmp_path_factory, monkeypatch):
+    # fab_audio.sfx reads the sound database from data/ when it is imported
+    root = tmp_path_factory.mktemp("library")
+    for folder, name in [("sfx", "bark"), ("bg_music", "forest"), ("misc", "toy-symphony"), ("misc", "quirky-quest")]:
+        os.makedirs(root / "data" / folder, exist_ok=True)
+        (root / "data" / folder / f"{name}.mp3").write_bytes(b"")
+    monkeypatch.chdir(root)
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY_O4MINI", "key")
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT_O4MINI", "https://example.openai.azure.com")
+    return importlib.import_module("fab_audio.sfx")
+
+
+OPENING = "Welcome to Fablette, where stories come alive!"
+
+SFX = json.dumps({
+    "sound_effects": {"bark": {"name": "bark", "mode": "overlay"}},
+    "text": "<bark> The dog barked.",
+    "bg_music": {"name": "forest"},
+})
+
+
+def completion(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def test_opening_and_sfx_are_requested_at_once(sfx, tmp_path, monkeypatch):
+    generator = sfx.Sfx()
+    # Each request waits for the other one to be in flight too
+    both_running = threading.Barrier(2, timeout=5)
+    requested = []
+
+    def complete(messages, expected_output=0, **kwargs):
+        requested.append("sfx" if kwargs.get("response_format") else "opening")
+        both_running.wait()
+        return completion(SFX if kwargs.get("response_format") else OPENING)
+
+    monkeypatch.setattr(generator, "_complete", complete)
+    result = generator.generate("The Dog", "The dog barked.", str(tmp_path / "dog"))
+
+    assert sorted(requested) == ["opening", "sfx"]
+    # Same layout as tagging first and adding the opening afterwards
+    expected = sfx.save_sfx_output(
+        "The Dog", OPENING, sfx.validate_sfx_response(SFX), str(tmp_path / "sequential")
+    )
+    assert result == expected
+    with open(tmp_path / "dog" / "sfx_output.json", encoding="utf-8") as f:
+        assert json.load(f) == expected
+
+
+@pytest.mark.parametrize("failing", ["generate_opening", "generate_sfx_with_database"])
+def test_an_error_in_either_request_propagates(sfx, tmp_path, monkeypatch, failing):
+    generator = sfx.Sfx()
+    monkeypatch.setattr(generator, "generate_opening", lambda text: OPENING)
+    monkeypatch.setattr(generator, "generate_sfx_with_database", lambda text: sfx.validate_sfx_response(SFX))
+
+    def fail(text):
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(generator, failing, fail)
+    with pytest.raises(RuntimeError, match="connection reset"):
+        generator.generate("The Dog", "The dog barked.", str(tmp_path / "dog"))
+    assert not os.path.exists(tmp_path / "dog" / "sfx_output.json")
+
+
+def test_no_output_when_either_request_gives_up(sfx, tmp_path, monkeypatch):
+    generator = sfx.Sfx()
+    monkeypatch.setattr(generator, "generate_opening", lambda text: None)
+    monkeypatch.setattr(generator, "generate_sfx_with_database", lambda text: sfx.validate_sfx_response(SFX))
+
+    assert generator.generate("The Dog", "The dog barked.", str(tmp_path / "dog")) is None
+    assert not os.path.exists(tmp_path / "dog" / "sfx_output.json")
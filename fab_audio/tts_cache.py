@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentCache:
+    """
+    Content-addressed, size-bounded cache of synthesized TTS segments.
+
+    Entries are stored as `<cache_dir>/<key[:2]>/<key>.<format>` where the key
+    is a hash of everything that influences the generated audio, so identical
+    text is only synthesized once no matter which story or index it lands in.
+    The least recently used entries are evicted once the cache grows over
+    `max_bytes`. Recency is kept in the file mtime so it survives restarts.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: Optional[OrderedDict] = None  # key -> (path, size), oldest first
+        self._total_bytes = 0
+
+    @staticmethod
+    def make_key(text: str, voice: str, format: str, deployment: str, instructions: str) -> str:
+        """Hash the synthesis inputs into a cache key."""
+        payload = json.dumps([text, voice, format, deployment, instructions], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path_for(self, key: str, format: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{format}")
+
+    def _load_index(self):
+        # Called with the lock held; scans the cache directory once per process
+        if self._entries is not None:
+            return
+        found = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for fname in files:
+                    if fname.startswith("."):
+                        continue
+                    path = os.path.join(root, fname)
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, fname.split(".")[0], path, stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((key, (path, size)) for _, key, path, size in found)
+        self._total_bytes = sum(size for _, _, _, size in found)
+
+    def get(self, key: str, format: str, dest_path: str, stats: Optional[dict] = None) -> bool:
+        """
+        Copy a cached segment to `dest_path`. The hit or miss is also counted
+        in `stats`, a dict with "hits" and "misses", if given.
+
+        Returns:
+            True on a cache hit, False otherwise
+        """
+        with self._lock:
+            self._load_index()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            try:
+                shutil.copyfile(entry[0], dest_path)
+                os.utime(entry[0])
+                with self._lock:
+                    self.hits += 1
+                    if stats is not None:
+                        stats["hits"] += 1
+                return True
+            except FileNotFoundError:
+                # Evicted by another process sharing the cache directory
+                with self._lock:
+                    if self._entries.pop(key, None) is not None:
+                        self._total_bytes -= entry[1]
+
+        with self._lock:
+            self.misses += 1
+            if stats is not None:
+                stats["misses"] += 1
+        return False
+
+    def put(self, key: str, format: str, src_path: str):
+        """Store a freshly synthesized segment and evict old entries if needed."""
+        path = self._path_for(key, format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        os.close(fd)
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._load_index()
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+            evicted = self._evict()
+
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> list[str]:
+        # Called with the lock held; never evicts the entry that was just added
+        evicted = []
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (path, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            evicted.append(path)
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load_index()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+    def log_stats(self, stats: Optional[dict] = None, label: str = "TTS cache"):
+        """Log the hits and misses counted in `stats` by `get`, or those of the whole process, and the cache size."""
+        totals = self.stats()
+        counts = stats if stats is not None else totals
+        logger.info(
+            f"{label}: {counts['hits']} hits, {counts['misses']} misses, "
+            f"{totals['entries']} entries ({totals['bytes'] / 1024 / 1024:.1f} MB)"
+        )
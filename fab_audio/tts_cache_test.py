@@ -0,0 +1,72 @@
+import os
+
+from fab_audio.tts_cache import SegmentCache
+
+
+def write_file(path, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_key_depends_on_all_inputs():
+    base = SegmentCache.make_key("Hello", "alloy", "mp3", "gpt-4o-audio-preview", "Read it")
+    assert base == SegmentCache.make_key("Hello", "alloy", "mp3", "gpt-4o-audio-preview", "Read it")
+    assert base != SegmentCache.make_key("Hello!", "alloy", "mp3", "gpt-4o-audio-preview", "Read it")
+    assert base != SegmentCache.make_key("Hello", "nova", "mp3", "gpt-4o-audio-preview", "Read it")
+    assert base != SegmentCache.make_key("Hello", "alloy", "wav", "gpt-4o-audio-preview", "Read it")
+    assert base != SegmentCache.make_key("Hello", "alloy", "mp3", "other", "Read it")
+    assert base != SegmentCache.make_key("Hello", "alloy", "mp3", "gpt-4o-audio-preview", "Read it slowly")
+
+
+def test_put_then_get_copies_segment(tmp_path):
+    cache = SegmentCache(str(tmp_path / "cache"))
+    key = SegmentCache.make_key("Hello", "alloy", "mp3", "model", "")
+    dest = str(tmp_path / "0.mp3")
+
+    assert not cache.get(key, "mp3", dest)
+    cache.put(key, "mp3", write_file(tmp_path / "src.mp3", b"audio"))
+    assert cache.get(key, "mp3", dest)
+
+    with open(dest, "rb") as f:
+        assert f.read() == b"audio"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_index_survives_restart(tmp_path):
+    cache = SegmentCache(str(tmp_path / "cache"))
+    cache.put("abc", "mp3", write_file(tmp_path / "src.mp3", b"audio"))
+
+    reopened = SegmentCache(str(tmp_path / "cache"))
+    assert reopened.get("abc", "mp3", str(tmp_path / "out.mp3"))
+    assert reopened.stats()["entries"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = SegmentCache(str(tmp_path / "cache"), max_bytes=10)
+    src = write_file(tmp_path / "src.mp3", b"12345")
+    cache.put("aa", "mp3", src)
+    cache.put("bb", "mp3", src)
+    # Touch "aa" so "bb" becomes the least recently used entry
+    assert cache.get("aa", "mp3", str(tmp_path / "out.mp3"))
+    cache.put("cc", "mp3", src)
+
+    assert cache.get("aa", "mp3", str(tmp_path / "out.mp3"))
+    assert not cache.get("bb", "mp3", str(tmp_path / "out.mp3"))
+    assert cache.get("cc", "mp3", str(tmp_path / "out.mp3"))
+    assert cache.stats()["bytes"] <= 10
+    assert not os.path.exists(cache._path_for("bb", "mp3"))
+
+
+def test_stats_are_also_counted_per_caller(tmp_path):
+    cache = SegmentCache(str(tmp_path / "cache"))
+    cache.put("aa", "mp3", write_file(tmp_path / "src.mp3", b"audio"))
+    story = {"hits": 0, "misses": 0}
+
+    assert not cache.get("bb", "mp3", str(tmp_path / "out.mp3"))
+    assert cache.get("aa", "mp3", str(tmp_path / "out.mp3"), story)
+    assert not cache.get("cc", "mp3", str(tmp_path / "out.mp3"), story)
+
+    assert story == {"hits": 1, "misses": 1}
+    assert cache.stats()["misses"] == 2
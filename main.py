@@ -1,42 +1,279 @@
 import argparse
+import functools
+from contextlib import contextmanager
+from typing import Sequence
 from fab_audio.sfx import Sfx
 import json
 import os
 from fab_audio.sfx import parse_sfx_output, all_audio_files
 # from fab_audio.realtime_tts import with_azure_openai
-from fab_audio.azure_oai import generate_story_audio
-from fab_audio.mix_audio import mix_audio
+from fab_audio.azure_oai import SEGMENT_EXTENSIONS, generate_story_audio
+from fab_audio.mix_audio import MIX_BACKENDS, mix_audio
+from fab_audio.mix_engine import export_targets, load_audio_array, parse_export
+from fab_audio.loudness import measure_segments
+from fab_audio.mix_farm import MixFarm, available_cpus
+from fab_audio.remix import StemCache
+from fab_audio.render_plan import Ducking, Normalization
+from fab_audio.asset_library import SAMPLE_RATE, asset_library
+from fab_audio.pipeline import StoryPipeline
+from fab_audio.manifest import JobManifest, hash_artifacts
+from fab_audio.corpus import iter_stories, in_shard, parse_shard
+from fab_audio.batch_sfx import AzureBatchBackend, BatchJob, run_sfx_batch
 import asyncio
 
-def generate_audio(title: str, story: str, out_dir: str = None):
-    if out_dir is None:
-        out_dir = f"out/{title.lower().replace(' ', '_')}"
-    os.makedirs(out_dir, exist_ok=True)
 
-    # Generate the sfx
-    if not os.path.exists(f"{out_dir}/sfx_output.json"):
-        sfx = Sfx()
-        sfx_dict = sfx.generate(title, story, out_dir)
+class StoryJob:
+    """State of one story as it moves through the generation stages."""
+
+    def __init__(
+        self,
+        title: str,
+        story: str,
+        out_dir: str = None,
+        language: str = None,
+        manifest: JobManifest = None
+    ):
+        if out_dir is None:
+            out_dir = f"out/{title.lower().replace(' ', '_')}"
+        self.title = title
+        self.story = story
+        self.out_dir = out_dir
+        self.language = language
+        self.manifest = manifest
+        self.sfx_dict = None
+        self.parsed_sfx_dict = None
+
+    def is_done(self, stage: str, artifact: str = None, outputs: Sequence[str] = ()) -> bool:
+        """
+        Whether a stage can be skipped. The manifest is the source of truth as
+        long as the stage's `artifact` and other `outputs` are still on disk; a
+        stage whose output was deleted runs again. An artifact left on disk by a
+        run from before the manifest is adopted once.
+        """
+        if self.manifest is None:
+            return artifact is not None and os.path.exists(artifact)
+        missing = [path for path in [artifact, *outputs] if path is not None and not os.path.exists(path)]
+        if self.manifest.is_done(self.title, self.language, stage):
+            if missing:
+                print(f"{self.title}: {missing[0]} from the {stage} stage is missing, running it again")
+            return not missing
+        if artifact is not None and not missing:
+            self.manifest.finish(self.title, self.language, stage, hash_artifacts([artifact]))
+            return True
+        return False
+
+    @contextmanager
+    def track(self, stage: str):
+        if self.manifest is None:
+            yield {"artifact_hash": None, "artifacts": []}
+            return
+        with self.manifest.track(self.title, self.language, stage) as result:
+            yield result
+
 
+def sfx_stage(job: StoryJob) -> StoryJob:
+    os.makedirs(job.out_dir, exist_ok=True)
+    sfx_path = f"{job.out_dir}/sfx_output.json"
+
+    # Generate the sfx
+    if not job.is_done("sfx", sfx_path):
+        with job.track("sfx") as result:
+            sfx = Sfx()
+            job.sfx_dict = sfx.generate(job.title, job.story, job.out_dir)
+            if job.sfx_dict is None:
+                raise RuntimeError("Failed to generate SFX")
+            result["artifact_hash"] = hash_artifacts([sfx_path])
     else:
-        with open(f"{out_dir}/sfx_output.json", "r") as f:
-            sfx_dict = json.load(f)
+        with open(sfx_path, "r") as f:
+            job.sfx_dict = json.load(f)
+    return job
+
+
+def parse_stage(job: StoryJob, tts_format: str = "mp3") -> StoryJob:
+    parsed_path = f"{job.out_dir}/parsed_sfx_output.json"
 
     # Parse the sfx
-    if not os.path.exists(f"{out_dir}/parsed_sfx_output.json"):
-        parsed_sfx_dict = parse_sfx_output(sfx_dict, out_dir, all_audio_files)
+    if not job.is_done("parse", parsed_path):
+        with job.track("parse") as result:
+            job.parsed_sfx_dict = parse_sfx_output(
+                job.sfx_dict, job.out_dir, all_audio_files, segment_ext=SEGMENT_EXTENSIONS[tts_format]
+            )
+            result["artifact_hash"] = hash_artifacts([parsed_path])
     else:
-        with open(f"{out_dir}/parsed_sfx_output.json", "r") as f:
-            parsed_sfx_dict = json.load(f)
+        with open(parsed_path, "r") as f:
+            job.parsed_sfx_dict = json.load(f)
+    return job
+
+
+def story_segments(parsed_sfx_dict: dict) -> list[str]:
+    """Paths of a story's TTS segments, in text segment order."""
+    return [
+        path for path, mode in zip(parsed_sfx_dict["audio_paths"], parsed_sfx_dict["mixing_instructions"])
+        if mode == "story"
+    ]
+
+
+def parsed_tts_format(parsed_sfx_dict: dict, tts_format: str) -> str:
+    """
+    The TTS format matching the segment files a story was parsed with.
+
+    The segment names are fixed when the story is parsed, so a story parsed
+    in an earlier run with another format keeps that run's format.
+    """
+    segment_paths = story_segments(parsed_sfx_dict)
+    if not segment_paths:
+        return tts_format
+    extension = os.path.splitext(segment_paths[0])[1][1:]
+    if SEGMENT_EXTENSIONS[tts_format] == extension:
+        return tts_format
+    formats = [name for name, ext in SEGMENT_EXTENSIONS.items() if ext == extension]
+    if not formats:
+        raise ValueError(f"Segments of {segment_paths[0]} have no matching TTS format")
+    return formats[0]
+
+
+def tts_stage(
+    job: StoryJob,
+    segment_workers: int = 1,
+    measure_loudness: bool = False,
+    tts_format: str = "mp3",
+    stream: bool = False,
+    coalesce: bool = False
+) -> StoryJob:
+    # Deleted segments are synthesized again
+    segment_paths = story_segments(job.parsed_sfx_dict)
+    if job.is_done("tts", outputs=segment_paths):
+        return job
+    # A segment deleted after the stage finished is being regenerated, e.g. to fix a
+    # mispronunciation, so it must not be copied back from the TTS cache
+    regenerate = set()
+    if job.manifest is not None and job.manifest.is_done(job.title, job.language, "tts"):
+        regenerate = {i for i, path in enumerate(segment_paths) if not os.path.exists(path)}
 
     # Generate the audio
-    text_segments = parsed_sfx_dict["text_segments"]
-    # asyncio.run(with_azure_openai(out_dir, text_segments))
-    generate_story_audio(text_segments, out_dir, title)
+    text_segments = job.parsed_sfx_dict["text_segments"]
+    segment_format = parsed_tts_format(job.parsed_sfx_dict, tts_format)
+    if segment_format != tts_format:
+        print(f"{job.title} was parsed with {segment_format} segments, synthesizing {segment_format} instead of {tts_format}")
+        # Only pcm16 can be streamed
+        stream = stream and segment_format == "pcm16"
+    with job.track("tts") as result:
+        # asyncio.run(with_azure_openai(job.out_dir, text_segments))
+        generated_files = generate_story_audio(
+            text_segments, job.out_dir, job.title, format=segment_format, max_workers=segment_workers, stream=stream,
+            coalesce=coalesce, refresh=regenerate
+        )
+        if len(generated_files) != len(text_segments):
+            raise RuntimeError(f"Only {len(generated_files)}/{len(text_segments)} segments were generated")
+        if measure_loudness:
+            # Measured once here so normalizing the mix needs no extra pass
+            measure_segments(generated_files, load_audio_array, SAMPLE_RATE)
+        result["artifact_hash"] = hash_artifacts(generated_files)
+    return job
+
+
+def missing_exports(out_dir: str, exports: list[str] = ()) -> bool:
+    """Whether any output of a story's mix, extra exports included, is missing."""
+    return any(not os.path.exists(target["path"]) for target in export_targets(f"{out_dir}/mixed.mp3", exports))
+
+
+def mix_stage(
+    job: StoryJob,
+    backend: str = "numpy",
+    stream: bool = False,
+    exports: list[str] = (),
+    duck: bool = False,
+    normalize: bool = False,
+    farm: MixFarm = None,
+    incremental: bool = False
+) -> StoryJob:
+    mixed_path = f"{job.out_dir}/mixed.mp3"
+    plan_path = f"{job.out_dir}/render_plan.json"
+    # Incremental mixes keep their stems here and re-render only what changed
+    stems_dir = f"{job.out_dir}/mix_stems" if incremental and backend == "numpy" else None
+
+    def stale() -> bool:
+        return stems_dir is not None and StemCache(stems_dir).is_stale(
+            job.parsed_sfx_dict, Ducking() if duck else None, Normalization() if normalize else None
+        )
+
+    # Mix the audio, again if a segment was regenerated since the last incremental mix
+    # or an export was asked for after the story was first mixed
+    if not job.is_done("mix", mixed_path) or stale() or missing_exports(job.out_dir, exports):
+        with job.track("mix") as result:
+            mix = farm.mix if farm is not None else mix_audio
+            mix(
+                job.parsed_sfx_dict, mixed_path,
+                backend=backend, plan_path=plan_path, stream=stream, exports=exports, duck=duck,
+                normalize=normalize, stems_dir=stems_dir
+            )
+            result["artifacts"].extend(export_targets(mixed_path, exports))
+            result["artifact_hash"] = hash_artifacts([mixed_path])
+    return job
+
 
-    # Mix the audio
-    if not os.path.exists(f"{out_dir}/mixed.mp3"):
-        mixed_path = mix_audio(parsed_sfx_dict, f"{out_dir}/mixed.mp3")
+def export_spec(value: str) -> str:
+    # Validate "format[:bitrate]" when parsing the arguments
+    parse_export(value)
+    return value
+
+
+LANGUAGES = ["en", "zh", "fr", "de"]
+
+STAGES = [
+    ("sfx", sfx_stage),
+    ("parse", parse_stage),
+    ("tts", tts_stage),
+    ("mix", mix_stage),
+]
+
+
+def generate_audio(
+    title: str,
+    story: str,
+    out_dir: str = None,
+    language: str = None,
+    manifest: JobManifest = None,
+    incremental_mix: bool = False
+):
+    job = StoryJob(title, story, out_dir, language, manifest)
+    stages = dict(STAGES)
+    # Re-mixes the story if one of its segments changed, re-rendering only that part
+    stages["mix"] = functools.partial(mix_stage, incremental=incremental_mix)
+    for name, _ in STAGES:
+        job = stages[name](job)
+    return job
+
+
+def select_stories(args, finished_stories: set[str]):
+    """
+    Yield (title, language, text, out_dir) for the unfinished stories of this shard, and for
+    finished ones missing one of the --exports.
+    """
+    selected_language_idx = LANGUAGES.index(args.language)
+    for story in iter_stories(args.story_path):
+        if not in_shard(story, args.shard) or (story.get("title") in finished_stories and not args.exports):
+            continue
+        try:
+            title = story["title"]
+            # only generate the English language for now
+            language = story["translations"][selected_language_idx]["language"]
+            story_text = story["translations"][selected_language_idx]["text"]
+        except Exception as e:
+            print(f"Error reading story {story.get('title')} in {args.language}: {e}")
+            continue
+        out_dir = f"out/audios/{title.lower().replace(' ', '_')}_{language.lower()}"
+        if title in finished_stories and not missing_exports(out_dir, args.exports):
+            continue
+        yield title, language, story_text, out_dir
+
+
+def report_result(job: StoryJob, future):
+    error = future.exception()
+    if error is not None:
+        print(f"Error generating audio for {job.title} in {job.language}: {error}")
+    else:
+        print(f"Finished audio for {job.title} in {job.language}")
 
 
 if __name__ == "__main__":
@@ -44,39 +281,130 @@ if __name__ == "__main__":
     arg_parser.add_argument("--language", type=str, default="en", help="The language to generate the stories in")
     arg_parser.add_argument("--n", type=int, default=1000, help="The number of stories to generate")
     arg_parser.add_argument("--story_path", type=str, default="generated_stories", help="The path to the generated stories")
+    arg_parser.add_argument("--shard", type=parse_shard, default=None, help="Only process shard i of N, given as i/N, e.g. 0/4")
+    arg_parser.add_argument("--sfx_workers", type=int, default=4, help="Number of stories in the SFX tagging stage at once")
+    arg_parser.add_argument("--parse_workers", type=int, default=1, help="Number of stories in the SFX parsing stage at once")
+    arg_parser.add_argument("--tts_workers", type=int, default=4, help="Number of stories in the TTS stage at once")
+    arg_parser.add_argument("--segment_workers", type=int, default=4, help="Number of TTS segments synthesized at once per story")
+    arg_parser.add_argument("--tts_format", type=str, default="mp3", choices=list(SEGMENT_EXTENSIONS), help="Audio format of the TTS segments; wav and pcm16 are lossless and are read by the mixer without ffmpeg")
+    arg_parser.add_argument("--stream_tts", action="store_true", help="Stream TTS responses and write the audio as it arrives (requires --tts_format pcm16)")
+    arg_parser.add_argument("--coalesce_segments", action="store_true", help="Synthesize runs of short neighbouring text segments in one TTS request and split the audio afterwards")
+    arg_parser.add_argument("--mix_workers", type=int, default=2, help="Number of stories in the mixing stage at once")
+    arg_parser.add_argument("--mix_processes", type=int, default=available_cpus(), help="Size of the mixing process pool, 0 to mix in the pipeline threads")
+    arg_parser.add_argument("--mix_backend", type=str, default="numpy", choices=MIX_BACKENDS, help="Mixing engine, pydub is the slower reference implementation")
+    arg_parser.add_argument("--exports", type=export_spec, nargs="*", default=[], help="Extra outputs encoded from the same mix, as format[:bitrate], e.g. mp3:64k opus:32k")
+    arg_parser.add_argument("--duck", action="store_true", help="Duck music and SFX under the narration instead of fixed volume drops (numpy backend)")
+    arg_parser.add_argument("--normalize", action="store_true", help="Normalize the loudness of every TTS segment and library file in the mix (numpy backend)")
+    arg_parser.add_argument("--stream_mix", action="store_true", help="Encode mixes block by block through ffmpeg to bound memory (numpy backend)")
+    arg_parser.add_argument("--incremental_mix", action="store_true", help="Keep per-track stems and re-mix only the parts whose segments changed (numpy backend)")
+    arg_parser.add_argument("--manifest", type=str, default="out/manifest.db", help="The job manifest database used to resume runs")
+    arg_parser.add_argument("--batch", action="store_true", help="Generate openings and SFX tags for all selected stories with the batch API first")
+    arg_parser.add_argument("--batch_poll_interval", type=float, default=60, help="Seconds between batch status checks")
+    arg_parser.add_argument("--max_in_flight", type=int, default=16, help="Maximum number of stories queued in the pipeline")
 
     args = arg_parser.parse_args()
+    if args.stream_tts and args.tts_format != "pcm16":
+        arg_parser.error("--stream_tts requires --tts_format pcm16")
+    if args.duck and args.mix_backend != "numpy":
+        arg_parser.error("--duck requires --mix_backend numpy")
+    if args.normalize and args.mix_backend != "numpy":
+        arg_parser.error("--normalize requires --mix_backend numpy")
 
-    story_path = args.story_path
-    languages = ["en", "zh", "fr", "de"]
-    language_indxe = { language: idx for idx, language in enumerate(languages)}
-
-    if args.language not in languages:
+    if args.language not in LANGUAGES:
         print(f"Language {args.language} not supported.")
-        print(f"Supported languages: {languages}")
+        print(f"Supported languages: {LANGUAGES}")
         exit(1)
-    
+
     print(f"Generating {args.n} stories in {args.language}")
+    if args.shard is not None:
+        print(f"Processing shard {args.shard[0]}/{args.shard[1]}")
+
+    workers = {
+        "sfx": args.sfx_workers,
+        "parse": args.parse_workers,
+        "tts": args.tts_workers,
+        "mix": args.mix_workers,
+    }
+    stages = dict(STAGES)
+    # Segments are named after the TTS format when the story is parsed
+    stages["parse"] = functools.partial(parse_stage, tts_format=args.tts_format)
+    stages["tts"] = functools.partial(
+        tts_stage,
+        segment_workers=args.segment_workers,
+        measure_loudness=args.normalize,
+        tts_format=args.tts_format,
+        stream=args.stream_tts,
+        coalesce=args.coalesce_segments,
+    )
+
+    # Decode new or changed library assets once so mixing can memory-map them
+    asset_library.ingest()
+
+    mix_farm = None
+    if args.mix_processes > 0:
+        # Every mix process needs a pipeline thread waiting on it
+        mix_farm = MixFarm(args.mix_processes)
+        workers["mix"] = max(args.mix_workers, args.mix_processes)
+    stages["mix"] = functools.partial(
+        mix_stage,
+        backend=args.mix_backend,
+        stream=args.stream_mix,
+        exports=args.exports,
+        duck=args.duck,
+        normalize=args.normalize,
+        farm=mix_farm,
+        incremental=args.incremental_mix,
+    )
+    pipeline = StoryPipeline([(name, stages[name], workers[name]) for name, _ in STAGES])
+
+    manifest = JobManifest(args.manifest)
+    # Stories already mixed in an earlier run are skipped and do not count towards --n
+    finished_stories = manifest.finished_stories(args.language)
+    print(f"{len(finished_stories)} stories in {args.language} already finished")
 
-    selected_language_idx = language_indxe[args.language]
     n = 0
-    for json_file in os.listdir(story_path):
-        if not json_file.endswith(".json"):
-            continue
-        with open(f"{story_path}/{json_file}", "r") as f:
-            stories = json.load(f)
-            for story in stories:
-                if n >= args.n:
-                    break
-                try:
-                    title = story["title"]
-                    # only generate the English language for now
-                    language = story["translations"][selected_language_idx]["language"]
-                    story_text = story["translations"][selected_language_idx]["text"]
-                    out_dir = f"out/audios/{title.lower().replace(' ', '_')}_{language.lower()}"
-                    print(f"Generating audio for {title} in {language}")
-                    generate_audio(title, story_text, out_dir)
-                    n += 1
-                except Exception as e:
-                    print(f"Error generating audio for {title} in {language}: {e}")
 
+    def wait_for_slot(limit: int):
+        # Block until fewer than `limit` stories are in flight, counting finished ones
+        global n
+        n += sum(1 for f in pipeline.wait_for_slot(limit) if f.exception() is None)
+
+    if args.batch:
+        # Tag every selected story through the batch API first; the sfx stage then finds the results
+        batch_jobs = []
+        for title, language, story_text, out_dir in select_stories(args, finished_stories):
+            if len(batch_jobs) >= args.n:
+                break
+            if not StoryJob(title, story_text, out_dir, args.language, manifest).is_done("sfx", f"{out_dir}/sfx_output.json"):
+                batch_jobs.append(BatchJob(title, title, story_text, out_dir))
+        print(f"Generating openings and SFX for {len(batch_jobs)} stories in batch mode")
+        sfx = Sfx()
+        outputs = run_sfx_batch(
+            batch_jobs,
+            AzureBatchBackend(sfx.client),
+            os.getenv("AZURE_OPENAI_BATCH_DEPLOYMENT", sfx.deployment_name),
+            "out/batches",
+            poll_interval=args.batch_poll_interval
+        )
+        for job in batch_jobs:
+            if job.key in outputs:
+                manifest.finish(job.title, args.language, "sfx", hash_artifacts([f"{job.out_dir}/sfx_output.json"]))
+
+    for title, language, story_text, out_dir in select_stories(args, finished_stories):
+        # Only count stories that finished successfully towards --n
+        wait_for_slot(min(args.max_in_flight, args.n - n))
+        if n >= args.n:
+            break
+        print(f"Generating audio for {title} in {language}")
+        job = StoryJob(title, story_text, out_dir, args.language, manifest)
+        future = pipeline.submit(job)
+        future.add_done_callback(lambda f, job=job: report_result(job, f))
+
+    wait_for_slot(1)
+    pipeline.shutdown()
+    pipeline.log_stats()
+    if mix_farm is not None:
+        mix_farm.shutdown()
+        mix_farm.log_stats()
+    print(f"Progress: {json.dumps(manifest.progress(args.language))}")
+    manifest.close()
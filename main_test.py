@@ -0,0 +1,67 @@
+import importlib
+import os
+
+import pytest
+
+from fab_audio.manifest import JobManifest
+
+
+@pytest.fixture
+def main(tmp_path_factory, monkeypatch):
+    # main.py reads the sound database from data/ and creates the Azure OpenAI client when it is imported
+    root = tmp_path_factory.mktemp("library")
+    for folder in ["sfx", "bg_music", "misc"]:
+        os.makedirs(root / "data" / folder, exist_ok=True)
+    monkeypatch.chdir(root)
+    monkeypatch.setenv("AUDIO_AZURE_OPENAI_API_KEY", "key")
+    monkeypatch.setenv("AUDIO_AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+    return importlib.import_module("main")
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = JobManifest(str(tmp_path / "manifest.db"))
+    yield manifest
+    manifest.close()
+
+
+def story_job(main, tmp_path, manifest):
+    job = main.StoryJob("The Fox", "The fox ran.", str(tmp_path / "fox"), "en", manifest)
+    os.makedirs(job.out_dir)
+    job.parsed_sfx_dict = {
+        "audio_paths": [f"{job.out_dir}/0.mp3", "data/sfx/bark.mp3", f"{job.out_dir}/1.mp3"],
+        "mixing_instructions": ["story", "overlay", "story"],
+        "text_segments": ["The fox ran.", "It hid."],
+    }
+    return job
+
+
+def test_tts_stage_runs_again_for_deleted_segments(main, tmp_path, manifest, monkeypatch):
+    job = story_job(main, tmp_path, manifest)
+    synthesized = []
+    refreshed = []
+
+    def generate_story_audio(texts, out_dir, story_name, **kwargs):
+        refreshed.append(kwargs["refresh"])
+        paths = [f"{out_dir}/{i}.mp3" for i in range(len(texts))]
+        for path in paths:
+            if not os.path.exists(path):
+                synthesized.append(os.path.basename(path))
+                with open(path, "wb") as f:
+                    f.write(b"audio")
+        return paths
+
+    monkeypatch.setattr(main, "generate_story_audio", generate_story_audio)
+    main.tts_stage(job)
+    assert synthesized == ["0.mp3", "1.mp3"]
+    assert manifest.is_done("The Fox", "en", "tts")
+
+    # Done and on disk: skipped
+    main.tts_stage(job)
+    assert synthesized == ["0.mp3", "1.mp3"]
+
+    os.remove(f"{job.out_dir}/1.mp3")
+    main.tts_stage(job)
+    assert synthesized == ["0.mp3", "1.mp3", "1.mp3"]
+    # Only the deleted segment bypasses the TTS cache, which would return the same audio
+    assert refreshed == [set(), {1}]
@@ -5,7 +5,7 @@ import asyncio
 import base64
 import uuid
 from collections.abc import AsyncGenerator, AsyncIterator, Awaitable, Callable
-from typing import Literal, Optional, TypeGuard, Union
+from typing import BinaryIO, Literal, Optional, TypeGuard, Union
 
 from azure.core.credentials import AzureKeyCredential
 from azure.core.credentials_async import AsyncTokenCredential
@@ -284,6 +284,36 @@ class RTAudioContent:
                 # and that is a better signal to end the iteration
                 continue
 
+    async def save_to(self, path_or_file: Union[str, BinaryIO], samplerate: int = 24000) -> int:
+        """
+        Write the audio to a 16-bit mono WAV file as it streams in.
+
+        Every chunk from `audio_chunks()` is written and flushed as soon as it
+        arrives, so memory stays at one chunk and the file (header included) is
+        readable while the response is still being generated. The default
+        rate is the one of the realtime API's pcm16 output.
+
+        Returns:
+            Number of frames written
+        """
+        # soundfile is only needed by callers that save audio
+        import numpy as np
+        import soundfile as sf
+
+        frames = 0
+        remainder = b""
+        with sf.SoundFile(path_or_file, mode="w", samplerate=samplerate, channels=1, format="WAV", subtype="PCM_16") as out:
+            async for chunk in self.audio_chunks():
+                chunk = remainder + chunk
+                # A delta could end in the middle of a sample
+                usable = len(chunk) - len(chunk) % 2
+                remainder = chunk[usable:]
+                if usable:
+                    out.write(np.frombuffer(chunk[:usable], dtype=np.int16))
+                    out.flush()
+                    frames += usable // 2
+        return frames
+
     async def transcript_chunks(self) -> AsyncGenerator[str]:
         while True:
             message = await self.__content_queue.receive(
@@ -588,6 +618,9 @@ class RTClient:
 
         self._response_map: dict[str, str] = {}
 
+        # Serializes response.create / response.created pairs, so concurrent callers get their own response
+        self._response_lock = asyncio.Lock()
+
     @property
     def request_id(self) -> uuid.UUID | None:
         return self._client.request_id
@@ -692,16 +725,28 @@ class RTClient:
             raise RealtimeException(message.error)
         assert message.type == "conversation.item.deleted"
 
-    async def generate_response(self) -> RTResponse:
-        await self._client.send(ResponseCreateMessage())
-        message = await self._message_queue.receive(lambda m: m.type == "response.created")
+    async def generate_response(self, params: Optional[ResponseCreateParams] = None) -> RTResponse:
+        # The server doesn't echo an id from response.create in response.created, but it answers
+        # in order, so with one create in flight at a time the next created message is ours.
+        # Pass ResponseCreateParams(cancel_previous=False) to queue a response behind one
+        # that is still streaming.
+        async with self._response_lock:
+            await self._client.send(ResponseCreateMessage() if params is None else ResponseCreateMessage(response=params))
+            message = await self._message_queue.receive(lambda m: m.type == "response.created")
         if message.type == "error":
             raise RealtimeException(message.error)
         assert message.type == "response.created"
-        # TODO: Need to verify if there is a way to correlate  the response.create message with the
-        # response.created message
         return RTResponse(message.response, self._message_queue, self._client)
 
+    def latest_rate_limits(self) -> Optional[list[RateLimits]]:
+        """Pop any queued `rate_limits.updated` messages and return the most recent limits."""
+        latest = None
+        while True:
+            message = self._message_queue._find_and_remove(lambda m: m.type == "rate_limits.updated")
+            if message is None:
+                return latest
+            latest = message.rate_limits
+
     async def events(self) -> AsyncGenerator[RTInputAudioItem | RTResponse]:
         # TODO: Add the updated quota message as a control type of event.
         while True:
@@ -730,6 +775,14 @@ class RTClient:
             raise RealtimeException(message.error)
         self.session = message.session
 
+    async def ping(self):
+        """Send a websocket ping; raises if the connection is gone."""
+        await self._client.ping()
+
+    @property
+    def closed(self) -> bool:
+        return self._client.closed
+
     async def close(self):
         await self._client.close()
 
@@ -0,0 +1,78 @@
+import asyncio
+import base64
+import io
+
+import numpy as np
+import soundfile as sf
+
+from rtclient import RTAudioContent
+from rtclient.models import (
+    ResponseAudioDeltaMessage,
+    ResponseContentPartAddedMessage,
+    ResponseContentPartDoneMessage,
+    ResponseItemAudioContentPart,
+)
+from rtclient.util.message_queue import MessageQueueWithError
+
+IDS = {"response_id": "resp_1", "item_id": "item_1", "output_index": 0, "content_index": 0}
+
+
+def test_save_to_streams_chunks_to_wav(tmp_path):
+    samples = (np.sin(np.arange(4800) / 10) * 10000).astype(np.int16)
+    data = samples.tobytes()
+    # Deltas don't have to end on a sample boundary
+    chunks = [data[:1001], data[1001:5000], data[5000:]]
+    path = tmp_path / "0.wav"
+    sizes = []
+
+    async def main():
+        messages = [
+            ResponseAudioDeltaMessage(event_id=f"event_{i}", delta=base64.b64encode(chunk).decode(), **IDS)
+            for i, chunk in enumerate(chunks)
+        ]
+        messages.append(
+            ResponseContentPartDoneMessage(event_id="event_done", part=ResponseItemAudioContentPart(transcript="hi"), **IDS)
+        )
+
+        async def receive():
+            if len(messages) < len(chunks) + 1:
+                # Each chunk is on disk before the next one arrives
+                sizes.append(len(sf.read(str(path), dtype="int16")[0]))
+            return messages.pop(0) if messages else None
+
+        queue = MessageQueueWithError(receive, lambda m: m.type == "error")
+        added = ResponseContentPartAddedMessage(
+            event_id="event_added", part=ResponseItemAudioContentPart(transcript=None), **IDS
+        )
+        return await RTAudioContent(added, queue).save_to(str(path))
+
+    frames = asyncio.run(main())
+
+    assert frames == len(samples)
+    assert sizes == [500, 2500, 4800]
+    written, rate = sf.read(str(path), dtype="int16")
+    assert rate == 24000
+    assert np.array_equal(written, samples)
+
+
+def test_save_to_file_object():
+    samples = np.arange(-100, 100, dtype=np.int16)
+
+    async def main(out):
+        messages = [
+            ResponseAudioDeltaMessage(event_id="event_0", delta=base64.b64encode(samples.tobytes()).decode(), **IDS),
+            ResponseContentPartDoneMessage(event_id="event_1", part=ResponseItemAudioContentPart(transcript=""), **IDS),
+        ]
+
+        async def receive():
+            return messages.pop(0) if messages else None
+
+        added = ResponseContentPartAddedMessage(
+            event_id="event_added", part=ResponseItemAudioContentPart(transcript=None), **IDS
+        )
+        return await RTAudioContent(added, MessageQueueWithError(receive, lambda m: m.type == "error")).save_to(out)
+
+    out = io.BytesIO()
+    assert asyncio.run(main(out)) == len(samples)
+    out.seek(0)
+    assert np.array_equal(sf.read(out, dtype="int16")[0], samples)
@@ -124,6 +124,9 @@ class RTLowLevelClient:
             raise StopAsyncIteration
         return message
 
+    async def ping(self):
+        await self.ws.ping()
+
     async def close(self):
         await self.ws.close()
         await self._session.close()